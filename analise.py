@@ -0,0 +1,192 @@
+"""Agregados do Dashboard mantidos por gatilhos (estudos por mês, tags, armazenamento por cliente e tipo).
+
+Cada escrita em estudos/anexos ajusta só os buckets afetados; o Dashboard lê essas tabelas
+pequenas em vez de agrupar `anexos` (com o file_data) a cada renderização.
+
+    python analise.py reconstruir     # recalcula tudo e informa quantos buckets divergiam
+"""
+import sys
+
+import armazenamento
+
+
+# json_each das tags 'a, b' (separadas por vírgula) da coluna; texto inválido vira lista vazia. Também usado
+# pelas operações em lote de core.py para reescrever as tags em SQL
+def tags_json(coluna):
+    bruto = f"""'["' || replace(replace(replace(COALESCE({coluna}, ''), '\\', '\\\\'), '"', '\\"'), ',', '","') || '"]'"""
+    return f"json_each(CASE WHEN json_valid({bruto}) THEN {bruto} ELSE '[]' END)"
+
+
+def _tags(coluna):
+    return f"SELECT DISTINCT lower(trim(value)) AS tag FROM {tags_json(coluna)} WHERE trim(value) <> ''"
+
+
+def _mes(coluna):
+    return f"COALESCE(strftime('%Y-%m', {coluna}), '?')"
+
+
+def _tipo(coluna):
+    return f"COALESCE(NULLIF(lower(trim({coluna})), ''), 'desconhecido')"
+
+
+def _cliente_do_estudo(coluna):
+    return f"COALESCE((SELECT cliente_id FROM estudos WHERE id={coluna}), 0)"
+
+
+def _estudo(sinal, r):
+    """Comandos que somam (+1) ou subtraem (-1) o estudo `r` (new/old) dos agregados."""
+    if sinal > 0:
+        return f"""
+        INSERT INTO agg_estudos_mes (cliente_id, mes, estudos) VALUES ({r}.cliente_id, {_mes(f'{r}.created_at')}, 1)
+            ON CONFLICT(cliente_id, mes) DO UPDATE SET estudos=estudos+1;
+        INSERT INTO agg_tags (tag, estudos) SELECT tag, 1 FROM ({_tags(f'{r}.tags')}) WHERE 1
+            ON CONFLICT(tag) DO UPDATE SET estudos=estudos+1;"""
+    return f"""
+        UPDATE agg_estudos_mes SET estudos=estudos-1 WHERE cliente_id={r}.cliente_id AND mes={_mes(f'{r}.created_at')};
+        DELETE FROM agg_estudos_mes WHERE cliente_id={r}.cliente_id AND mes={_mes(f'{r}.created_at')} AND estudos<=0;
+        UPDATE agg_tags SET estudos=estudos-1 WHERE tag IN ({_tags(f'{r}.tags')});
+        DELETE FROM agg_tags WHERE tag IN ({_tags(f'{r}.tags')}) AND estudos<=0;"""
+
+
+def _anexo(sinal, r):
+    valores = f"{sinal}, {sinal} * COALESCE({r}.file_size, 0), {sinal} * {armazenamento.bytes_armazenados(r)}"
+    comandos = ""
+    for tabela, chave, expr in (
+        ("agg_anexos_cliente", "cliente_id", _cliente_do_estudo(f"{r}.estudo_id")),
+        ("agg_anexos_tipo", "tipo", _tipo(f"{r}.file_type")),
+    ):
+        comandos += f"""
+        INSERT INTO {tabela} ({chave}, anexos, bytes_originais, bytes_armazenados) VALUES ({expr}, {valores})
+            ON CONFLICT({chave}) DO UPDATE SET anexos=anexos+excluded.anexos,
+                bytes_originais=bytes_originais+excluded.bytes_originais,
+                bytes_armazenados=bytes_armazenados+excluded.bytes_armazenados;
+        DELETE FROM {tabela} WHERE {chave}={expr} AND anexos<=0;"""
+    return comandos
+
+
+def _anexos_do_estudo(sinal, cliente):
+    """Soma (+1) ou subtrai (-1) os anexos do estudo `new` no total do cliente `cliente`."""
+    return f"""
+        INSERT INTO agg_anexos_cliente (cliente_id, anexos, bytes_originais, bytes_armazenados)
+            SELECT {cliente}, {sinal} * COUNT(*), {sinal} * SUM(COALESCE(file_size, 0)),
+                   {sinal} * SUM({armazenamento.bytes_armazenados('anexos')})
+            FROM anexos WHERE estudo_id=new.id HAVING COUNT(*) > 0
+            ON CONFLICT(cliente_id) DO UPDATE SET anexos=anexos+excluded.anexos,
+                bytes_originais=bytes_originais+excluded.bytes_originais,
+                bytes_armazenados=bytes_armazenados+excluded.bytes_armazenados;
+        DELETE FROM agg_anexos_cliente WHERE cliente_id={cliente} AND anexos<=0;"""
+
+
+TABELAS = {
+    "agg_estudos_mes": """CREATE TABLE IF NOT EXISTS agg_estudos_mes (
+        cliente_id INTEGER NOT NULL,
+        mes TEXT NOT NULL,
+        estudos INTEGER NOT NULL,
+        PRIMARY KEY (cliente_id, mes)
+    ) WITHOUT ROWID""",
+    "agg_tags": """CREATE TABLE IF NOT EXISTS agg_tags (
+        tag TEXT PRIMARY KEY,
+        estudos INTEGER NOT NULL
+    ) WITHOUT ROWID""",
+    "agg_anexos_cliente": """CREATE TABLE IF NOT EXISTS agg_anexos_cliente (
+        cliente_id INTEGER PRIMARY KEY,
+        anexos INTEGER NOT NULL,
+        bytes_originais INTEGER NOT NULL,
+        bytes_armazenados INTEGER NOT NULL
+    )""",
+    "agg_anexos_tipo": """CREATE TABLE IF NOT EXISTS agg_anexos_tipo (
+        tipo TEXT PRIMARY KEY,
+        anexos INTEGER NOT NULL,
+        bytes_originais INTEGER NOT NULL,
+        bytes_armazenados INTEGER NOT NULL
+    ) WITHOUT ROWID""",
+}
+
+GATILHOS = [
+    f"CREATE TRIGGER IF NOT EXISTS agg_estudos_ai AFTER INSERT ON estudos BEGIN {_estudo(1, 'new')} END",
+    f"CREATE TRIGGER IF NOT EXISTS agg_estudos_ad AFTER DELETE ON estudos BEGIN {_estudo(-1, 'old')} END",
+    f"""CREATE TRIGGER IF NOT EXISTS agg_estudos_au AFTER UPDATE OF cliente_id, tags, created_at ON estudos BEGIN
+        {_estudo(-1, 'old')} {_estudo(1, 'new')} END""",
+    # estudo movido para outro cliente (operações em lote) leva junto o armazenamento dos anexos
+    f"""CREATE TRIGGER IF NOT EXISTS agg_estudos_cliente_au AFTER UPDATE OF cliente_id ON estudos
+        WHEN old.cliente_id IS NOT new.cliente_id BEGIN
+        {_anexos_do_estudo(-1, 'old.cliente_id')} {_anexos_do_estudo(1, 'new.cliente_id')} END""",
+    f"CREATE TRIGGER IF NOT EXISTS agg_anexos_ai AFTER INSERT ON anexos BEGIN {_anexo(1, 'new')} END",
+    f"CREATE TRIGGER IF NOT EXISTS agg_anexos_ad AFTER DELETE ON anexos BEGIN {_anexo(-1, 'old')} END",
+    f"""CREATE TRIGGER IF NOT EXISTS agg_anexos_au AFTER UPDATE OF estudo_id, file_type, file_size, file_data, pacote_tam ON anexos BEGIN
+        {_anexo(-1, 'old')} {_anexo(1, 'new')} END""",
+]
+
+
+def init_agregados(conn):
+    """Cria tabelas e gatilhos; um banco que já tinha dados é agregado uma vez com GROUP BY."""
+    c = conn.cursor()
+    novo = not c.execute("SELECT 1 FROM sqlite_master WHERE name='agg_estudos_mes'").fetchone()
+    for sql in TABELAS.values():
+        c.execute(sql)
+    trocados = [armazenamento.criar_gatilho(c, sql) for sql in GATILHOS]
+    # gatilhos de outra versão podem ter somado com outra fórmula: recalcula uma vez com a atual
+    if novo or any(trocados):
+        reconstruir(conn)
+
+
+def _instantaneo(c):
+    r = {}
+    for tabela in TABELAS:
+        for linha in c.execute(f"SELECT * FROM {tabela}"):
+            linha = tuple(linha)
+            chave = linha[:2] if tabela == "agg_estudos_mes" else linha[:1]
+            r[(tabela, chave)] = linha
+    return r
+
+
+def reconstruir(conn):
+    """Recalcula os agregados a partir das tabelas de origem; retorna quantos buckets estavam divergentes."""
+    c = conn.cursor()
+    antes = _instantaneo(c)
+    for tabela in TABELAS:
+        c.execute(f"DELETE FROM {tabela}")
+    c.execute(f"""INSERT INTO agg_estudos_mes (cliente_id, mes, estudos)
+                  SELECT cliente_id, {_mes('created_at')}, COUNT(*) FROM estudos GROUP BY 1, 2""")
+    c.execute(f"""INSERT INTO agg_tags (tag, estudos)
+                  SELECT lower(trim(j.value)), COUNT(DISTINCT e.id) FROM estudos e, {tags_json('e.tags')} j
+                  WHERE trim(j.value) <> '' GROUP BY 1""")
+    for tabela, chave, expr in (
+        ("agg_anexos_cliente", "cliente_id", "COALESCE(e.cliente_id, 0)"),
+        ("agg_anexos_tipo", "tipo", _tipo("a.file_type")),
+    ):
+        # o tamanho armazenado sai do cabeçalho do registro (ver armazenamento.bytes_armazenados); calculado
+        # antes do GROUP BY, que de outro modo copiaria o file_data inteiro para o sorter
+        c.execute(f"""WITH t AS MATERIALIZED (
+                          SELECT {expr} AS chave, a.file_size, {armazenamento.bytes_armazenados('a')} AS armazenado
+                          FROM anexos a LEFT JOIN estudos e ON e.id=a.estudo_id)
+                      INSERT INTO {tabela} ({chave}, anexos, bytes_originais, bytes_armazenados)
+                      SELECT chave, COUNT(*), SUM(COALESCE(file_size, 0)), SUM(armazenado) FROM t GROUP BY 1""")
+    depois = _instantaneo(c)
+    return sum(antes.get(k) != depois.get(k) for k in antes.keys() | depois.keys())
+
+
+def ler(conn, desde_mes="0000-00"):
+    c = conn.cursor()
+    return {
+        "estudos_mes": [dict(r) for r in c.execute(
+            "SELECT cliente_id, mes, estudos FROM agg_estudos_mes WHERE mes >= ?", (desde_mes,)
+        )],
+        "tags": [dict(r) for r in c.execute("SELECT tag, estudos FROM agg_tags")],
+        "anexos_cliente": [dict(r) for r in c.execute("SELECT * FROM agg_anexos_cliente")],
+        "anexos_tipo": [dict(r) for r in c.execute("SELECT * FROM agg_anexos_tipo")],
+    }
+
+
+def main():
+    import core
+
+    if len(sys.argv) < 2 or sys.argv[1] != "reconstruir":
+        print(__doc__)
+        return
+    core.init_db()
+    print(f"✅ Agregados reconstruídos; {core.reconstruir_agregados()} bucket(s) estavam divergentes")
+
+
+if __name__ == "__main__":
+    main()
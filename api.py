@@ -0,0 +1,336 @@
+"""API HTTP assíncrona (somente leitura) sobre a biblioteca, sem Streamlit.
+
+    python api.py --host 0.0.0.0 --porta 8600 --workers 8
+
+Listas aceitam ?limite=&offset= e devolvem {"itens", "limite", "offset", "proximo"}.
+
+    GET /clientes[?q=nome-ou-cnpj]     GET /clientes/{id}      GET /clientes/{id}/estudos
+    GET /clientes/{id}/dossie (zip com estudos e anexos, gerado ou reaproveitado do cache)
+    GET /estudos                       GET /estudos/{id}       GET /estudos/{id}/anexos
+    GET /busca?q=termo                 GET /anexos/{id}        GET /anexos/{id}/conteudo
+
+O conteúdo dos anexos sai em blocos, com ETag (sha256), If-None-Match e Range de um intervalo.
+Todo acesso ao SQLite roda num pool de threads; o laço de eventos só move bytes.
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, quote, urlencode, urlsplit
+
+import core
+
+BLOCO = 256 * 1024
+LIMITE_PADRAO = 50
+LIMITE_MAX = 500
+
+MOTIVOS = {
+    200: "OK", 206: "Partial Content", 304: "Not Modified", 400: "Bad Request", 404: "Not Found",
+    405: "Method Not Allowed", 416: "Range Not Satisfiable", 500: "Internal Server Error",
+}
+
+
+class ErroHTTP(Exception):
+    def __init__(self, status, mensagem, cabecalhos=None):
+        super().__init__(mensagem)
+        self.status = status
+        self.cabecalhos = cabecalhos or {}
+
+
+class Requisicao:
+    def __init__(self, metodo, alvo, cabecalhos):
+        partes = urlsplit(alvo)
+        self.metodo = metodo
+        self.caminho = partes.path.rstrip("/") or "/"
+        self.query = {k: v[-1] for k, v in parse_qs(partes.query).items()}
+        self.cabecalhos = cabecalhos
+
+    def inteiro(self, nome, padrao, minimo=0, maximo=None):
+        try:
+            v = int(self.query.get(nome, padrao))
+        except ValueError:
+            raise ErroHTTP(400, f"'{nome}' deve ser inteiro")
+        v = max(minimo, v)
+        return min(v, maximo) if maximo is not None else v
+
+    def pagina(self):
+        return self.inteiro("limite", LIMITE_PADRAO, 1, LIMITE_MAX), self.inteiro("offset", 0)
+
+
+def intervalo(cabecalho, tamanho):
+    """'bytes=a-b' -> (inicio, fim inclusivo); None quando ausente ou com vários intervalos."""
+    m = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", cabecalho or "")
+    if not m or not (m.group(1) or m.group(2)):
+        return None
+    if m.group(1):
+        inicio = int(m.group(1))
+        fim = min(int(m.group(2)), tamanho - 1) if m.group(2) else tamanho - 1
+    else:
+        inicio, fim = max(0, tamanho - int(m.group(2))), tamanho - 1
+    if inicio >= tamanho or fim < inicio:
+        raise ErroHTTP(416, "Intervalo inválido", {"Content-Range": f"bytes */{tamanho}"})
+    return inicio, fim
+
+
+class Servidor:
+    def __init__(self, workers=8):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api-db")
+        self.rotas = [
+            (r"/clientes", self.clientes),
+            (r"/clientes/(\d+)", self.cliente),
+            (r"/clientes/(\d+)/estudos", self.estudos_do_cliente),
+            (r"/clientes/(\d+)/dossie", self.dossie),
+            (r"/estudos", self.estudos),
+            (r"/estudos/(\d+)", self.estudo),
+            (r"/estudos/(\d+)/anexos", self.anexos_do_estudo),
+            (r"/busca", self.busca),
+            (r"/anexos/(\d+)", self.anexo),
+            (r"/anexos/(\d+)/conteudo", self.conteudo),
+        ]
+        self.rotas = [(re.compile(p), h) for p, h in self.rotas]
+        self.respondendo = set()  # conexões cuja resposta atual já teve a linha de status enviada
+
+    async def db(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.pool, func, *args)
+
+    # ---------- protocolo ----------
+    async def conexao(self, reader, writer):
+        try:
+            while True:
+                linha = await reader.readline()
+                if not linha:
+                    break
+                try:
+                    metodo, alvo, versao = linha.decode("latin-1").split()
+                except ValueError:
+                    await self.enviar(writer, 400, {"erro": "Requisição malformada"}, manter=False)
+                    break
+                cabecalhos = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    k, _, v = h.decode("latin-1").partition(":")
+                    cabecalhos[k.strip().lower()] = v.strip()
+                comprimento = cabecalhos.get("content-length") or "0"
+                if not comprimento.isdigit():
+                    await self.enviar(writer, 400, {"erro": "Content-Length inválido"}, manter=False)
+                    break
+                if int(comprimento):
+                    await reader.readexactly(int(comprimento))
+                conexao = cabecalhos.get("connection", "").lower()
+                manter = conexao == "keep-alive" if versao == "HTTP/1.0" else conexao != "close"
+                manter = await self.responder(Requisicao(metodo, alvo, cabecalhos), writer, manter)
+                if not manter:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.respondendo.discard(writer)
+            writer.close()
+
+    async def responder(self, req, writer, manter):
+        self.respondendo.discard(writer)
+        try:
+            if req.metodo not in ("GET", "HEAD"):
+                raise ErroHTTP(405, "Somente GET/HEAD", {"Allow": "GET, HEAD"})
+            for padrao, handler in self.rotas:
+                m = padrao.fullmatch(req.caminho)
+                if m:
+                    return await handler(req, writer, manter, *(int(g) for g in m.groups()))
+            raise ErroHTTP(404, "Rota não encontrada")
+        except Exception as e:
+            if writer in self.respondendo:
+                # a resposta já começou: um segundo status corromperia o fluxo, só resta fechar
+                return False
+            if isinstance(e, ErroHTTP):
+                return await self.enviar(writer, e.status, {"erro": str(e)}, manter, e.cabecalhos,
+                                         req.metodo == "HEAD")
+            await self.enviar(writer, 500, {"erro": str(e)}, False, head=req.metodo == "HEAD")
+            return False
+
+    async def enviar(self, writer, status, corpo, manter, cabecalhos=None, head=False):
+        dados = b"" if corpo is None else json.dumps(corpo, ensure_ascii=False, default=str).encode()
+        h = {"Content-Type": "application/json; charset=utf-8", "Content-Length": str(len(dados))}
+        h.update(cabecalhos or {})
+        self.cabecalho(writer, status, h, manter)
+        if not head:
+            writer.write(dados)
+        await writer.drain()
+        return manter
+
+    def cabecalho(self, writer, status, cabecalhos, manter):
+        self.respondendo.add(writer)
+        linhas = [f"HTTP/1.1 {status} {MOTIVOS.get(status, '')}"]
+        linhas += [f"{k}: {v}" for k, v in cabecalhos.items()]
+        linhas.append(f"Connection: {'keep-alive' if manter else 'close'}")
+        writer.write(("\r\n".join(linhas) + "\r\n\r\n").encode("latin-1"))
+
+    async def lista(self, req, writer, manter, func, *args):
+        limite, offset = req.pagina()
+        # um item a mais indica se existe próxima página sem precisar de COUNT(*)
+        itens = [dict(r) for r in await self.db(func, *args, limite + 1, offset)]
+        proximo = None
+        if len(itens) > limite:
+            itens = itens[:limite]
+            proximo = f"{req.caminho}?{urlencode({**req.query, 'limite': limite, 'offset': offset + limite})}"
+        corpo = {"itens": itens, "limite": limite, "offset": offset, "proximo": proximo}
+        return await self.enviar(writer, 200, corpo, manter, head=req.metodo == "HEAD")
+
+    async def objeto(self, req, writer, manter, func, *args):
+        r = await self.db(func, *args)
+        if not r:
+            raise ErroHTTP(404, "Não encontrado")
+        return await self.enviar(writer, 200, dict(r), manter, head=req.metodo == "HEAD")
+
+    # ---------- rotas ----------
+    async def clientes(self, req, writer, manter):
+        q = req.query.get("q")
+        if q:
+            return await self.lista(req, writer, manter, core.buscar_clientes, q)
+        return await self.lista(req, writer, manter, core.listar_clientes)
+
+    async def cliente(self, req, writer, manter, cid):
+        return await self.objeto(req, writer, manter, core.obter_cliente, cid)
+
+    async def estudos_do_cliente(self, req, writer, manter, cid):
+        if not await self.db(core.obter_cliente, cid):
+            raise ErroHTTP(404, "Cliente não encontrado")
+        return await self.lista(req, writer, manter, core.listar_estudos, cid)
+
+    async def dossie(self, req, writer, manter, cid):
+        cliente = await self.db(core.obter_cliente, cid)
+        if not cliente:
+            raise ErroHTTP(404, "Cliente não encontrado")
+        # aberto já na mesma chamada que acha o arquivo: uma geração mais nova apaga o anterior
+        caminho, f = await self.db(core.abrir_dossie, cid)
+        try:
+            # o nome do arquivo em cache já é a versão do cliente: serve de ETag
+            etag = f'"{caminho.stem}"'
+            if etag in [t.strip() for t in req.cabecalhos.get("if-none-match", "").split(",")]:
+                self.cabecalho(writer, 304, {"ETag": etag, "Content-Length": "0"}, manter)
+                await writer.drain()
+                return manter
+            tamanho = await self.db(lambda: os.fstat(f.fileno()).st_size)
+            self.cabecalho(writer, 200, {
+                "Content-Type": "application/zip",
+                "Content-Disposition": f"attachment; filename*=UTF-8''{quote('dossie - ' + cliente['nome'] + '.zip')}",
+                "Content-Length": str(tamanho),
+                "ETag": etag,
+                "Cache-Control": "private, max-age=0, must-revalidate",
+            }, manter)
+            if req.metodo != "HEAD":
+                while b := await self.db(f.read, BLOCO):
+                    writer.write(b)
+                    await writer.drain()
+            await writer.drain()
+        finally:
+            await self.db(f.close)
+        return manter
+
+    async def estudos(self, req, writer, manter):
+        return await self.lista(req, writer, manter, core.listar_estudos, None)
+
+    async def estudo(self, req, writer, manter, eid):
+        est = await self.db(core.obter_estudo, eid)
+        if not est:
+            raise ErroHTTP(404, "Estudo não encontrado")
+        corpo = dict(est)
+        corpo["anexos"] = [dict(a) for a in await self.db(core.listar_anexos, eid)]
+        return await self.enviar(writer, 200, corpo, manter, head=req.metodo == "HEAD")
+
+    async def anexos_do_estudo(self, req, writer, manter, eid):
+        if not await self.db(core.obter_estudo, eid):
+            raise ErroHTTP(404, "Estudo não encontrado")
+        return await self.lista(req, writer, manter, core.listar_anexos, eid)
+
+    async def busca(self, req, writer, manter):
+        termo = req.query.get("q", "").strip()
+        if not termo:
+            raise ErroHTTP(400, "Informe ?q=")
+
+        def pagina(limite, offset):
+            return core.buscar_estudos(termo, core.versao_db(), offset + limite)[offset:]
+
+        return await self.lista(req, writer, manter, pagina)
+
+    async def anexo(self, req, writer, manter, aid):
+        return await self.objeto(req, writer, manter, core.obter_anexo_info, aid)
+
+    async def conteudo(self, req, writer, manter, aid):
+        info = await self.db(core.obter_anexo_info, aid)
+        if not info:
+            raise ErroHTTP(404, "Anexo não encontrado")
+        # o ETag não conta como leitura: só o corpo enviado abaixo conta
+        etag = f'"{await self.db(core.hash_anexo, aid, False)}"'
+        # o tamanho sai do valor armazenado: um file_size gravado errado não chega ao Content-Length
+        tamanho = await self.db(core.tamanho_anexo, aid)
+        if tamanho is None:
+            raise ErroHTTP(404, "Anexo não encontrado")
+        cab = {
+            "Content-Type": info["file_type"] or "application/octet-stream",
+            "Content-Disposition": f"attachment; filename*=UTF-8''{quote(info['filename'])}",
+            "Accept-Ranges": "bytes",
+            "ETag": etag,
+            "Cache-Control": "private, max-age=0, must-revalidate",
+        }
+        if etag in [t.strip() for t in req.cabecalhos.get("if-none-match", "").split(",")]:
+            self.cabecalho(writer, 304, {"ETag": etag, "Content-Length": "0"}, manter)
+            await writer.drain()
+            return manter
+
+        faixa = None
+        if req.cabecalhos.get("if-range", etag) == etag:
+            faixa = intervalo(req.cabecalhos.get("range"), tamanho)
+        status, inicio, fim = 200, 0, tamanho - 1
+        if faixa:
+            status, (inicio, fim) = 206, faixa
+            cab["Content-Range"] = f"bytes {inicio}-{fim}/{tamanho}"
+        cab["Content-Length"] = str(fim - inicio + 1)
+        self.cabecalho(writer, status, cab, manter)
+        if req.metodo == "HEAD":
+            await writer.drain()
+            return manter
+
+        blocos = core.iterar_anexo(aid, BLOCO, inicio, fim + 1)
+        enviados = 0
+        try:
+            while True:
+                b = await self.db(next, blocos, None)
+                if b is None:
+                    break
+                enviados += len(b)
+                writer.write(b)
+                await writer.drain()
+        finally:
+            await self.db(blocos.close)
+        # conteúdo mudou (ou encolheu) no meio do envio: o cliente só percebe se a conexão fechar
+        return manter and enviados == fim - inicio + 1
+
+
+async def servir(host, porta, workers):
+    await asyncio.get_running_loop().run_in_executor(None, core.init_db)
+    srv = Servidor(workers)
+    server = await asyncio.start_server(srv.conexao, host, porta)
+    banco = core.SHARDS.diretorio if core.SHARDS.ativo() else core.DB_PATH
+    print(f"API da biblioteca em http://{host}:{porta} (banco: {banco})")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--porta", type=int, default=8600)
+    ap.add_argument("--workers", type=int, default=8, help="threads para acesso ao SQLite")
+    args = ap.parse_args()
+    try:
+        asyncio.run(servir(args.host, args.porta, args.workers))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
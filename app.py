@@ -1,11 +1,34 @@
 import streamlit as st
-import sqlite3
+import base64
 from datetime import datetime
 from pathlib import Path
-import base64
-import json
-import zipfile
-import io
+import os
+import time
+from contextlib import contextmanager
+
+import armazenamento
+import dossie
+import jobs
+import memoria
+import replicacao
+from core import (
+    SHARDS, JOBS_DIR, JOBS_DB_PATH,
+    init_db, arquivos_banco, relatorio_armazenamento, obter_config, salvar_config, versao_db, fmt_bytes,
+    criar_cliente, buscar_clientes, obter_cliente, excluir_cliente,
+    criar_estudo, listar_estudos, obter_estudo, atualizar_estudo, excluir_estudo, buscar_estudos,
+    excluir_estudos, mover_estudos, alterar_tags_estudos,
+    listar_anexos, ler_anexo, registrar_leitura, excluir_anexo, previa_anexo, stats,
+    job_backup, job_restaurar, job_upload, job_comprimir_anexos, job_compactar, job_verificar_integridade,
+    REPLICACAO_DIR, alteracoes_pendentes, eh_replica, job_exportar_alteracoes,
+    agregados, job_reconstruir_agregados,
+    FRIO_DIR, job_arquivar_anexos,
+    dossie_em_cache, abrir_dossie, job_exportar_dossie,
+)
+
+try:
+    from st_keyup import st_keyup
+except ImportError:  # sem o componente a busca roda ao confirmar o texto (Enter)
+    st_keyup = None
 
 # ==================== CONFIGURAÇÃO ====================
 st.set_page_config(
@@ -14,10 +37,25 @@ st.set_page_config(
     layout="wide",
     initial_sidebar_state="expanded"
 )
+INICIO_EXECUCAO = time.perf_counter()
+
+@st.cache_resource
+def banco():
+    # criação/migração do schema uma vez por processo, não a cada rerun
+    init_db()
+
+banco()
 
-DATA_DIR = Path("data")
-DATA_DIR.mkdir(exist_ok=True)
-DB_PATH = DATA_DIR / "biblioteca.db"
+@st.cache_resource
+def perfil_memoria():
+    # tracemalloc vale para o processo inteiro: ligado uma vez, não a cada rerun
+    memoria.configurar(
+        int(os.environ.get("BIBLIOTECA_MEMORIA") or obter_config("memoria_perfil", 0)),
+        os.environ.get("BIBLIOTECA_MEMORIA_ORCAMENTO_MB") or obter_config("memoria_orcamento_mb", 0),
+    )
+
+perfil_memoria()
+MEMORIA_EXECUCAO = memoria.abrir(raiz=True)
 
 # ==================== CSS ====================
 st.markdown("""
@@ -130,225 +168,100 @@ header {visibility: hidden;}
 </style>
 """, unsafe_allow_html=True)
 
-# ==================== DATABASE ====================
-def get_conn():
-    conn = sqlite3.connect(str(DB_PATH), check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def init_db():
-    """Mantém compatibilidade com banco antigo (tabelas extras podem existir)."""
-    conn = get_conn()
-    c = conn.cursor()
-
-    c.execute("""CREATE TABLE IF NOT EXISTS clientes (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        nome TEXT NOT NULL,
-        cnpj TEXT,
-        observacoes TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )""")
-
-    c.execute("""CREATE TABLE IF NOT EXISTS estudos (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        cliente_id INTEGER NOT NULL,
-        titulo TEXT NOT NULL,
-        resumo TEXT NOT NULL,
-        tags TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )""")
-
-    c.execute("""CREATE TABLE IF NOT EXISTS anexos (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        estudo_id INTEGER NOT NULL,
-        filename TEXT NOT NULL,
-        file_type TEXT NOT NULL,
-        file_data TEXT NOT NULL,
-        file_size INTEGER,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )""")
-
-    conn.commit()
-    conn.close()
-
-init_db()
-
-# ==================== CRUD ====================
-def criar_cliente(nome, cnpj=None, obs=None):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("INSERT INTO clientes (nome, cnpj, observacoes) VALUES (?, ?, ?)", (nome, cnpj, obs))
-    conn.commit()
-    cid = c.lastrowid
-    conn.close()
-    return cid
-
-def listar_clientes():
-    conn = get_conn()
-    r = list(conn.cursor().execute("SELECT * FROM clientes ORDER BY nome").fetchall())
-    conn.close()
-    return r
-
-def obter_cliente(cid):
-    conn = get_conn()
-    r = conn.cursor().execute("SELECT * FROM clientes WHERE id=?", (cid,)).fetchone()
-    conn.close()
-    return r
-
-def excluir_cliente(cid):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("DELETE FROM anexos WHERE estudo_id IN (SELECT id FROM estudos WHERE cliente_id=?)", (cid,))
-    c.execute("DELETE FROM estudos WHERE cliente_id=?", (cid,))
-    c.execute("DELETE FROM clientes WHERE id=?", (cid,))
-    conn.commit()
-    conn.close()
-
-def criar_estudo(cid, titulo, resumo, tags=None):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("INSERT INTO estudos (cliente_id, titulo, resumo, tags) VALUES (?, ?, ?, ?)", (cid, titulo, resumo, tags))
-    conn.commit()
-    eid = c.lastrowid
-    conn.close()
-    return eid
-
-def listar_estudos(cid=None):
-    conn = get_conn()
-    if cid:
-        r = list(conn.cursor().execute(
-            "SELECT * FROM estudos WHERE cliente_id=? ORDER BY created_at DESC", (cid,)
-        ).fetchall())
-    else:
-        r = list(conn.cursor().execute(
-            "SELECT e.*, c.nome as cliente FROM estudos e JOIN clientes c ON e.cliente_id=c.id ORDER BY e.created_at DESC"
-        ).fetchall())
-    conn.close()
-    return r
-
-def obter_estudo(eid):
-    conn = get_conn()
-    r = conn.cursor().execute("SELECT * FROM estudos WHERE id=?", (eid,)).fetchone()
-    conn.close()
-    return r
-
-def atualizar_estudo(eid, titulo, resumo, tags):
-    conn = get_conn()
-    conn.cursor().execute(
-        "UPDATE estudos SET titulo=?, resumo=?, tags=?, updated_at=CURRENT_TIMESTAMP WHERE id=?",
-        (titulo, resumo, tags, eid)
+# ==================== TAREFAS EM SEGUNDO PLANO ====================
+@st.cache_resource
+def job_runner():
+    return jobs.JobRunner(
+        JOBS_DB_PATH, JOBS_DIR,
+        max_pesados=int(os.environ.get("BIBLIOTECA_JOBS_PESADOS") or obter_config("jobs_pesados", 2))
     )
-    conn.commit()
-    conn.close()
-
-def excluir_estudo(eid):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("DELETE FROM anexos WHERE estudo_id=?", (eid,))
-    c.execute("DELETE FROM estudos WHERE id=?", (eid,))
-    conn.commit()
-    conn.close()
-
-def add_anexo(eid, nome, tipo, dados, tam):
-    conn = get_conn()
-    conn.cursor().execute(
-        "INSERT INTO anexos (estudo_id, filename, file_type, file_data, file_size) VALUES (?, ?, ?, ?, ?)",
-        (eid, nome, tipo or "", base64.b64encode(dados).decode(), tam)
+
+@st.cache_resource
+def manutencao():
+    return armazenamento.ManutencaoOcioso(
+        arquivos_banco,
+        ocioso_seg=int(obter_config("vacuum_ocioso_seg", 60)),
+        max_paginas=int(obter_config("vacuum_paginas_passo", 256)),
     )
-    conn.commit()
-    conn.close()
-
-def listar_anexos(eid):
-    conn = get_conn()
-    r = list(conn.cursor().execute(
-        "SELECT id, filename, file_type, file_size FROM anexos WHERE estudo_id=? ORDER BY created_at DESC", (eid,)
-    ).fetchall())
-    conn.close()
-    return r
-
-def obter_anexo(aid):
-    conn = get_conn()
-    r = conn.cursor().execute("SELECT * FROM anexos WHERE id=?", (aid,)).fetchone()
-    conn.close()
-    return r
-
-def excluir_anexo(aid):
-    conn = get_conn()
-    conn.cursor().execute("DELETE FROM anexos WHERE id=?", (aid,))
-    conn.commit()
-    conn.close()
-
-def stats():
-    conn = get_conn()
-    c = conn.cursor()
-    s = {
-        "clientes": c.execute("SELECT COUNT(*) FROM clientes").fetchone()[0],
-        "estudos": c.execute("SELECT COUNT(*) FROM estudos").fetchone()[0],
-        "anexos": c.execute("SELECT COUNT(*) FROM anexos").fetchone()[0],
-    }
-    conn.close()
-    return s
-
-# ==================== BACKUP / RESTORE (CORE) ====================
-def backup():
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
-        conn = get_conn()
-        data = {
-            "versao": "6.3",
-            "data": datetime.now().isoformat(),
-            "clientes": [dict(r) for r in conn.cursor().execute("SELECT * FROM clientes").fetchall()],
-            "estudos": [dict(r) for r in conn.cursor().execute("SELECT * FROM estudos").fetchall()],
-            "anexos": [dict(r) for r in conn.cursor().execute("SELECT * FROM anexos").fetchall()],
-        }
-        conn.close()
-        zf.writestr("backup.json", json.dumps(data, ensure_ascii=False, indent=2))
-    buf.seek(0)
-    return buf
-
-def restaurar(file):
-    try:
-        content = file.read()
-        with zipfile.ZipFile(io.BytesIO(content)) as zf:
-            data = json.loads(zf.read("backup.json"))
-    except zipfile.BadZipFile:
-        data = json.loads(content)
 
-    try:
-        conn = get_conn()
-        c = conn.cursor()
-
-        # limpa core
-        for t in ["anexos", "estudos", "clientes"]:
-            c.execute(f"DELETE FROM {t}")
-
-        # restaura (tolerante a campos faltantes)
-        for cl in data.get("clientes", []):
-            c.execute(
-                "INSERT INTO clientes (id, nome, cnpj, observacoes, created_at) VALUES (?, ?, ?, ?, ?)",
-                (cl.get("id"), cl.get("nome"), cl.get("cnpj"), cl.get("observacoes"), cl.get("created_at"))
-            )
+manutencao()
 
-        for e in data.get("estudos", []):
-            c.execute(
-                "INSERT INTO estudos (id, cliente_id, titulo, resumo, tags, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (e.get("id"), e.get("cliente_id"), e.get("titulo"), e.get("resumo"), e.get("tags"),
-                 e.get("created_at"), e.get("updated_at"))
-            )
+def enviar_anexos(eid, arquivos):
+    """Lê os uploads na sessão e delega a gravação a uma tarefa em segundo plano."""
+    arquivos = [(a.name, a.type or "", a.getvalue(), a.size) for a in arquivos or []]
+    if arquivos:
+        job_runner().submeter(
+            "upload", job_upload, eid, arquivos,
+            descricao=f"{len(arquivos)} anexo(s) no estudo #{eid}"
+        )
+    return len(arquivos)
 
-        for a in data.get("anexos", []):
-            c.execute(
-                "INSERT INTO anexos (id, estudo_id, filename, file_type, file_data, file_size, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (a.get("id"), a.get("estudo_id"), a.get("filename"), a.get("file_type"),
-                 a.get("file_data"), a.get("file_size"), a.get("created_at"))
-            )
+# ==================== CACHE ====================
+@st.cache_data(show_spinner=False, max_entries=256)
+def _clientes_busca_cache(termo, limite, versao):
+    return [dict(r) for r in buscar_clientes(termo, limite)]
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def _estudos_cache(cid, versao):
+    return [dict(r) for r in listar_estudos(cid)]
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def _anexos_cache(eid, versao):
+    return [dict(r) for r in listar_anexos(eid)]
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _relatorio_cache(versao, tamanhos):
+    # relatório físico: VACUUM e compactação mudam os arquivos sem mudar a versão dos dados
+    return relatorio_armazenamento()
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _stats_cache(versao):
+    return stats()
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _agregados_cache(versao):
+    return agregados()
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def _previa_cache(aid, versao):
+    return previa_anexo(aid)
+
+def buscar_clientes_cached(termo=None, limite=20):
+    return _clientes_busca_cache(termo or "", limite, versao_db())
+
+def estudos_cached(cid=None):
+    return _estudos_cache(cid, versao_db())
 
-        conn.commit()
-        conn.close()
-        return True, "Restaurado!"
-    except Exception as e:
-        return False, str(e)
+def buscar_estudos_cached(termo):
+    # termo -> ids fica no LRU do módulo de busca, compartilhado entre sessões
+    return [dict(r) for r in buscar_estudos(termo, versao_db())]
+
+def anexos_cached(eid):
+    return _anexos_cache(eid, versao_db())
+
+def previa_cached(aid):
+    return _previa_cache(aid, versao_db())
+
+def stats_cached():
+    return _stats_cache(versao_db())
+
+def agregados_cached():
+    return _agregados_cache(versao_db())
+
+# ==================== LATÊNCIA ====================
+def registrar_latencia(escopo, ms):
+    lat = st.session_state.setdefault("latencias", [])
+    lat.append((escopo, ms))
+    del lat[:-300]
+
+@contextmanager
+def medir(escopo):
+    t0 = time.perf_counter()
+    try:
+        with memoria.medir(escopo):
+            yield
+    finally:
+        registrar_latencia(escopo, (time.perf_counter() - t0) * 1000)
 
 # ==================== ESTADO ====================
 if "pagina" not in st.session_state:
@@ -392,14 +305,489 @@ with st.sidebar:
             st.rerun()
 
     st.markdown("---")
+    n_jobs = job_runner().em_andamento()
+    if n_jobs:
+        st.caption(f"⏳ {n_jobs} tarefa(s) em andamento")
     st.caption("✅ Agente removido | ✅ Atualizações removidas")
     st.caption("© 2025 MP Solutions")
 
+def campo_busca(rotulo, placeholder, key):
+    """Campo de texto que dispara a cada digitação (com debounce) quando o st_keyup está instalado."""
+    if st_keyup:
+        return st_keyup(rotulo, placeholder=placeholder, debounce=250, key=key)
+    return st.text_input(rotulo, placeholder=placeholder, key=key)
+
+def rotulo_cliente(cl):
+    return f"{cl['nome']} — {cl['cnpj']}" if cl.get("cnpj") else cl["nome"]
+
+def executar_lote(acao, ids):
+    """Callback das ações em lote: uma chamada ao núcleo (uma transação por arquivo) antes da reexecução."""
+    t0 = time.perf_counter()
+    try:
+        if acao == "tags":
+            n = alterar_tags_estudos(
+                ids, st.session_state.lote_adicionar.split(","), st.session_state.lote_remover.split(",")
+            )
+        elif acao == "mover":
+            n = mover_estudos(ids, st.session_state.lote_destino)
+        else:
+            n = excluir_estudos(ids)
+    except ValueError as e:
+        st.session_state.lote_msg = f"❌ {e}"
+        return
+    st.session_state.lote_confirmar = False
+    # chave nova para a tabela: a seleção antiga apontaria para outras linhas
+    st.session_state.lote_rodada = st.session_state.get("lote_rodada", 0) + 1
+    st.session_state.lote_msg = f"✅ {n} estudo(s) alterado(s) em {(time.perf_counter() - t0) * 1000:.0f} ms"
+
+def acoes_em_lote(estudos):
+    sel = st.dataframe(
+        [{"título": e["titulo"], "cliente": e.get("cliente", ""), "tags": e.get("tags") or "",
+          "criado em": str(e.get("created_at") or "")[:10]} for e in estudos],
+        key=f"lote_{st.session_state.get('lote_rodada', 0)}", on_select="rerun", selection_mode="multi-row",
+        use_container_width=True, hide_index=True
+    )
+    if st.session_state.get("lote_msg"):
+        st.caption(st.session_state.pop("lote_msg"))
+    ids = [estudos[i]["id"] for i in sel.selection.rows]
+    if not ids:
+        st.caption("Marque as linhas (ou todas, pelo cabeçalho) para agir sobre elas de uma vez.")
+        return
+    acao = st.radio(
+        f"{len(ids)} estudo(s) selecionado(s):", ["tags", "mover", "excluir"], horizontal=True,
+        format_func={"tags": "🏷️ Tags", "mover": "🔀 Mover para cliente", "excluir": "🗑️ Excluir"}.get
+    )
+    if acao == "tags":
+        colA, colB = st.columns(2)
+        adicionar = colA.text_input("Adicionar (vírgula):", key="lote_adicionar")
+        remover = colB.text_input("Remover (vírgula):", key="lote_remover")
+        st.button("🏷️ Aplicar tags", on_click=executar_lote, args=("tags", ids), disabled=not (adicionar or remover))
+    elif acao == "mover":
+        termo = campo_busca("Cliente de destino:", "Nome ou CNPJ...", "lote_busca_cliente")
+        clientes = {c["id"]: c for c in buscar_clientes_cached(termo)}
+        st.selectbox(
+            "Destino:", list(clientes), format_func=lambda cid: rotulo_cliente(clientes[cid]),
+            key="lote_destino", label_visibility="collapsed"
+        )
+        st.button("🔀 Mover", on_click=executar_lote, args=("mover", ids), disabled=not clientes)
+    else:
+        confirmar = st.checkbox(f"Excluir {len(ids)} estudo(s) e os anexos deles", key="lote_confirmar")
+        st.button("🗑️ Excluir selecionados", type="primary", on_click=executar_lote, args=("excluir", ids),
+                  disabled=not confirmar)
+
+def dossie_cliente(cl, versao):
+    """Exportar dossiê: o zip em cache vai direto para o download; senão é gerado em segundo plano."""
+    chave = f"dossie_{cl['id']}"
+    pedido = st.session_state.get(chave) or {}
+    if pedido.get("job"):
+        job = job_runner().obter(pedido["job"])
+        if job and job["status"] in jobs.ATIVOS:
+            st.progress(job["progresso"] / 100, text=job["mensagem"] or "📦 Gerando dossiê...")
+            return
+        if job and job["status"] == jobs.ERRO:
+            st.error((job["erro"] or "").split("\n")[0])
+        pedido = {"versao": versao} if job and job["status"] == jobs.CONCLUIDO else {}
+        st.session_state[chave] = pedido
+    # pedido de uma versão anterior do banco: o cliente pode ter mudado desde então
+    aberto = abrir_dossie(cl["id"], gerar=False) if pedido.get("versao") == versao else None
+    if aberto:
+        with aberto[1] as arquivo:
+            st.download_button(
+                "⬇️ Baixar dossiê", arquivo, f"dossie - {dossie.nome_arquivo(cl['nome'])}.zip",
+                "application/zip", key=f"ddl_{cl['id']}"
+            )
+    elif st.button("📦 Exportar dossiê", key=f"dx_{cl['id']}"):
+        if dossie_em_cache(cl["id"]):
+            st.session_state[chave] = {"versao": versao}
+        else:
+            st.session_state[chave] = {"versao": versao, "job": job_runner().submeter(
+                "dossie", job_exportar_dossie, cl["id"], descricao=f"Dossiê de {cl['nome']}"
+            )}
+        # reexecuta a página para o fragmento passar a acompanhar a tarefa
+        st.rerun()
+
+def preparar_download(aid):
+    # a leitura conta aqui, uma vez: o botão abaixo relê o anexo a cada reexecução da página
+    registrar_leitura(aid)
+    st.session_state.baixar_anexo = aid
+
+def mostrar_previa(p):
+    if not p:
+        st.caption("Anexo não encontrado.")
+    elif p["tipo"] == "imagem":
+        st.image(base64.b64decode(p["dados"]), width=p["largura"])
+    elif p["tipo"] == "tabela":
+        for pl in p["planilhas"]:
+            if pl["nome"]:
+                st.caption(f"📑 {pl['nome']}")
+            if pl["linhas"]:
+                st.dataframe([dict(zip(pl["colunas"], l)) for l in pl["linhas"]], hide_index=True,
+                             use_container_width=True)
+            else:
+                st.caption("Planilha vazia.")
+            if pl["cortada"]:
+                st.caption("Mostrando só as primeiras linhas.")
+    elif p["tipo"] == "texto":
+        st.text(p["texto"] + ("\n…" if p["cortado"] else ""))
+    else:
+        st.caption(p["motivo"])
+
+# ==================== FRAGMENTOS ====================
+# cada bloco abaixo reexecuta sozinho quando um widget dele é acionado;
+# navegação entre páginas continua usando st.rerun() completo
+@st.fragment
+def biblioteca_resultados():
+    with medir("biblioteca.resultados"):
+        busca = campo_busca("🔍 Buscar:", "Digite para filtrar por título, tags ou resumo...", "busca_biblioteca")
+        t0 = time.perf_counter()
+        estudos = buscar_estudos_cached(busca) if busca else estudos_cached()
+        if busca:
+            st.caption(f"{len(estudos)} resultado(s) em {(time.perf_counter() - t0) * 1000:.0f} ms")
+
+        if not estudos:
+            st.info("Nenhum estudo encontrado.")
+            return
+        if st.toggle("☑️ Seleção em lote", key="biblioteca_lote"):
+            acoes_em_lote(estudos)
+            return
+        for est in estudos:
+            with st.expander(f"📄 {est['titulo'][:55]}... - {est.get('cliente', '')}"):
+                st.markdown(f"**Tags:** {est.get('tags') or 'Sem tags'}")
+                st.markdown((est.get("resumo") or "")[:600] + ("..." if len(est.get("resumo") or "") > 600 else ""))
+
+                col1, col2 = st.columns(2)
+                with col1:
+                    if st.button("📖 Abrir", key=f"a_{est['id']}"):
+                        navegar("estudo_view", est.get("cliente_id"), est["id"])
+                        st.rerun()
+                with col2:
+                    # o callback roda antes da reexecução do fragmento, que já lista sem o estudo
+                    st.button("🗑️ Excluir", key=f"d_{est['id']}", on_click=excluir_estudo, args=(est["id"],))
+
+@st.fragment(run_every=2 if job_runner().em_andamento() else None)
+def clientes_lista():
+    with medir("clientes.lista"):
+        termo = campo_busca("🔍 Filtrar:", "Nome ou CNPJ...", "busca_clientes")
+        clientes = buscar_clientes_cached(termo, 50)
+        if not clientes:
+            st.info("Nenhum cliente encontrado." if termo else "Nenhum cliente cadastrado ainda.")
+            return
+        if len(clientes) == 50:
+            st.caption("Mostrando os 50 primeiros; refine o filtro para ver outros.")
+        versao = versao_db()
+        for cl in clientes:
+            estudos_cl = estudos_cached(cl["id"])
+
+            with st.expander(f"🏢 {cl['nome']}" + (f" - {cl.get('cnpj','')}" if cl.get("cnpj") else "")):
+                st.markdown(f"**Estudos:** {len(estudos_cl)}")
+
+                for est in estudos_cl[:8]:
+                    if st.button(f"📄 {est['titulo'][:45]}...", key=f"e_{cl['id']}_{est['id']}"):
+                        navegar("estudo_view", cl["id"], est["id"])
+                        st.rerun()
+
+                colA, colB = st.columns(2)
+                with colA:
+                    dossie_cliente(cl, versao)
+                with colB:
+                    st.button("🗑️ Excluir Cliente", key=f"dc_{cl['id']}", on_click=excluir_cliente, args=(cl["id"],))
+
+@st.fragment
+def novo_estudo_form():
+    with medir("novo.estudo"):
+        # o cliente fica fora do form: cada digitação consulta o índice com LIMIT
+        termo = campo_busca("Cliente:", "Digite o nome ou CNPJ...", "busca_cliente_estudo")
+        clientes = {c["id"]: c for c in buscar_clientes_cached(termo)}
+        if not clientes:
+            st.warning("Nenhum cliente encontrado." if termo else "Cadastre um cliente primeiro.")
+            return
+        cliente_id = st.selectbox(
+            "Selecione:", list(clientes), format_func=lambda cid: rotulo_cliente(clientes[cid]),
+            label_visibility="collapsed"
+        )
+        with st.form("f_estudo"):
+            titulo = st.text_input("Título:")
+            resumo = st.text_area("Resumo:", height=220)
+            tags = st.text_input("Tags (vírgula):")
+            arquivos = st.file_uploader("Anexos:", accept_multiple_files=True)
+
+            if st.form_submit_button("💾 Salvar", type="primary"):
+                if not titulo or not resumo:
+                    st.error("Preencha título e resumo.")
+                else:
+                    eid = criar_estudo(cliente_id, titulo, resumo, tags)
+                    if enviar_anexos(eid, arquivos):
+                        st.info("📤 Anexos sendo gravados em segundo plano (veja Configurações → Tarefas).")
+                    st.success("✅ Estudo criado!")
+                    st.balloons()
+
+@st.fragment
+def novo_cliente_form():
+    with medir("novo.cliente"):
+        with st.form("f_cliente"):
+            nome = st.text_input("Nome:")
+            cnpj = st.text_input("CNPJ:")
+            obs = st.text_area("Observações:")
+            if st.form_submit_button("💾 Salvar", type="primary"):
+                if not nome:
+                    st.error("Nome é obrigatório.")
+                else:
+                    try:
+                        criar_cliente(nome, cnpj, obs)
+                        st.success("✅ Cliente criado!")
+                    except ValueError as e:
+                        st.error(str(e))
+
+def preparar_artefato(job_id):
+    st.session_state.baixar_tarefa = job_id
+
+@st.fragment(run_every=2 if job_runner().em_andamento() else None)
+def tarefas_painel():
+    with medir("config.tarefas"):
+        runner = job_runner()
+        colA, colB = st.columns([3, 1])
+        with colA:
+            limite = st.number_input(
+                "Tarefas pesadas simultâneas:", min_value=1, max_value=16, value=runner.max_pesados, step=1
+            )
+            if limite != runner.max_pesados:
+                salvar_config("jobs_pesados", limite)
+                runner.definir_limite(limite)
+        with colB:
+            st.button("🔄 Atualizar", use_container_width=True)
+
+        tarefas = runner.listar(10)
+        if not tarefas:
+            st.info("Nenhuma tarefa executada ainda.")
+        for job in tarefas:
+            job = dict(job)
+            colA, colB, colC = st.columns([4, 1, 1])
+            with colA:
+                st.markdown(f"**#{job['id']} {job['tipo']}** — {job.get('descricao') or ''} · `{job['status']}`")
+                if job["status"] in jobs.ATIVOS:
+                    st.progress(job["progresso"] / 100, text=job.get("mensagem") or "")
+                elif job["status"] == jobs.ERRO:
+                    st.error((job.get("erro") or "").split("\n")[0])
+                st.caption(f"🕒 {str(job['created_at'])[:16]}")
+            with colB:
+                art = Path(job["artefato"]) if job.get("artefato") else None
+                if job["status"] == jobs.CONCLUIDO and art and art.exists():
+                    # artefatos (backups inteiros) só são lidos para a tarefa escolhida, não a cada atualização
+                    if st.session_state.get("baixar_tarefa") == job["id"]:
+                        with open(art, "rb") as f:
+                            st.download_button("💾", f, art.name.split("_", 1)[1], key=f"dj_{job['id']}")
+                    else:
+                        st.button("⬇️", key=f"pj_{job['id']}", on_click=preparar_artefato, args=(job["id"],))
+            with colC:
+                if job["status"] not in jobs.ATIVOS:
+                    st.button("🗑️", key=f"xj_{job['id']}", on_click=runner.excluir, args=(job["id"],))
+
+@st.fragment(run_every=2 if job_runner().em_andamento() else None)
+def anexos_painel(eid):
+    with medir("estudo.anexos"):
+        anexos = anexos_cached(eid)
+        if not anexos:
+            st.info("Nenhum anexo neste estudo.")
+        else:
+            for anx in anexos:
+                colA, colB, colC = st.columns([4, 1, 1])
+                with colA:
+                    st.markdown(f"📄 {anx['filename']}")
+                with colB:
+                    # o conteúdo só é lido quando o download é pedido, não a cada abertura do estudo
+                    if st.session_state.get("baixar_anexo") == anx["id"]:
+                        st.download_button(
+                            "💾",
+                            ler_anexo(anx["id"], registrar=False),
+                            anx["filename"],
+                            anx["file_type"],
+                            key=f"dl_{anx['id']}"
+                        )
+                    else:
+                        st.button("⬇️", key=f"pd_{anx['id']}", on_click=preparar_download, args=(anx["id"],))
+                with colC:
+                    st.button("🗑️", key=f"da_{anx['id']}", on_click=excluir_anexo, args=(anx["id"],))
+                with st.expander("👁️ Prévia", expanded=True):
+                    mostrar_previa(previa_cached(anx["id"]))
+
+        with st.form("f_upload", clear_on_submit=True):
+            novos = st.file_uploader("Adicionar:", accept_multiple_files=True)
+            if st.form_submit_button("📤 Upload") and novos:
+                enviar_anexos(eid, novos)
+                # reexecuta a página para o painel passar a acompanhar a tarefa
+                st.rerun()
+
+@st.fragment
+def armazenamento_painel():
+    with medir("config.armazenamento"):
+        if not st.toggle("Mostrar relatório de armazenamento", key="mostrar_relatorio"):
+            return
+        rel = _relatorio_cache(versao_db(), tuple(p.stat().st_size for p in arquivos_banco() if p.exists()))
+        m = manutencao()
+        if SHARDS.ativo():
+            st.caption(f"🧩 Modo shards: catálogo + {rel.get('arquivos', 1) - 1} arquivo(s) de cliente em `{SHARDS.diretorio}`")
+        cols = st.columns(4)
+        cols[0].metric("Arquivo", fmt_bytes(rel["bytes_total"]))
+        cols[1].metric("Páginas livres", f"{rel['razao_livre']:.1%}", fmt_bytes(rel["bytes_livres"]), delta_color="off")
+        cols[2].metric("auto_vacuum", rel["auto_vacuum"])
+        cols[3].metric("Liberado em ociosidade", fmt_bytes(m.paginas_liberadas * rel["page_size"]))
+        if rel["auto_vacuum"] != "INCREMENTAL":
+            st.warning("Banco sem auto_vacuum incremental: use **Compactar agora** uma vez para migrar.")
+
+        colA, colB, colC = st.columns(3)
+        with colA:
+            if st.button("🧹 Compactar agora", use_container_width=True):
+                job_runner().submeter("compactar", job_compactar, descricao="VACUUM completo")
+                st.toast("Compactação iniciada em segundo plano.")
+        with colB:
+            if st.button("🗜️ Comprimir anexos antigos", use_container_width=True):
+                job_runner().submeter("comprimir", job_comprimir_anexos, descricao="Compressão dos anexos legados")
+                st.toast("Compressão iniciada em segundo plano.")
+        with colC:
+            if st.button("🩺 Verificar integridade", use_container_width=True):
+                job_runner().submeter("integridade", job_verificar_integridade, descricao="quick_check dos arquivos")
+                st.toast("Verificação iniciada em segundo plano.")
+        if st.button("🧮 Reconciliar agregados do Dashboard"):
+            job_runner().submeter("agregados", job_reconstruir_agregados, descricao="Recalcula os agregados")
+            st.toast("Reconciliação iniciada em segundo plano.")
+
+        frio = rel["frio"]
+        st.markdown(
+            f"**🧊 Camada fria** — {frio['anexos']} anexo(s) em {frio['pacotes']} pacote(s), "
+            f"{fmt_bytes(frio['bytes_pacotes'])} em `{FRIO_DIR}`"
+        )
+        atuais = {"frio_idade_dias": int(float(obter_config("frio_idade_dias", 90))),
+                  "frio_ocioso_dias": int(float(obter_config("frio_ocioso_dias", 30)))}
+        colA, colB, colC = st.columns(3)
+        with colA:
+            idade = st.number_input("Esfriar com mais de (dias do upload):", min_value=0, max_value=3650,
+                                    value=atuais["frio_idade_dias"], step=30, key="frio_idade")
+        with colB:
+            ocioso = st.number_input("E sem leitura há (dias):", min_value=0, max_value=3650,
+                                     value=atuais["frio_ocioso_dias"], step=7, key="frio_ocioso")
+        for chave, valor in (("frio_idade_dias", idade), ("frio_ocioso_dias", ocioso)):
+            if valor != atuais[chave]:
+                salvar_config(chave, valor)
+        with colC:
+            if st.button("🧊 Arquivar anexos frios", use_container_width=True):
+                job_runner().submeter("arquivar", job_arquivar_anexos, descricao="Anexos antigos para os pacotes")
+                st.toast("Arquivamento iniciado em segundo plano.")
+        st.caption("Anexos frios são lidos direto do pacote; um anexo frio lido duas vezes em poucos dias volta ao banco.")
+
+        colA, colB = st.columns(2)
+        with colA:
+            st.markdown("**Por tabela**")
+            st.dataframe(
+                [{"tabela": t["tabela"], "tamanho": fmt_bytes(t["bytes"])} for t in rel["por_tabela"]],
+                use_container_width=True, hide_index=True
+            )
+        with colB:
+            st.markdown("**Por cliente**")
+            st.dataframe(
+                [{"cliente": c["nome"], "estudos": c["estudos"], "anexos": c["anexos"],
+                  "tamanho": fmt_bytes(c["bytes_anexos"])} for c in rel["por_cliente"]],
+                use_container_width=True, hide_index=True
+            )
+        st.markdown("**Maiores anexos**")
+        st.dataframe(
+            [{"arquivo": a["filename"], "cliente": a["cliente"], "estudo": a["estudo"],
+              "armazenado": fmt_bytes(a["bytes_armazenados"])} for a in rel["maiores_anexos"]],
+            use_container_width=True, hide_index=True
+        )
+
+@st.fragment
+def replicacao_painel():
+    with medir("config.replicacao"):
+        if eh_replica():
+            st.info("🔁 Esta instância é uma réplica: os dados chegam pelos segmentos do primário.")
+            return
+        colA, colB, colC = st.columns(3)
+        colA.metric("Alterações a exportar", alteracoes_pendentes())
+        colB.metric("Segmentos em disco", len(replicacao.segmentos(REPLICACAO_DIR)))
+        with colC:
+            if st.button("📤 Exportar alterações", use_container_width=True):
+                job_runner().submeter(
+                    "replicacao", job_exportar_alteracoes, descricao="Segmentos do log de alterações", pesado=False
+                )
+                st.toast("Exportação iniciada em segundo plano.")
+        st.caption(f"Segmentos em `{REPLICACAO_DIR}` · réplicas: `python replicacao.py aplicar --replica ... --origem ...`")
+        reps = replicacao.situacao(REPLICACAO_DIR) if REPLICACAO_DIR.exists() else []
+        if not reps:
+            st.info("Nenhuma réplica registrada.")
+            return
+        st.dataframe(
+            [{"réplica": r["nome"], "segmentos pendentes": r["pendentes"],
+              "atraso": f"{r['atraso_seg']:.0f} s",
+              "última aplicação": datetime.fromtimestamp(r["aplicado_em"]).strftime("%d/%m %H:%M:%S")} for r in reps],
+            use_container_width=True, hide_index=True
+        )
+
+def latencias_painel():
+    lat = st.session_state.get("latencias", [])
+    if not lat:
+        st.info("Nenhuma interação medida nesta sessão.")
+        return
+    por_escopo = {}
+    for escopo, ms in lat:
+        por_escopo.setdefault(escopo, []).append(ms)
+    linhas = []
+    for escopo, v in sorted(por_escopo.items()):
+        v = sorted(v)
+        linhas.append({
+            "escopo": escopo,
+            "execuções": len(v),
+            "mediana (ms)": round(v[len(v) // 2], 1),
+            "p95 (ms)": round(v[min(len(v) - 1, int(len(v) * 0.95))], 1),
+        })
+    st.dataframe(linhas, use_container_width=True, hide_index=True)
+    st.caption("`app:*` = reexecução completa do script; os demais escopos são fragmentos reexecutados isoladamente.")
+
+@st.fragment
+def memoria_painel():
+    ligado = st.toggle("Perfil de memória (tracemalloc)", value=memoria.ativo(), key="memoria_ligado")
+    orcamento = st.number_input(
+        "Orçamento por escopo (MB, 0 = sem alerta):", min_value=0, max_value=65536,
+        value=memoria.orcamento // 2**20, step=64, key="memoria_orcamento"
+    )
+    if ligado != memoria.ativo() or orcamento != memoria.orcamento // 2**20:
+        salvar_config("memoria_perfil", int(ligado))
+        salvar_config("memoria_orcamento_mb", orcamento)
+        memoria.configurar(ligado, orcamento)
+    if not ligado:
+        st.caption("Desligado. Ligue para investigar picos: o Python fica mais lento e usa mais memória enquanto rastreia.")
+        return
+
+    colA, colB = st.columns([3, 1])
+    with colA:
+        st.caption("Pico = maior alocação durante o escopo acima do que já estava alocado; mede o processo inteiro.")
+    with colB:
+        st.button("🧽 Limpar medições", on_click=memoria.limpar, use_container_width=True)
+    linhas = memoria.resumo()
+    if not linhas:
+        st.info("Nenhum escopo medido desde que o perfil foi ligado.")
+        return
+    st.dataframe(
+        [{"escopo": r["escopo"], "execuções": r["execucoes"], "pico máx.": fmt_bytes(r["pico"]),
+          "pico médio": fmt_bytes(r["medio"]), "último": fmt_bytes(r["ultimo"]),
+          "retido": fmt_bytes(max(0, r["liquido"])), "acima do orçamento": r["acima"]} for r in linhas],
+        use_container_width=True, hide_index=True
+    )
+    escopo = st.selectbox("Alocações vivas na saída da maior execução de:", [r["escopo"] for r in linhas])
+    st.dataframe(
+        [{"local": l["local"], "tamanho": fmt_bytes(l["bytes"]), "blocos": l["blocos"]} for l in memoria.locais(escopo)],
+        use_container_width=True, hide_index=True
+    )
+    for a in memoria.alertas()[:5]:
+        st.warning(
+            f"{datetime.fromtimestamp(a['quando']):%d/%m %H:%M:%S} · **{a['escopo']}** chegou a {fmt_bytes(a['pico'])}"
+            + (f" — maior local: `{a['locais'][0]['local']}`" if a["locais"] else "")
+        )
+
 # ==================== PÁGINAS ====================
 if st.session_state.pagina == "dashboard":
     st.markdown("## 📊 Dashboard")
 
-    s = stats()
+    s = stats_cached()
     cols = st.columns(3)
     for col, (icon, label, value) in zip(cols, [
         ("👥", "Clientes", s["clientes"]),
@@ -413,9 +801,51 @@ if st.session_state.pagina == "dashboard":
             )
 
     st.markdown("<br>", unsafe_allow_html=True)
+    with medir("dashboard.agregados"):
+        ag = agregados_cached()
+        colA, colB = st.columns(2)
+        with colA:
+            st.markdown("### 📈 Estudos por mês")
+            # os 6 clientes com mais estudos no período; o resto vira "Outros"
+            por_cliente = {}
+            for r in ag["estudos_mes"]:
+                por_cliente[r["cliente"]] = por_cliente.get(r["cliente"], 0) + r["estudos"]
+            principais = set(sorted(por_cliente, key=por_cliente.get, reverse=True)[:6])
+            serie = {}
+            for r in ag["estudos_mes"]:
+                chave = (r["mes"], r["cliente"] if r["cliente"] in principais else "Outros")
+                serie[chave] = serie.get(chave, 0) + r["estudos"]
+            if serie:
+                st.bar_chart(
+                    [{"mês": m, "cliente": c, "estudos": n} for (m, c), n in serie.items()],
+                    x="mês", y="estudos", color="cliente"
+                )
+            else:
+                st.info("Nenhum estudo nos últimos 12 meses.")
+        with colB:
+            st.markdown("### 🏷️ Tags mais usadas")
+            if ag["tags"]:
+                st.bar_chart(ag["tags"], x="tag", y="estudos", horizontal=True)
+            else:
+                st.info("Nenhuma tag cadastrada.")
+        colA, colB = st.columns(2)
+        with colA:
+            st.markdown("### 💾 Armazenamento por cliente")
+            st.dataframe(
+                [{"cliente": r["cliente"], "anexos": r["anexos"], "original": fmt_bytes(r["bytes_originais"]),
+                  "armazenado": fmt_bytes(r["bytes_armazenados"])} for r in ag["anexos_cliente"][:10]],
+                use_container_width=True, hide_index=True
+            )
+        with colB:
+            st.markdown("### 📎 Anexos por tipo")
+            st.dataframe(
+                [{"tipo": r["tipo"], "anexos": r["anexos"], "original": fmt_bytes(r["bytes_originais"]),
+                  "armazenado": fmt_bytes(r["bytes_armazenados"])} for r in ag["anexos_tipo"]],
+                use_container_width=True, hide_index=True
+            )
+
     st.markdown("### 📚 Estudos Recentes")
-    for est in listar_estudos()[:8]:
-        est = dict(est)
+    for est in estudos_cached()[:8]:
         st.markdown(
             f'<div class="search-result">'
             f'<span class="card-badge badge-estadual">{est.get("cliente","")}</span>'
@@ -427,123 +857,66 @@ if st.session_state.pagina == "dashboard":
 
 elif st.session_state.pagina == "biblioteca":
     st.markdown("## 📚 Biblioteca")
-    busca = st.text_input("🔍 Buscar:", placeholder="Digite para filtrar por título ou resumo...")
-
-    if busca:
-        conn = get_conn()
-        estudos = [dict(r) for r in conn.cursor().execute(
-            """SELECT e.*, c.nome as cliente
-               FROM estudos e JOIN clientes c ON e.cliente_id=c.id
-               WHERE e.titulo LIKE ? OR e.resumo LIKE ?
-               ORDER BY e.created_at DESC""",
-            (f"%{busca}%", f"%{busca}%")
-        ).fetchall()]
-        conn.close()
-    else:
-        estudos = [dict(r) for r in listar_estudos()]
-
-    if not estudos:
-        st.info("Nenhum estudo encontrado.")
-    else:
-        for est in estudos:
-            with st.expander(f"📄 {est['titulo'][:55]}... - {est.get('cliente', '')}"):
-                st.markdown(f"**Tags:** {est.get('tags') or 'Sem tags'}")
-                st.markdown((est.get("resumo") or "")[:600] + ("..." if len(est.get("resumo") or "") > 600 else ""))
-
-                col1, col2 = st.columns(2)
-                with col1:
-                    if st.button("📖 Abrir", key=f"a_{est['id']}"):
-                        navegar("estudo_view", est.get("cliente_id"), est["id"])
-                        st.rerun()
-                with col2:
-                    if st.button("🗑️ Excluir", key=f"d_{est['id']}"):
-                        excluir_estudo(est["id"])
-                        st.rerun()
+    biblioteca_resultados()
 
 elif st.session_state.pagina == "clientes":
     st.markdown("## 👥 Clientes")
-
-    clientes = listar_clientes()
-    if not clientes:
-        st.info("Nenhum cliente cadastrado ainda.")
-    else:
-        for cl in clientes:
-            cl = dict(cl)
-            estudos_cl = listar_estudos(cl["id"])
-
-            with st.expander(f"🏢 {cl['nome']}" + (f" - {cl.get('cnpj','')}" if cl.get("cnpj") else "")):
-                st.markdown(f"**Estudos:** {len(estudos_cl)}")
-
-                for est in estudos_cl[:8]:
-                    est = dict(est)
-                    if st.button(f"📄 {est['titulo'][:45]}...", key=f"e_{cl['id']}_{est['id']}"):
-                        navegar("estudo_view", cl["id"], est["id"])
-                        st.rerun()
-
-                if st.button("🗑️ Excluir Cliente", key=f"dc_{cl['id']}"):
-                    excluir_cliente(cl["id"])
-                    st.rerun()
+    clientes_lista()
 
 elif st.session_state.pagina == "novo":
     st.markdown("## ➕ Novo Cadastro")
     tab1, tab2 = st.tabs(["📄 Estudo", "👤 Cliente"])
 
     with tab1:
-        clientes = listar_clientes()
-        if not clientes:
-            st.warning("Cadastre um cliente primeiro.")
-        else:
-            with st.form("f_estudo"):
-                opts = {c["nome"]: c["id"] for c in clientes}
-                cliente_nome = st.selectbox("Cliente:", list(opts.keys()))
-                titulo = st.text_input("Título:")
-                resumo = st.text_area("Resumo:", height=220)
-                tags = st.text_input("Tags (vírgula):")
-                arquivos = st.file_uploader("Anexos:", accept_multiple_files=True)
-
-                if st.form_submit_button("💾 Salvar", type="primary"):
-                    if not titulo or not resumo:
-                        st.error("Preencha título e resumo.")
-                    else:
-                        eid = criar_estudo(opts[cliente_nome], titulo, resumo, tags)
-                        for arq in arquivos or []:
-                            add_anexo(eid, arq.name, arq.type or "", arq.read(), arq.size)
-                        st.success("✅ Estudo criado!")
-                        st.balloons()
+        novo_estudo_form()
 
     with tab2:
-        with st.form("f_cliente"):
-            nome = st.text_input("Nome:")
-            cnpj = st.text_input("CNPJ:")
-            obs = st.text_area("Observações:")
-            if st.form_submit_button("💾 Salvar", type="primary"):
-                if not nome:
-                    st.error("Nome é obrigatório.")
-                else:
-                    criar_cliente(nome, cnpj, obs)
-                    st.success("✅ Cliente criado!")
+        novo_cliente_form()
 
 elif st.session_state.pagina == "config":
     st.markdown("## ⚙️ Configurações")
 
     st.markdown("### 💾 Backup")
+    runner = job_runner()
     col1, col2 = st.columns(2)
 
     with col1:
         if st.button("📥 Gerar Backup", use_container_width=True):
-            bkp = backup()
-            st.download_button(
-                "⬇️ Baixar",
-                bkp,
-                f"backup_{datetime.now():%Y%m%d_%H%M}.zip",
-                use_container_width=True
-            )
+            runner.submeter("backup", job_backup, descricao="Backup completo")
+            st.toast("Backup iniciado em segundo plano.")
+        atual = int(obter_config("backup_nivel", 6))
+        nivel = st.slider("Nível de compressão (0 = sem, 9 = máximo):", 0, 9, atual, key="backup_nivel")
+        if nivel != atual:
+            salvar_config("backup_nivel", nivel)
+        st.caption(f"Compressão em paralelo em {int(obter_config('backup_threads', 0) or os.cpu_count() or 1)} thread(s).")
 
     with col2:
         arq = st.file_uploader("Restaurar:", type=["zip", "json"])
         if arq and st.button("�� Restaurar", use_container_width=True):
-            ok, msg = restaurar(arq)
-            st.success(msg) if ok else st.error(msg)
+            caminho = JOBS_DIR / f"restaurar_{datetime.now():%Y%m%d_%H%M%S}_{arq.name}"
+            caminho.write_bytes(arq.getvalue())
+            runner.submeter("restaurar", job_restaurar, str(caminho), descricao=f"Restauração de {arq.name}")
+            st.toast("Restauração iniciada em segundo plano.")
+
+    st.markdown("---")
+    st.markdown("### ⏳ Tarefas")
+    tarefas_painel()
+
+    st.markdown("---")
+    st.markdown("### 🗄️ Armazenamento")
+    armazenamento_painel()
+
+    st.markdown("---")
+    st.markdown("### 🔁 Replicação")
+    replicacao_painel()
+
+    st.markdown("---")
+    st.markdown("### ⏱️ Latência por interação")
+    latencias_painel()
+
+    st.markdown("---")
+    st.markdown("### 🧠 Memória")
+    memoria_painel()
 
     st.markdown("---")
     st.markdown("""
@@ -552,6 +925,21 @@ elif st.session_state.pagina == "config":
 - ✅ Atualizações removidas
 - ✅ App focado na biblioteca (clientes/estudos/anexos)
 - ✅ Backup/restore do núcleo
+- ✅ Backup, restauração e uploads em segundo plano
+- ✅ Fragmentos: cliques reexecutam só o bloco afetado
+- ✅ Busca instantânea por prefixo (FTS5) com cache LRU
+- ✅ auto_vacuum incremental, compactação e relatório de armazenamento
+- ✅ Anexos comprimidos em repouso (zstd/zlib conforme o tipo)
+- ✅ Busca de clientes indexada (nome sem acentos / CNPJ normalizado)
+- ✅ Modo opcional com um arquivo SQLite por cliente (shards)
+- ✅ Log de alterações e réplica somente leitura por segmentos
+- ✅ Dashboard com agregados mantidos por gatilhos
+- ✅ Perfil de memória opcional por página, fragmento e função do núcleo
+- ✅ Biblioteca com seleção em lote: excluir, mover e alterar tags numa transação
+- ✅ Camada fria: anexos antigos e sem leitura em pacotes comprimidos fora do banco
+- ✅ Backup com compressão em paralelo e nível configurável
+- ✅ Dossiê do cliente em zip (estudos em Markdown/HTML e anexos), reaproveitado enquanto nada muda
+- ✅ Prévias dos anexos (planilhas, CSV, texto de PDF/DOCX e miniaturas) com cache em disco
 """)
 
 elif st.session_state.pagina == "estudo_view":
@@ -602,36 +990,7 @@ elif st.session_state.pagina == "estudo_view":
         st.markdown("---")
         st.markdown("### 📎 Anexos")
 
-        anexos = listar_anexos(estudo["id"])
-        if not anexos:
-            st.info("Nenhum anexo neste estudo.")
-        else:
-            for anx in anexos:
-                anx = dict(anx)
-                colA, colB, colC = st.columns([4, 1, 1])
-                with colA:
-                    st.markdown(f"📄 {anx['filename']}")
-                with colB:
-                    anexo_full = obter_anexo(anx["id"])
-                    if anexo_full:
-                        st.download_button(
-                            "⬇️",
-                            base64.b64decode(anexo_full["file_data"]),
-                            anx["filename"],
-                            anx["file_type"],
-                            key=f"dl_{anx['id']}"
-                        )
-                with colC:
-                    if st.button("🗑️", key=f"da_{anx['id']}"):
-                        excluir_anexo(anx["id"])
-                        st.rerun()
-
-        with st.form("f_upload", clear_on_submit=True):
-            novos = st.file_uploader("Adicionar:", accept_multiple_files=True)
-            if st.form_submit_button("📤 Upload") and novos:
-                for arq in novos:
-                    add_anexo(estudo["id"], arq.name, arq.type or "", arq.read(), arq.size)
-                st.rerun()
+        anexos_painel(estudo["id"])
 
         if st.button("← Voltar"):
             navegar("biblioteca")
@@ -639,3 +998,6 @@ elif st.session_state.pagina == "estudo_view":
 
 st.markdown("---")
 st.caption("⚖️ Biblioteca Tributária Pro v6.3 (Core) | © 2025 MP Solutions")
+
+registrar_latencia(f"app:{st.session_state.pagina}", (time.perf_counter() - INICIO_EXECUCAO) * 1000)
+memoria.fechar(MEMORIA_EXECUCAO, f"app:{st.session_state.pagina}")
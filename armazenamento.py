@@ -0,0 +1,193 @@
+"""Recuperação de espaço do SQLite (auto_vacuum incremental) e relatório de armazenamento."""
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+AUTO_VACUUM = {0: "NONE", 1: "FULL", 2: "INCREMENTAL"}
+
+
+def _conn(db_path, timeout=5):
+    conn = sqlite3.connect(str(db_path), timeout=timeout, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def preparar_banco_novo(conn):
+    """Em um arquivo ainda vazio o modo pode ser definido sem VACUUM."""
+    c = conn.cursor()
+    if c.execute("PRAGMA page_count").fetchone()[0] == 0:
+        c.execute("PRAGMA auto_vacuum=INCREMENTAL")
+
+
+def criar_gatilho(c, sql):
+    """CREATE TRIGGER IF NOT EXISTS que também troca um gatilho de mesmo nome com definição antiga;
+    retorna True quando havia uma definição antiga."""
+    sql = sql.strip()
+    nome = sql.split()[5]  # CREATE TRIGGER IF NOT EXISTS <nome> ...
+    atual = c.execute("SELECT sql FROM sqlite_master WHERE type='trigger' AND name=?", (nome,)).fetchone()
+    trocado = bool(atual) and atual[0] != sql.replace("IF NOT EXISTS ", "", 1)
+    if trocado:
+        c.execute(f"DROP TRIGGER {nome}")
+    c.execute(sql)
+    return trocado
+
+
+def paginas(conn):
+    c = conn.cursor()
+    return {
+        "page_size": c.execute("PRAGMA page_size").fetchone()[0],
+        "page_count": c.execute("PRAGMA page_count").fetchone()[0],
+        "freelist": c.execute("PRAGMA freelist_count").fetchone()[0],
+        "auto_vacuum": AUTO_VACUUM.get(c.execute("PRAGMA auto_vacuum").fetchone()[0], "?"),
+    }
+
+
+def compactar(db_path, progresso=None):
+    """VACUUM completo, migrando para auto_vacuum=INCREMENTAL. Retorna bytes liberados.
+
+    O VACUUM reescreve o arquivo dentro de uma transação (falha = banco intacto), mas
+    precisa de até 2x o tamanho em disco e de um banco íntegro; ambos são verificados antes.
+    """
+    db_path = Path(db_path)
+    antes = db_path.stat().st_size
+    livre = shutil.disk_usage(db_path.parent).free
+    if livre < 2 * antes:
+        raise RuntimeError(f"Espaço em disco insuficiente para compactar ({livre} B livres, {2 * antes} B necessários)")
+    conn = _conn(db_path, timeout=60)
+    try:
+        c = conn.cursor()
+        if progresso:
+            progresso(5, "verificando integridade")
+        ok = c.execute("PRAGMA quick_check").fetchone()[0]
+        if ok != "ok":
+            raise RuntimeError(f"quick_check falhou: {ok}")
+        if progresso:
+            progresso(20, "reescrevendo o arquivo")
+        c.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        c.execute("VACUUM")
+    finally:
+        conn.close()
+    return antes - db_path.stat().st_size
+
+
+def verificar(db_path):
+    """Resultado do quick_check: 'ok' ou as mensagens de erro juntas."""
+    conn = _conn(db_path, timeout=60)
+    try:
+        return "; ".join(r[0] for r in conn.cursor().execute("PRAGMA quick_check"))
+    finally:
+        conn.close()
+
+
+def vacuum_incremental(db_path, max_paginas=256):
+    """Devolve até `max_paginas` páginas livres ao sistema; não espera por locks."""
+    conn = _conn(db_path, timeout=0.1)
+    try:
+        c = conn.cursor()
+        if c.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        livres = c.execute("PRAGMA freelist_count").fetchone()[0]
+        if not livres:
+            return 0
+        # execute() do sqlite3 dá um único passo em pragmas sem colunas; executescript roda até o fim
+        c.executescript(f"PRAGMA incremental_vacuum({int(max_paginas)})")
+        return livres - c.execute("PRAGMA freelist_count").fetchone()[0]
+    except sqlite3.OperationalError:
+        # banco ocupado: tenta de novo no próximo ciclo
+        return 0
+    finally:
+        conn.close()
+
+
+class ManutencaoOcioso:
+    """Thread que roda passos de incremental_vacuum quando o banco está sem escritas há um tempo.
+
+    `arquivos` é um caminho ou uma função que devolve a lista atual de arquivos (modo shards).
+    """
+
+    def __init__(self, arquivos, ocioso_seg=60, intervalo_seg=15, max_paginas=256):
+        self._arquivos = arquivos if callable(arquivos) else (lambda: [arquivos])
+        self.ocioso_seg = ocioso_seg
+        self.intervalo_seg = intervalo_seg
+        self.max_paginas = max_paginas
+        self.paginas_liberadas = 0
+        self.ultimo_passo = None
+        self._mtime_proprio = {}
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="vacuum-ocioso", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _ultima_escrita(db_path):
+        arquivos = (Path(db_path), Path(f"{db_path}-wal"))
+        return max((p.stat().st_mtime for p in arquivos if p.exists()), default=0)
+
+    def _loop(self):
+        while not self._parar.wait(self.intervalo_seg):
+            for db_path in self._arquivos():
+                ultima = self._ultima_escrita(db_path)
+                # a escrita feita pelo próprio passo anterior não conta como atividade
+                if ultima > self._mtime_proprio.get(db_path, 0) and time.time() - ultima < self.ocioso_seg:
+                    continue
+                n = vacuum_incremental(db_path, self.max_paginas)
+                if n:
+                    self.paginas_liberadas += n
+                    self.ultimo_passo = time.time()
+                    self._mtime_proprio[db_path] = self._ultima_escrita(db_path)
+
+    def parar(self):
+        self._parar.set()
+
+
+def bytes_armazenados(a):
+    """Expressão SQL do tamanho armazenado do anexo `a` sem ler o conteúdo (relatório e agregados)."""
+    # length() de BLOB vem do cabeçalho do registro, mas em TEXT conta caracteres e lê o valor inteiro:
+    # anexos antigos em base64 (TEXT) contam pelo tamanho do base64 de file_size; frios, pelo pacote
+    return (f"COALESCE({a}.pacote_tam, CASE typeof({a}.file_data) WHEN 'blob' THEN length({a}.file_data)"
+            f" WHEN 'text' THEN 4 * (({a}.file_size + 2) / 3) END, 0)")
+
+
+def relatorio(conn, top=10):
+    c = conn.cursor()
+    info = paginas(conn)
+    info["bytes_total"] = info["page_size"] * info["page_count"]
+    info["bytes_livres"] = info["page_size"] * info["freelist"]
+    info["razao_livre"] = info["freelist"] / info["page_count"] if info["page_count"] else 0.0
+
+    # dbstat traz páginas por b-tree; índices (e tabelas-sombra do FTS) são somados à tabela dona
+    donos = {r["name"]: r["tbl_name"] for r in c.execute("SELECT name, tbl_name FROM sqlite_master")}
+    por_tabela = {}
+    try:
+        for r in c.execute("SELECT name, SUM(pgsize) AS bytes FROM dbstat GROUP BY name"):
+            dono = donos.get(r["name"], r["name"])
+            if dono.startswith("estudos_fts"):
+                dono = "estudos_fts"
+            por_tabela[dono] = por_tabela.get(dono, 0) + r["bytes"]
+    except sqlite3.OperationalError:
+        pass
+    info["por_tabela"] = sorted(
+        ({"tabela": k, "bytes": v} for k, v in por_tabela.items()), key=lambda x: -x["bytes"]
+    )
+
+    info["por_cliente"] = [dict(r) for r in c.execute(
+        f"""SELECT cl.id, cl.nome,
+                  COUNT(DISTINCT e.id) AS estudos,
+                  COUNT(a.id) AS anexos,
+                  COALESCE(SUM({bytes_armazenados("a")}), 0) AS bytes_anexos
+           FROM clientes cl
+           LEFT JOIN estudos e ON e.cliente_id=cl.id
+           LEFT JOIN anexos a ON a.estudo_id=e.id
+           GROUP BY cl.id ORDER BY bytes_anexos DESC"""
+    )]
+    info["maiores_anexos"] = [dict(r) for r in c.execute(
+        f"""SELECT a.id, a.filename, a.file_size, {bytes_armazenados("a")} AS bytes_armazenados,
+                  e.titulo AS estudo, cl.nome AS cliente
+           FROM anexos a
+           LEFT JOIN estudos e ON a.estudo_id=e.id
+           LEFT JOIN clientes cl ON e.cliente_id=cl.id
+           ORDER BY bytes_armazenados DESC LIMIT ?""",
+        (top,)
+    )]
+    return info
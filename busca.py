@@ -0,0 +1,135 @@
+"""Índice de busca por prefixo (FTS5) dos estudos e cache LRU compartilhado entre sessões."""
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+
+TOKEN = re.compile(r"\w+", re.UNICODE)
+
+SCHEMA = [
+    # prefix='2 3 4' cria índices auxiliares para consultas "tri"* sem varrer o vocabulário
+    """CREATE VIRTUAL TABLE IF NOT EXISTS estudos_fts USING fts5(
+        titulo, tags, cliente, resumo,
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3 4'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS estudos_fts_ai AFTER INSERT ON estudos BEGIN
+        INSERT INTO estudos_fts (rowid, titulo, tags, cliente, resumo)
+        VALUES (new.id, new.titulo, new.tags, (SELECT nome FROM clientes WHERE id=new.cliente_id), new.resumo);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS estudos_fts_au AFTER UPDATE ON estudos BEGIN
+        DELETE FROM estudos_fts WHERE rowid=old.id;
+        INSERT INTO estudos_fts (rowid, titulo, tags, cliente, resumo)
+        VALUES (new.id, new.titulo, new.tags, (SELECT nome FROM clientes WHERE id=new.cliente_id), new.resumo);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS estudos_fts_ad AFTER DELETE ON estudos BEGIN
+        DELETE FROM estudos_fts WHERE rowid=old.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS clientes_fts_au AFTER UPDATE OF nome ON clientes BEGIN
+        UPDATE estudos_fts SET cliente=new.nome
+        WHERE rowid IN (SELECT id FROM estudos WHERE cliente_id=new.id);
+    END""",
+]
+
+
+def init_fts(conn):
+    """Cria o índice e os gatilhos; popula a partir de `estudos` quando o índice é novo.
+
+    Retorna False se o SQLite não tiver FTS5 (a busca cai para LIKE).
+    """
+    c = conn.cursor()
+    try:
+        novo = not c.execute(
+            "SELECT 1 FROM sqlite_master WHERE name='estudos_fts'"
+        ).fetchone()
+        for sql in SCHEMA:
+            c.execute(sql)
+    except sqlite3.OperationalError:
+        return False
+    if novo:
+        reindexar(conn)
+    return True
+
+
+def reindexar(conn):
+    c = conn.cursor()
+    c.execute("DELETE FROM estudos_fts")
+    c.execute(
+        """INSERT INTO estudos_fts (rowid, titulo, tags, cliente, resumo)
+           SELECT e.id, e.titulo, e.tags, c.nome, e.resumo
+           FROM estudos e LEFT JOIN clientes c ON e.cliente_id=c.id"""
+    )
+
+
+def consulta_prefixo(termo):
+    """'pace aut' -> '"pace"* "aut"*' (todas as palavras, a última ainda sendo digitada)."""
+    return " ".join(f'"{t}"*' for t in TOKEN.findall(termo))
+
+
+class CacheLRU:
+    """LRU de termo -> ids, descartado inteiro quando a versão do banco muda."""
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._dados = OrderedDict()
+        self._versao = None
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.faltas = 0
+
+    def obter(self, chave, versao):
+        with self._lock:
+            if versao != self._versao:
+                self._dados.clear()
+                self._versao = versao
+            if chave in self._dados:
+                self._dados.move_to_end(chave)
+                self.acertos += 1
+                return self._dados[chave]
+            self.faltas += 1
+            return None
+
+    def guardar(self, chave, versao, valor):
+        with self._lock:
+            if versao != self._versao:
+                return
+            self._dados[chave] = valor
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.maxsize:
+                self._dados.popitem(last=False)
+
+    def limpar(self):
+        with self._lock:
+            self._dados.clear()
+
+
+cache = CacheLRU()
+
+
+def buscar_ids(conn, termo, versao=None, limite=200):
+    """Ids dos estudos que casam com `termo`, mais recentes primeiro; usa o cache quando `versao` é dada."""
+    chave = (termo.strip().lower(), limite)
+    if versao is not None:
+        ids = cache.obter(chave, versao)
+        if ids is not None:
+            return ids
+    c = conn.cursor()
+    q = consulta_prefixo(termo)
+    if not q:
+        ids = []
+    else:
+        try:
+            ids = [r[0] for r in c.execute(
+                # ORDER BY rank calcularia bm25 para todos os casamentos de um prefixo curto
+                "SELECT rowid FROM estudos_fts WHERE estudos_fts MATCH ? ORDER BY rowid DESC LIMIT ?", (q, limite)
+            )]
+        except sqlite3.OperationalError:
+            ids = [r[0] for r in c.execute(
+                """SELECT e.id FROM estudos e JOIN clientes c ON e.cliente_id=c.id
+                   WHERE e.titulo LIKE ? OR e.resumo LIKE ? OR e.tags LIKE ?
+                   ORDER BY e.created_at DESC LIMIT ?""",
+                (f"%{termo}%", f"%{termo}%", f"%{termo}%", limite)
+            )]
+    if versao is not None:
+        cache.guardar(chave, versao, ids)
+    return ids
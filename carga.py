@@ -0,0 +1,436 @@
+"""Teste de carga: N sessões simultâneas percorrendo fluxos reais contra um banco gerado.
+
+    python carga.py --sessoes 1,4,8,16 --acoes 40 --slo-ms 1500
+    python carga.py --alvo api --sessoes 8,32,64 --json carga_v6.3.json --rotulo v6.3
+
+Alvos:
+  app  cada sessão é um `AppTest` do app.py em um processo próprio (o AppTest não roda em
+       threads); páginas são medidas pela reexecução do script.
+  api  cada sessão é uma thread com conexão keep-alive ao api.py, iniciado em um subprocesso.
+Downloads, uploads e criação de estudos passam por core.py nos dois alvos (a API é somente leitura).
+
+O banco é gerado uma vez a partir de --semente em --dir e copiado antes de cada rodada, então
+rodadas e versões diferentes medem a mesma carga. O relatório traz p50/p95/p99 por página/ação,
+vazão, erros de lock e pico de RSS; a capacidade é o maior número de sessões (da lista, em ordem)
+com p95 geral dentro de --slo-ms e nenhum erro.
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import queue
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from urllib.parse import quote_plus
+
+RAIZ = Path(__file__).resolve().parent
+PALAVRAS = (
+    "icms pis cofins iss ipi irpj csll substituição tributária crédito presumido diferimento "
+    "exportação importação drawback simples nacional lucro real presumido retenção fonte "
+    "benefício fiscal convênio regime especial alíquota base cálculo não cumulatividade"
+).split()
+FLUXOS = {
+    "app": {"biblioteca": 3, "busca": 3, "estudo_view": 3, "dashboard": 1, "download": 2, "upload": 1, "criar_estudo": 1},
+    "api": {"biblioteca": 3, "busca": 3, "estudo_view": 3, "clientes": 1, "download": 2, "upload": 1, "criar_estudo": 1},
+}
+
+
+def percentil(v, q):
+    return v[min(len(v) - 1, int(len(v) * q))] if v else 0.0
+
+
+def _erro_lock(msg):
+    return "locked" in msg or "busy" in msg
+
+
+# ==================== BANCO SINTÉTICO ====================
+def _texto(rnd, n):
+    return " ".join(rnd.choice(PALAVRAS) for _ in range(n))
+
+
+def _arquivo(rnd, tamanho):
+    # metade texto (comprimível), metade binário
+    if rnd.random() < 0.5:
+        return f"parecer_{rnd.randint(1, 99999)}.txt", "text/plain", _texto(rnd, tamanho // 8).encode()[:tamanho]
+    return f"anexo_{rnd.randint(1, 99999)}.pdf", "application/pdf", rnd.randbytes(tamanho)
+
+
+def gerar_banco(core, args):
+    rnd = random.Random(args.semente)
+    core.init_db()
+    cids = [core.criar_cliente(f"{_texto(rnd, 2).title()} Ltda {i}", f"{rnd.randrange(10**13):014d}") for i in range(args.clientes)]
+    eids = []
+    for i in range(args.estudos):
+        eids.append(core.criar_estudo(
+            rnd.choice(cids), _texto(rnd, 6).capitalize(), _texto(rnd, 80), ", ".join(rnd.sample(PALAVRAS, 3))
+        ))
+    for i in range(args.anexos):
+        nome, tipo, dados = _arquivo(rnd, int(args.tamanho_kb * 1024 * rnd.uniform(0.5, 1.5)))
+        core.add_anexo(rnd.choice(eids), nome, tipo, dados, len(dados))
+        if i % 100 == 0:
+            print(f"  anexos {i}/{args.anexos}", end="\r", flush=True)
+    print(f"  banco: {args.clientes} clientes, {args.estudos} estudos, {args.anexos} anexos")
+
+
+def amostras(core, semente):
+    """Ids e termos sorteados pelas sessões (lidos uma vez, antes da rodada)."""
+    rnd = random.Random(semente)
+    estudos = [(e["id"], e["cliente_id"]) for e in core.listar_estudos()]
+    anexos = []
+    for eid, _ in rnd.sample(estudos, min(len(estudos), 300)):
+        anexos += [a["id"] for a in core.listar_anexos(eid)]
+    termos = [" ".join(rnd.sample(PALAVRAS, rnd.choice((1, 1, 2))))[:rnd.randint(3, 12)] for _ in range(50)]
+    return {"estudos": estudos, "anexos": anexos or [None], "termos": termos}
+
+
+# ==================== AÇÕES ====================
+class Sessao:
+    """Executa as ações de uma sessão e anota (ação, ms, erro)."""
+
+    def __init__(self, indice, alvo, amostra, acoes, pausa_ms, semente):
+        self.alvo = alvo
+        self.amostra = amostra
+        self.acoes = acoes
+        self.pausa = pausa_ms / 1000
+        self.rnd = random.Random(semente * 1000 + indice)
+        self.medidas = []
+
+    def sortear(self):
+        fluxos = FLUXOS[self.alvo]
+        return self.rnd.choices(list(fluxos), weights=list(fluxos.values()))[0]
+
+    def medir(self, acao, func):
+        inicio = time.perf_counter()
+        try:
+            erro = func()
+        except Exception as e:
+            erro = f"{type(e).__name__}: {e}"
+        self.medidas.append((acao, (time.perf_counter() - inicio) * 1000, erro))
+
+    def executar(self, pagina):
+        for _ in range(self.acoes):
+            acao = self.sortear()
+            func = getattr(self, f"_{acao}", None) or (lambda: pagina(acao))
+            self.medir(acao, func)
+            if self.pausa:
+                time.sleep(self.pausa * self.rnd.uniform(0.5, 1.5))
+
+    # escritas e downloads: sempre pelo core
+    def _download(self):
+        import core
+        aid = self.rnd.choice(self.amostra["anexos"])
+        if aid is not None:
+            for _ in core.iterar_anexo(aid):
+                pass
+
+    def _upload(self):
+        import core
+        eid, _ = self.rnd.choice(self.amostra["estudos"])
+        nome, tipo, dados = _arquivo(self.rnd, self.rnd.randint(8, 256) * 1024)
+        core.add_anexo(eid, nome, tipo, dados, len(dados))
+
+    def _criar_estudo(self):
+        import core
+        _, cid = self.rnd.choice(self.amostra["estudos"])
+        core.criar_estudo(cid, _texto(self.rnd, 6).capitalize(), _texto(self.rnd, 80), ", ".join(self.rnd.sample(PALAVRAS, 3)))
+
+
+def _sessao_app(indice, args, amostra, barreira, fila):
+    """Processo de uma sessão do alvo app."""
+    from streamlit import logger
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(str(RAIZ / "app.py"), default_timeout=120)
+    at.run()  # aquecimento (import, init_db, caches de recurso) fora da medida
+    # depois da primeira execução, que aplica a configuração: avisos do modo bare se repetiriam a cada ação
+    logger.set_log_level("error")
+    s = Sessao(indice, "app", amostra, args.acoes, args.pausa_ms, args.semente)
+
+    def pagina(acao):
+        estado = at.session_state
+        if acao == "busca":
+            estado["pagina"] = "biblioteca"
+            estado["busca_biblioteca"] = s.rnd.choice(amostra["termos"])
+        elif acao == "estudo_view":
+            estado["estudo_id"], estado["cliente_id"] = s.rnd.choice(amostra["estudos"])
+            estado["pagina"] = "estudo_view"
+        else:
+            estado["pagina"] = acao
+            if acao == "biblioteca":
+                estado["busca_biblioteca"] = ""
+        at.run()
+        if at.exception:
+            return at.exception[0].message
+
+    barreira.wait()
+    inicio = time.time()
+    s.executar(pagina)
+    fila.put({"indice": indice, "medidas": s.medidas, "inicio": inicio, "fim": time.time(),
+              "rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss})
+
+
+def _sessao_app_protegida(indice, args, amostra, barreira, fila):
+    try:
+        _sessao_app(indice, args, amostra, barreira, fila)
+    except threading.BrokenBarrierError:
+        fila.put({"indice": indice, "falha": "abortada: outra sessão falhou antes do início"})
+    except BaseException as e:
+        fila.put({"indice": indice, "falha": f"{type(e).__name__}: {e}"})
+        raise
+
+
+def rodada_app(args, amostra, n):
+    ctx = multiprocessing.get_context("spawn")
+    barreira, fila = ctx.Barrier(n, timeout=args.limite_s), ctx.Queue()
+    procs = [ctx.Process(target=_sessao_app_protegida, args=(i, args, amostra, barreira, fila)) for i in range(n)]
+    for p in procs:
+        p.start()
+    # uma sessão que morre (importação, OOM, sinal) não responde nunca: sem prazo e sem olhar o
+    # exitcode, as outras ficariam presas na barreira e esta espera, para sempre
+    respostas = {}
+    limite = time.monotonic() + args.limite_s
+    try:
+        while len(respostas) < n:
+            try:
+                r = fila.get(timeout=1)
+                respostas[r["indice"]] = r
+                continue
+            except queue.Empty:
+                pass
+            for i, p in enumerate(procs):
+                # quem saiu já entregou o que tinha na fila: a espera acima a esvazia primeiro
+                if i not in respostas and p.exitcode is not None and fila.empty():
+                    respostas[i] = {"indice": i, "falha": f"processo saiu com código {p.exitcode} sem resultado"}
+            if any("falha" in r for r in respostas.values()):
+                barreira.abort()
+            if time.monotonic() > limite:
+                for i in set(range(n)) - set(respostas):
+                    respostas[i] = {"indice": i, "falha": f"sem resultado em {args.limite_s:.0f} s"}
+    finally:
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+            p.join()
+    resultados = [r for r in respostas.values() if "falha" not in r]
+    falhas = [f"sessão {i}: {r['falha']}" for i, r in sorted(respostas.items()) if "falha" in r]
+    return resultados, {"rss_pico_kb": max((r["rss_kb"] for r in resultados), default=0),
+                        "rss_soma_kb": sum(r["rss_kb"] for r in resultados), "falhas": falhas}
+
+
+def _porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _pico_rss_kb(pid):
+    try:
+        for linha in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if linha.startswith("VmHWM:"):
+                return int(linha.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def rodada_api(args, amostra, n):
+    porta = _porta_livre()
+    srv = subprocess.Popen(
+        [sys.executable, str(RAIZ / "api.py"), "--porta", str(porta), "--workers", str(args.workers)],
+        stdout=subprocess.DEVNULL, cwd=str(RAIZ)
+    )
+    try:
+        for _ in range(100):
+            if srv.poll() is not None:
+                raise RuntimeError(f"api.py saiu com código {srv.returncode} antes de atender")
+            try:
+                socket.create_connection(("127.0.0.1", porta), timeout=0.1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        else:
+            # medir daqui em diante só anotaria recusas de conexão como latência
+            raise RuntimeError(f"api.py não atendeu na porta {porta} em 10 s")
+        barreira = threading.Barrier(n)
+        resultados = []
+
+        def sessao(indice):
+            s = Sessao(indice, "api", amostra, args.acoes, args.pausa_ms, args.semente)
+            conn = http.client.HTTPConnection("127.0.0.1", porta, timeout=60)
+
+            def get(caminho):
+                try:
+                    conn.request("GET", caminho)
+                    r = conn.getresponse()
+                    corpo = r.read()
+                except Exception:
+                    conn.close()  # a próxima requisição reabre a conexão
+                    raise
+                if r.status >= 400:
+                    return f"HTTP {r.status}: {corpo[:200].decode(errors='replace')}"
+
+            def pagina(acao):
+                if acao == "busca":
+                    return get(f"/busca?q={quote_plus(s.rnd.choice(amostra['termos']))}&limite=50")
+                if acao == "estudo_view":
+                    return get(f"/estudos/{s.rnd.choice(amostra['estudos'])[0]}")
+                if acao == "clientes":
+                    return get("/clientes?limite=50")
+                return get("/estudos?limite=50")
+
+            def download():
+                aid = s.rnd.choice(amostra["anexos"])
+                return get(f"/anexos/{aid}/conteudo") if aid is not None else None
+
+            s._download = download
+            barreira.wait()
+            inicio = time.time()
+            s.executar(pagina)
+            conn.close()
+            resultados.append({"medidas": s.medidas, "inicio": inicio, "fim": time.time()})
+
+        threads = [threading.Thread(target=sessao, args=(i,)) for i in range(n)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if srv.poll() is not None:
+            raise RuntimeError(f"api.py caiu durante a rodada (código {srv.returncode})")
+        rss = _pico_rss_kb(srv.pid)
+    finally:
+        srv.terminate()
+        srv.wait()
+    return resultados, {"rss_pico_kb": rss}
+
+
+# ==================== RELATÓRIO ====================
+def resumir(n, resultados, extra):
+    por_acao = {}
+    erros = [("sessão", f) for f in extra.get("falhas", [])]
+    for r in resultados:
+        for acao, ms, erro in r["medidas"]:
+            por_acao.setdefault(acao, []).append(ms)
+            if erro:
+                erros.append((acao, erro))
+    duracao = max((r["fim"] for r in resultados), default=0) - min((r["inicio"] for r in resultados), default=0)
+    todas = sorted(ms for v in por_acao.values() for ms in v)
+    linhas = {}
+    for acao, v in sorted(por_acao.items()):
+        v.sort()
+        linhas[acao] = {
+            "n": len(v),
+            "p50": round(percentil(v, 0.50), 1),
+            "p95": round(percentil(v, 0.95), 1),
+            "p99": round(percentil(v, 0.99), 1),
+            "erros": sum(1 for a, _ in erros if a == acao),
+        }
+    return {
+        "sessoes": n,
+        "acoes": len(todas),
+        "duracao_s": round(duracao, 2),
+        "vazao_acoes_s": round(len(todas) / duracao, 1) if duracao else 0.0,
+        "p50": round(percentil(todas, 0.50), 1),
+        "p95": round(percentil(todas, 0.95), 1),
+        "p99": round(percentil(todas, 0.99), 1),
+        "erros": len(erros),
+        "erros_lock": sum(1 for _, e in erros if _erro_lock(e)),
+        "exemplos_erro": (extra.get("falhas", []) + sorted({e for a, e in erros if a != "sessão"}))[:5],
+        "por_acao": linhas,
+        **extra,
+    }
+
+
+def imprimir(r):
+    rss = f"{r['rss_pico_kb'] / 1024:.0f} MB"
+    if "rss_soma_kb" in r:
+        rss += f" por sessão ({r['rss_soma_kb'] / 1024:.0f} MB somando os processos)"
+    print(f"\n== {r['sessoes']} sessão(ões): {r['acoes']} ações em {r['duracao_s']} s "
+          f"→ {r['vazao_acoes_s']} ações/s · p95 {r['p95']} ms · erros {r['erros']} (lock {r['erros_lock']}) · RSS {rss}")
+    print(f"   {'ação':<14}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'erros':>7}")
+    for acao, l in r["por_acao"].items():
+        print(f"   {acao:<14}{l['n']:>6}{l['p50']:>10}{l['p95']:>10}{l['p99']:>10}{l['erros']:>7}")
+    for e in r["exemplos_erro"]:
+        print(f"   ⚠️ {e[:160]}")
+
+
+def _versao_codigo():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=RAIZ,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--alvo", choices=["app", "api"], default="app")
+    ap.add_argument("--sessoes", default="1,2,4,8", help="lista de rodadas (sessões simultâneas)")
+    ap.add_argument("--acoes", type=int, default=30, help="ações por sessão")
+    ap.add_argument("--pausa-ms", type=int, default=0, help="tempo de leitura médio entre ações")
+    ap.add_argument("--slo-ms", type=float, default=1500, help="p95 máximo aceito para a capacidade")
+    ap.add_argument("--dir", default="data_carga", help="onde o banco sintético é gerado e reutilizado")
+    ap.add_argument("--semente", type=int, default=42)
+    ap.add_argument("--clientes", type=int, default=100)
+    ap.add_argument("--estudos", type=int, default=1000)
+    ap.add_argument("--anexos", type=int, default=500)
+    ap.add_argument("--tamanho-kb", type=int, default=64, help="tamanho médio dos anexos")
+    ap.add_argument("--workers", type=int, default=8, help="threads do api.py (alvo api)")
+    ap.add_argument("--limite-s", type=float, default=1800, help="tempo máximo de uma rodada (alvo app)")
+    ap.add_argument("--json", help="grava o relatório completo neste arquivo")
+    ap.add_argument("--rotulo", help="identificação da versão no relatório")
+    args = ap.parse_args()
+
+    base = Path(args.dir).resolve() / "base"
+    atual = Path(args.dir).resolve() / "atual"
+    # core lê BIBLIOTECA_DATA_DIR na importação; sessões (processos/servidor) herdam o ambiente
+    os.environ["BIBLIOTECA_DATA_DIR"] = str(atual)
+    sys.path.insert(0, str(RAIZ))
+    import core
+
+    if not base.exists():
+        print(f"Gerando banco sintético em {base} (semente {args.semente})...")
+        shutil.rmtree(atual, ignore_errors=True)
+        gerar_banco(core, args)
+        shutil.copytree(atual, base)
+
+    rodadas = []
+    for n in [int(x) for x in args.sessoes.split(",")]:
+        shutil.rmtree(atual, ignore_errors=True)
+        shutil.copytree(base, atual)
+        amostra = amostras(core, args.semente)
+        try:
+            resultados, extra = (rodada_app if args.alvo == "app" else rodada_api)(args, amostra, n)
+        except RuntimeError as e:
+            print(f"\n❌ Rodada de {n} sessão(ões) interrompida: {e}")
+            break
+        r = resumir(n, resultados, extra)
+        imprimir(r)
+        rodadas.append(r)
+
+    capacidade = 0
+    for r in rodadas:
+        if r["erros"] or r["p95"] > args.slo_ms:
+            break
+        capacidade = r["sessoes"]
+    print(f"\n📈 Capacidade ({args.alvo}, p95 ≤ {args.slo_ms:.0f} ms, sem erros): {capacidade} sessão(ões) simultânea(s)")
+
+    if args.json:
+        relatorio = {
+            "rotulo": args.rotulo, "codigo": _versao_codigo(), "data": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "alvo": args.alvo, "parametros": {k: v for k, v in vars(args).items() if k not in ("json", "rotulo")},
+            "capacidade": capacidade, "rodadas": rodadas,
+        }
+        Path(args.json).write_text(json.dumps(relatorio, ensure_ascii=False, indent=2))
+        print(f"Relatório em {args.json}")
+
+
+if __name__ == "__main__":
+    main()
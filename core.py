@@ -0,0 +1,1353 @@
+"""Camada de dados da biblioteca (clientes, estudos, anexos, backup), sem dependência do Streamlit.
+
+Importar este módulo não toca no banco; chame `init_db()` antes do primeiro uso.
+"""
+import base64
+import hashlib
+import heapq
+import io
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unicodedata
+import weakref
+import zipfile
+from datetime import datetime
+from itertools import count, groupby, islice
+from pathlib import Path
+
+import analise
+import armazenamento
+import busca as indice_busca
+import compressao
+import dossie
+import memoria
+import pacotes
+import previa
+import replicacao
+import shards
+
+DATA_DIR = Path(os.environ.get("BIBLIOTECA_DATA_DIR", "data"))
+DB_PATH = DATA_DIR / "biblioteca.db"
+JOBS_DIR = DATA_DIR / "jobs"
+# progresso das tarefas fica fora do banco principal para não disputar o lock de escrita
+JOBS_DB_PATH = JOBS_DIR / "jobs.db"
+# segmentos do log de alterações; aponte para um diretório compartilhado com as réplicas
+REPLICACAO_DIR = Path(os.environ.get("BIBLIOTECA_REPLICACAO_DIR") or DATA_DIR / "replicacao")
+# pacotes com o conteúdo dos anexos frios (antigos e sem leitura recente)
+FRIO_DIR = Path(os.environ.get("BIBLIOTECA_FRIO_DIR") or DATA_DIR / "frio")
+# zips de dossiê por cliente, reaproveitados enquanto o cliente não muda
+DOSSIES_DIR = DATA_DIR / "dossies"
+# prévias dos anexos (cache LRU em disco pelo sha256 do conteúdo)
+PREVIAS_DIR = DATA_DIR / "previas"
+
+# ==================== DATABASE ====================
+# modo opcional com um arquivo por cliente; ativo quando o catálogo existe (python shards.py migrar)
+SHARDS = shards.Layout(DATA_DIR / "shards")
+PACOTES = pacotes.Pacotes(FRIO_DIR)
+PREVIAS = previa.CachePrevias(PREVIAS_DIR)
+_esquemas_prontos = set()
+# colunas cuja alteração muda o que a interface mostra (gatilhos de versao_dados)
+VERSIONADAS = {
+    "clientes": "nome, cnpj, observacoes",
+    "estudos": "cliente_id, titulo, resumo, tags",
+    "anexos": "estudo_id, filename, file_type, file_data, codec, pacote",
+}
+# neste processo, ninguém abre conexão no meio da troca de diretórios; só protege a abertura em si
+_troca_shards = threading.Lock()
+_abertas = weakref.WeakSet()  # conexões ainda abertas, drenadas antes da troca (ver _drenar_shards)
+
+class _Conexao(sqlite3.Connection):
+    def close(self):
+        _abertas.discard(self)
+        super().close()
+
+def _conectar(caminho):
+    caminho = Path(caminho)
+    no_diretorio = caminho.parent == SHARDS.diretorio
+    while True:
+        if no_diretorio:
+            SHARDS.aguardar_troca()  # sem segurar o lock: a troca pode levar segundos
+        with _troca_shards:
+            # a marca pode ter aparecido entre a espera e o lock; depois dele, _drenar_shards já nos vê
+            if no_diretorio and SHARDS.marca_troca.exists():
+                continue
+            conn = sqlite3.connect(str(caminho), check_same_thread=False, factory=_Conexao)
+            conn.row_factory = sqlite3.Row
+            conn.caminho = caminho
+            _abertas.add(conn)
+            return conn
+
+def _drenar_shards(espera=10):
+    """Chamada por SHARDS.trocar com a marca já criada: as conexões abertas no diretório têm `espera`
+    segundos para fechar; as que seguem ocupadas são interrompidas e, se ainda assim não fecharem,
+    a troca é cancelada (fechá-las de outra thread no meio de um comando não é seguro)."""
+    with _troca_shards:
+        pass  # quem passou pela verificação da marca antes dela existir já se registrou
+    for tentativa in (espera, 1):
+        limite = time.monotonic() + tentativa
+        while True:
+            abertas = [c for c in list(_abertas) if c.caminho.parent == SHARDS.diretorio]
+            if not abertas or time.monotonic() >= limite:
+                break
+            time.sleep(0.02)
+        if not abertas:
+            return
+        for c in abertas:
+            c.interrupt()
+    raise RuntimeError(f"{len(abertas)} conexão(ões) com os shards ainda em uso; restauração não aplicada")
+
+def get_conn():
+    """Banco principal: o arquivo único ou, no modo shards, o catálogo (clientes e configurações)."""
+    return _conectar(SHARDS.catalogo if SHARDS.ativo() else DB_PATH)
+
+def conn_cliente(cid):
+    """Conexão com o banco que guarda os estudos e anexos do cliente."""
+    if not SHARDS.ativo():
+        return get_conn()
+    caminho = SHARDS.caminho(cid)
+    conn = _conectar(caminho)
+    if caminho not in _esquemas_prontos:
+        criar_esquema(conn)
+        conn.commit()
+        _esquemas_prontos.add(caminho)
+    return conn
+
+def conn_estudo(eid):
+    cid = SHARDS.cliente_de("estudos", eid) if SHARDS.ativo() else None
+    # id desconhecido cai no catálogo, cujas tabelas de estudos/anexos ficam vazias
+    return conn_cliente(cid) if cid else get_conn()
+
+def conn_anexo(aid):
+    cid = SHARDS.cliente_de("anexos", aid) if SHARDS.ativo() else None
+    return conn_cliente(cid) if cid else get_conn()
+
+def fatias_dados():
+    """Clientes com arquivo próprio, para `conn_cliente`; fora do modo shards, [None] = banco principal."""
+    return SHARDS.clientes() if SHARDS.ativo() else [None]
+
+def arquivos_banco():
+    return SHARDS.arquivos() if SHARDS.ativo() else [DB_PATH]
+
+def adicionar_coluna(c, tabela, coluna, tipo):
+    if coluna not in {r[1] for r in c.execute(f"PRAGMA table_info({tabela})")}:
+        c.execute(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {tipo}")
+
+def colunas(c, tabela, schema="main"):
+    return [r[1] for r in c.execute(f"PRAGMA {schema}.table_info({tabela})")]
+
+def copiar_linha(c, tabela, linha):
+    """Grava `linha` (sqlite3.Row) em `tabela`, só com as colunas que existem nos dois lados."""
+    destino = set(colunas(c, tabela))
+    cols = [k for k in linha.keys() if k in destino]
+    c.execute(f"INSERT OR REPLACE INTO {tabela} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+              [linha[k] for k in cols])
+
+def normalizar_cnpj(cnpj):
+    """'11.135.153/0001-09' -> '11135153000109'; vazio -> None."""
+    return re.sub(r"\D", "", cnpj or "") or None
+
+def dobrar_acentos(texto):
+    """Forma usada no índice de nomes: minúsculas, sem acentos e com espaços simples."""
+    texto = unicodedata.normalize("NFKD", texto or "")
+    return " ".join("".join(ch for ch in texto if not unicodedata.combining(ch)).lower().split())
+
+def init_db():
+    """Mantém compatibilidade com banco antigo (tabelas extras podem existir)."""
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    conn = get_conn()
+    criar_esquema(conn)
+    if SHARDS.ativo():
+        SHARDS.init_catalogo(conn)
+    conn.commit()
+    conn.close()
+
+def criar_esquema(conn):
+    """Tabelas, colunas novas e índices; o mesmo esquema serve ao banco único, ao catálogo e aos shards."""
+    armazenamento.preparar_banco_novo(conn)
+    c = conn.cursor()
+
+    c.execute("""CREATE TABLE IF NOT EXISTS clientes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nome TEXT NOT NULL,
+        cnpj TEXT,
+        observacoes TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+
+    c.execute("""CREATE TABLE IF NOT EXISTS estudos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        cliente_id INTEGER NOT NULL,
+        titulo TEXT NOT NULL,
+        resumo TEXT NOT NULL,
+        tags TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+
+    c.execute("""CREATE TABLE IF NOT EXISTS anexos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        estudo_id INTEGER NOT NULL,
+        filename TEXT NOT NULL,
+        file_type TEXT NOT NULL,
+        file_data TEXT NOT NULL,
+        file_size INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+
+    # codec NULL = legado (base64 em texto); demais valores guardam bytes (BLOB) no file_data
+    adicionar_coluna(c, "anexos", "codec", "TEXT")
+    # hash do conteúdo original (ETag da API); anexos antigos são preenchidos sob demanda
+    adicionar_coluna(c, "anexos", "sha256", "TEXT")
+    # camada fria: com `pacote` preenchido o conteúdo está em FRIO_DIR e o file_data fica vazio
+    adicionar_coluna(c, "anexos", "pacote", "TEXT")
+    adicionar_coluna(c, "anexos", "pacote_pos", "INTEGER")
+    adicionar_coluna(c, "anexos", "pacote_tam", "INTEGER")
+    # última leitura, gravada no máximo uma vez por dia; decide o que esfria e o que volta ao banco
+    adicionar_coluna(c, "anexos", "acessado_em", "TIMESTAMP")
+    # candidatos da camada fria sem percorrer as linhas (e os BLOBs) de anexos
+    c.execute("CREATE INDEX IF NOT EXISTS idx_anexos_quentes ON anexos(created_at, acessado_em) WHERE pacote IS NULL")
+    # páginas de anexos de um estudo na ordem da listagem (o rowid desempata), sem ordenar nem varrer
+    c.execute("CREATE INDEX IF NOT EXISTS idx_anexos_estudo ON anexos(estudo_id, created_at)")
+
+    # chaves normalizadas de busca do cliente (preenchidas pela aplicação)
+    adicionar_coluna(c, "clientes", "cnpj_digitos", "TEXT")
+    adicionar_coluna(c, "clientes", "nome_busca", "TEXT")
+    vistos = set()
+    pendentes = c.execute(
+        "SELECT id, nome, cnpj FROM clientes WHERE nome_busca IS NULL ORDER BY id"
+    ).fetchall()
+    for cl in pendentes:
+        digitos = normalizar_cnpj(cl["cnpj"])
+        if digitos in vistos or (digitos and c.execute(
+            "SELECT 1 FROM clientes WHERE cnpj_digitos=?", (digitos,)
+        ).fetchone()):
+            digitos = None  # CNPJ repetido em cadastros antigos: só o primeiro fica indexado
+        vistos.add(digitos)
+        c.execute("UPDATE clientes SET cnpj_digitos=?, nome_busca=? WHERE id=?",
+                  (digitos, dobrar_acentos(cl["nome"]), cl["id"]))
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_clientes_cnpj ON clientes(cnpj_digitos) WHERE cnpj_digitos IS NOT NULL")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_clientes_nome_busca ON clientes(nome_busca)")
+
+    c.execute("""CREATE TABLE IF NOT EXISTS configuracoes (
+        chave TEXT PRIMARY KEY,
+        valor TEXT
+    )""")
+
+    # versão dos dados, chave dos caches da interface (ver versao_db): só escritas de conteúdo contam;
+    # registro de acesso, sha256/file_size preenchidos depois e manutenção não invalidam nada.
+    # `instancia` distingue um arquivo recriado (restauração, migração) de um contador que coincidiu
+    c.execute("""CREATE TABLE IF NOT EXISTS versao_dados (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        instancia TEXT NOT NULL DEFAULT (lower(hex(randomblob(8)))),
+        n INTEGER NOT NULL DEFAULT 0
+    )""")
+    c.execute("INSERT OR IGNORE INTO versao_dados (id) VALUES (1)")
+    for tabela, conteudo in VERSIONADAS.items():
+        for evento in ("INSERT", f"UPDATE OF {conteudo}", "DELETE"):
+            armazenamento.criar_gatilho(c, f"""CREATE TRIGGER IF NOT EXISTS trg_versao_{tabela}_{evento.split()[0].lower()}
+                AFTER {evento} ON {tabela} BEGIN UPDATE versao_dados SET n = n + 1; END""")
+
+    indice_busca.init_fts(conn)
+    replicacao.init_cdc(conn)
+    analise.init_agregados(conn)
+
+def obter_config(chave, padrao=None):
+    conn = get_conn()
+    r = conn.cursor().execute("SELECT valor FROM configuracoes WHERE chave=?", (chave,)).fetchone()
+    conn.close()
+    return r["valor"] if r else padrao
+
+def salvar_config(chave, valor):
+    conn = get_conn()
+    conn.cursor().execute(
+        "INSERT INTO configuracoes (chave, valor) VALUES (?, ?) ON CONFLICT(chave) DO UPDATE SET valor=excluded.valor",
+        (chave, str(valor))
+    )
+    conn.commit()
+    conn.close()
+
+# ==================== CRUD ====================
+def criar_cliente(nome, cnpj=None, obs=None):
+    conn = get_conn()
+    c = conn.cursor()
+    try:
+        c.execute(
+            "INSERT INTO clientes (nome, cnpj, observacoes, cnpj_digitos, nome_busca) VALUES (?, ?, ?, ?, ?)",
+            (nome, cnpj, obs, normalizar_cnpj(cnpj), dobrar_acentos(nome))
+        )
+    except sqlite3.IntegrityError:
+        existente = c.execute("SELECT nome FROM clientes WHERE cnpj_digitos=?", (normalizar_cnpj(cnpj),)).fetchone()
+        conn.close()
+        raise ValueError(f"CNPJ já cadastrado para '{existente['nome'] if existente else '?'}'.")
+    conn.commit()
+    cid = c.lastrowid
+    cl = c.execute("SELECT * FROM clientes WHERE id=?", (cid,)).fetchone()
+    conn.close()
+    if SHARDS.ativo():
+        # o shard leva uma cópia do cliente para os joins e o índice de busca locais
+        conn = conn_cliente(cid)
+        copiar_linha(conn.cursor(), "clientes", cl)
+        conn.commit()
+        conn.close()
+    return cid
+
+def listar_clientes(limite=None, offset=0):
+    conn = get_conn()
+    r = list(conn.cursor().execute(
+        "SELECT * FROM clientes ORDER BY nome LIMIT ? OFFSET ?", (-1 if limite is None else limite, offset)
+    ).fetchall())
+    conn.close()
+    return r
+
+def buscar_clientes(termo=None, limite=20, offset=0):
+    """Autocomplete: prefixo do nome (sem acentos) ou do CNPJ, sempre pelo índice e com LIMIT."""
+    conn = get_conn()
+    c = conn.cursor()
+    digitos = normalizar_cnpj(termo)
+    if digitos and len(digitos) >= 2 and not re.search(r"[^\d\s./-]", termo):
+        r = c.execute(
+            "SELECT * FROM clientes WHERE cnpj_digitos >= ? AND cnpj_digitos < ? ORDER BY cnpj_digitos LIMIT ? OFFSET ?",
+            (digitos, digitos + "\uffff", limite, offset)
+        ).fetchall()
+    else:
+        prefixo = dobrar_acentos(termo)
+        r = c.execute(
+            "SELECT * FROM clientes WHERE nome_busca >= ? AND nome_busca < ? ORDER BY nome_busca LIMIT ? OFFSET ?",
+            (prefixo, prefixo + "\uffff", limite, offset)
+        ).fetchall()
+    conn.close()
+    return list(r)
+
+def obter_cliente(cid):
+    conn = get_conn()
+    r = conn.cursor().execute("SELECT * FROM clientes WHERE id=?", (cid,)).fetchone()
+    conn.close()
+    return r
+
+def excluir_cliente(cid):
+    _descartar_dossies(cid)
+    if SHARDS.ativo():
+        SHARDS.remover(cid)
+        return
+    conn = get_conn()
+    c = conn.cursor()
+    c.execute("DELETE FROM anexos WHERE estudo_id IN (SELECT id FROM estudos WHERE cliente_id=?)", (cid,))
+    c.execute("DELETE FROM estudos WHERE cliente_id=?", (cid,))
+    c.execute("DELETE FROM clientes WHERE id=?", (cid,))
+    conn.commit()
+    conn.close()
+
+def criar_estudo(cid, titulo, resumo, tags=None):
+    # no modo shards o id vem do catálogo, para continuar único entre arquivos
+    eid = SHARDS.registrar("estudos", cid) if SHARDS.ativo() else None
+    conn = conn_cliente(cid)
+    c = conn.cursor()
+    c.execute("INSERT INTO estudos (id, cliente_id, titulo, resumo, tags) VALUES (?, ?, ?, ?, ?)", (eid, cid, titulo, resumo, tags))
+    conn.commit()
+    eid = c.lastrowid
+    conn.close()
+    return eid
+
+def listar_estudos(cid=None, limite=None, offset=0):
+    if not cid and SHARDS.ativo():
+        # cada shard devolve seus primeiros limite+offset; o merge mantém a ordem global
+        n = None if limite is None else limite + offset
+        partes = shards.em_paralelo(lambda cid: _listar_estudos(conn_cliente(cid), None, n, 0), fatias_dados())
+        todos = heapq.merge(*partes, key=lambda e: e["created_at"] or "", reverse=True)
+        return list(islice(todos, offset, None if limite is None else offset + limite))
+    return _listar_estudos(conn_cliente(cid) if cid else get_conn(), cid, limite, offset)
+
+def _listar_estudos(conn, cid, limite, offset):
+    pagina = (-1 if limite is None else limite, offset)
+    if cid:
+        r = list(conn.cursor().execute(
+            "SELECT * FROM estudos WHERE cliente_id=? ORDER BY created_at DESC LIMIT ? OFFSET ?", (cid, *pagina)
+        ).fetchall())
+    else:
+        r = list(conn.cursor().execute(
+            "SELECT e.*, c.nome as cliente FROM estudos e JOIN clientes c ON e.cliente_id=c.id ORDER BY e.created_at DESC LIMIT ? OFFSET ?",
+            pagina
+        ).fetchall())
+    conn.close()
+    return r
+
+def obter_estudo(eid):
+    conn = conn_estudo(eid)
+    r = conn.cursor().execute("SELECT * FROM estudos WHERE id=?", (eid,)).fetchone()
+    conn.close()
+    return r
+
+def atualizar_estudo(eid, titulo, resumo, tags):
+    conn = conn_estudo(eid)
+    conn.cursor().execute(
+        "UPDATE estudos SET titulo=?, resumo=?, tags=?, updated_at=CURRENT_TIMESTAMP WHERE id=?",
+        (titulo, resumo, tags, eid)
+    )
+    conn.commit()
+    conn.close()
+
+def excluir_estudo(eid):
+    conn = conn_estudo(eid)
+    c = conn.cursor()
+    c.execute("DELETE FROM anexos WHERE estudo_id=?", (eid,))
+    c.execute("DELETE FROM estudos WHERE id=?", (eid,))
+    conn.commit()
+    conn.close()
+    if SHARDS.ativo():
+        SHARDS.esquecer(estudos=[eid])
+
+def buscar_estudos(termo, versao=None, limite=200):
+    if not SHARDS.ativo():
+        return _buscar_estudos(get_conn(), termo, versao, limite)
+    chave = ("shards", termo.strip().lower(), limite)
+    if versao is not None:
+        r = indice_busca.cache.obter(chave, versao)
+        if r is not None:
+            return r
+    partes = shards.em_paralelo(lambda cid: _buscar_estudos(conn_cliente(cid), termo, None, limite), fatias_dados())
+    r = list(islice(heapq.merge(*partes, key=lambda e: e["id"], reverse=True), limite))
+    if versao is not None:
+        indice_busca.cache.guardar(chave, versao, r)
+    return r
+
+def _buscar_estudos(conn, termo, versao, limite):
+    ids = indice_busca.buscar_ids(conn, termo, versao, limite)
+    por_id = {r["id"]: r for r in conn.cursor().execute(
+        f"""SELECT e.*, c.nome as cliente
+            FROM estudos e JOIN clientes c ON e.cliente_id=c.id
+            WHERE e.id IN ({",".join("?" * len(ids))})""",
+        ids
+    ).fetchall()} if ids else {}
+    conn.close()
+    return [por_id[i] for i in ids if i in por_id]
+
+@memoria.perfil("core.add_anexo")
+def add_anexo(eid, nome, tipo, dados, tam):
+    codec, payload = compressao.comprimir(dados, tipo, nome)
+    aid = None
+    if SHARDS.ativo():
+        aid = SHARDS.registrar("anexos", SHARDS.cliente_de("estudos", eid), estudo_id=eid)
+    conn = conn_estudo(eid)
+    conn.cursor().execute(
+        "INSERT INTO anexos (id, estudo_id, filename, file_type, file_data, file_size, codec, sha256) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (aid, eid, nome, tipo or "", sqlite3.Binary(payload), tam, codec, hashlib.sha256(dados).hexdigest())
+    )
+    conn.commit()
+    conn.close()
+
+def listar_anexos(eid, limite=None, offset=0):
+    conn = conn_estudo(eid)
+    r = list(conn.cursor().execute(
+        "SELECT id, filename, file_type, file_size, created_at, sha256 FROM anexos WHERE estudo_id=? "
+        "ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?", (eid, -1 if limite is None else limite, offset)
+    ).fetchall())
+    conn.close()
+    return r
+
+@memoria.perfil("core.obter_anexo")
+def obter_anexo(aid):
+    """Linha completa do anexo; o conteúdo de um anexo frio vem do pacote, no file_data."""
+    conn = conn_anexo(aid)
+    r = conn.cursor().execute("SELECT * FROM anexos WHERE id=?", (aid,)).fetchone()
+    if r:
+        _registrar_acesso(conn, aid)
+        r = _anexo_completo(dict(r)) if r["pacote"] else r
+    conn.close()
+    return r
+
+def _anexo_completo(linha):
+    """Linha de anexo (dict) com o conteúdo no file_data, como se estivesse no banco."""
+    if linha.get("pacote"):
+        linha["file_data"] = PACOTES.ler(linha["pacote"], linha["pacote_pos"], linha["pacote_tam"])
+        linha["pacote"] = linha["pacote_pos"] = linha["pacote_tam"] = None
+    return linha
+
+def _registrar_acesso(conn, aid):
+    """Anota a leitura (no máximo uma vez por dia); um anexo frio lido de novo dentro de
+    `frio_promover_dias` volta ao banco. Melhor esforço: com o banco ocupado, a leitura segue sem anotar."""
+    c = conn.cursor()
+    r = c.execute(
+        "SELECT pacote, pacote_pos, pacote_tam, julianday('now') - julianday(acessado_em) AS dias FROM anexos WHERE id=?",
+        (aid,)
+    ).fetchone()
+    if not r or (r["dias"] is not None and r["dias"] < 1 and not r["pacote"]):
+        return
+    try:
+        if r["pacote"] and r["dias"] is not None and r["dias"] < float(obter_config("frio_promover_dias", 7)):
+            c.execute(
+                """UPDATE anexos SET file_data=?, pacote=NULL, pacote_pos=NULL, pacote_tam=NULL,
+                   acessado_em=CURRENT_TIMESTAMP WHERE id=? AND pacote=?""",
+                (sqlite3.Binary(PACOTES.ler(r["pacote"], r["pacote_pos"], r["pacote_tam"])), aid, r["pacote"])
+            )
+        elif r["dias"] is None or r["dias"] >= 1:
+            c.execute("UPDATE anexos SET acessado_em=CURRENT_TIMESTAMP WHERE id=?", (aid,))
+        conn.commit()
+    except sqlite3.OperationalError:
+        conn.rollback()
+
+def registrar_leitura(aid):
+    """Conta uma leitura pedida pelo usuário cujo conteúdo é lido com `registrar=False`
+    (o app monta o botão de download a cada reexecução, mas o pedido é um só)."""
+    conn = conn_anexo(aid)
+    _registrar_acesso(conn, aid)
+    conn.close()
+
+def obter_anexo_info(aid):
+    """Metadados do anexo, sem ler o conteúdo."""
+    conn = conn_anexo(aid)
+    r = conn.cursor().execute(
+        "SELECT id, estudo_id, filename, file_type, file_size, codec, sha256, created_at FROM anexos WHERE id=?", (aid,)
+    ).fetchone()
+    conn.close()
+    return r
+
+def iterar_anexo(aid, bloco=1 << 20, inicio=0, fim=None, registrar=True):
+    """Conteúdo original do anexo em blocos, lendo o valor armazenado de forma incremental.
+
+    `inicio`/`fim` recortam o intervalo [inicio, fim) do arquivo original; em anexos sem
+    compressão (e nos legados em base64) a leitura já começa no deslocamento certo.
+    `registrar=False` (leituras em massa, como o dossiê) não conta como acesso nem promove anexos frios.
+    """
+    conn = conn_anexo(aid)
+    try:
+        consulta = "SELECT codec, pacote, pacote_pos, pacote_tam FROM anexos WHERE id=?"
+        r = conn.cursor().execute(consulta, (aid,)).fetchone()
+        if not r:
+            return
+        if registrar:
+            _registrar_acesso(conn, aid)
+        if r["pacote"]:  # pode ter acabado de voltar ao banco
+            r = conn.cursor().execute(consulta, (aid,)).fetchone()
+        codec = r["codec"] or compressao.B64
+        with _valor_armazenado(conn, aid, r) as blob:
+            pular = inicio
+            if codec == compressao.RAW:
+                blob.seek(inicio)
+                pular = 0
+            elif codec == compressao.B64:
+                blob.seek(inicio // 3 * 4)
+                pular = inicio % 3
+            blocos = compressao.iterar(codec, iter(lambda: blob.read(bloco), b""))
+            yield from compressao.recortar(blocos, pular, None if fim is None else fim - inicio)
+    finally:
+        conn.close()
+
+def _valor_armazenado(conn, aid, r):
+    # anexo frio: o trecho do pacote tem a mesma interface de leitura do blob
+    return (PACOTES.abrir(r["pacote"], r["pacote_pos"], r["pacote_tam"]) if r["pacote"]
+            else conn.blobopen("anexos", "file_data", aid, readonly=True))
+
+def tamanho_anexo(aid):
+    """Tamanho do conteúdo original tirado do valor armazenado, sem confiar no file_size gravado."""
+    conn = conn_anexo(aid)
+    try:
+        r = conn.cursor().execute(
+            "SELECT codec, pacote, pacote_pos, pacote_tam FROM anexos WHERE id=?", (aid,)
+        ).fetchone()
+        if not r:
+            return None
+        with _valor_armazenado(conn, aid, r) as blob:
+            return compressao.tamanho_original(r["codec"], blob, len(blob))
+    finally:
+        conn.close()
+
+def hash_anexo(aid, registrar=True):
+    """sha256 do conteúdo original; calculado e gravado na primeira vez para anexos antigos.
+    `registrar=False`: o cálculo não conta como leitura do anexo (ver `iterar_anexo`)."""
+    info = obter_anexo_info(aid)
+    if not info:
+        return None
+    if info["sha256"]:
+        return info["sha256"]
+    h, tam = hashlib.sha256(), 0
+    for b in iterar_anexo(aid, registrar=registrar):
+        h.update(b)
+        tam += len(b)
+    _gravar_hash(aid, h.hexdigest(), tam)
+    return h.hexdigest()
+
+def _gravar_hash(aid, sha, tamanho):
+    # sha256 e file_size (só se faltava) saem do conteúdo, que a réplica já tem: não estão entre as
+    # colunas replicadas, então a gravação não gera evento de CDC com a linha inteira
+    conn = conn_anexo(aid)
+    c = conn.cursor()
+    c.execute("UPDATE anexos SET sha256=? WHERE id=? AND sha256 IS NULL", (sha, aid))
+    c.execute("UPDATE anexos SET file_size=? WHERE id=? AND file_size IS NULL", (tamanho, aid))
+    conn.commit()
+    conn.close()
+
+@memoria.perfil("core.ler_anexo")
+def ler_anexo(aid, registrar=True):
+    return b"".join(iterar_anexo(aid, registrar=registrar))
+
+@memoria.perfil("core.previa_anexo")
+def previa_anexo(aid):
+    """Prévia leve do anexo (ver previa.py): do cache em disco ou, na primeira vez, gerada lendo só o necessário."""
+    info = obter_anexo_info(aid)
+    if not info:
+        return None
+    genero = previa.tipo_previa(info["filename"], info["file_type"])
+    if genero is None:
+        return previa.gerar(info["filename"], info["file_type"], iter(()))  # nada a ler
+    sha = info["sha256"]
+    if sha:
+        r = PREVIAS.obter(f"{sha}-{genero}")
+        if r is not None:
+            return r
+    # gerar a prévia não conta como leitura do anexo (não promove anexos frios); em anexos antigos,
+    # sem sha256, o hash (a chave do cache) sai da mesma leitura, que continua após a prévia
+    h, tam, completo = hashlib.sha256(), 0, False
+    blocos = iterar_anexo(aid, registrar=False)
+
+    def lidos():
+        nonlocal tam, completo
+        for b in blocos:
+            h.update(b)
+            tam += len(b)
+            yield b
+        completo = True
+
+    fluxo = lidos() if sha is None else blocos
+    try:
+        r = previa.gerar(info["filename"], info["file_type"], fluxo, info["file_size"])
+        if sha is None:
+            for _ in fluxo:
+                pass
+    finally:
+        fluxo.close()
+        blocos.close()
+    if sha is None:
+        if not completo:  # a leitura falhou no meio (a prévia já diz isso): sem hash, sem cache
+            return r
+        sha = h.hexdigest()
+        _gravar_hash(aid, sha, tam)
+    if r.pop("guardar", True):
+        PREVIAS.limite = int(float(obter_config("previas_limite_mb", 64)) * 1024 * 1024)
+        PREVIAS.guardar(f"{sha}-{genero}", r)
+    return r
+
+def excluir_anexo(aid):
+    conn = conn_anexo(aid)
+    conn.cursor().execute("DELETE FROM anexos WHERE id=?", (aid,))
+    conn.commit()
+    conn.close()
+    if SHARDS.ativo():
+        SHARDS.esquecer(anexos=[aid])
+
+def stats():
+    if SHARDS.ativo():
+        return SHARDS.contagens()
+    conn = get_conn()
+    c = conn.cursor()
+    s = {
+        "clientes": c.execute("SELECT COUNT(*) FROM clientes").fetchone()[0],
+        "estudos": c.execute("SELECT COUNT(*) FROM estudos").fetchone()[0],
+        "anexos": c.execute("SELECT COUNT(*) FROM anexos").fetchone()[0],
+    }
+    conn.close()
+    return s
+
+# ==================== OPERAÇÕES EM LOTE ====================
+# cada operação é um comando por conjunto (ids via json_each) numa transação por arquivo:
+# o banco único inteiro ou, no modo shards, cada shard envolvido
+def _em_lote(ids, func):
+    """Aplica `func(cursor, ids_json)` a cada arquivo envolvido e soma as linhas alteradas."""
+    ids = [int(i) for i in ids]
+    if not ids:
+        return 0
+    grupos = list(SHARDS.agrupar("estudos", ids).items()) if SHARDS.ativo() else [(None, ids)]
+
+    def um(grupo):
+        cid, lote = grupo
+        conn = conn_cliente(cid) if cid else get_conn()
+        n = func(conn.cursor(), json.dumps(lote))
+        conn.commit()
+        conn.close()
+        return n
+
+    return sum(shards.em_paralelo(um, grupos))
+
+def excluir_estudos(ids):
+    ids = [int(i) for i in ids]
+
+    def excluir(c, lote):
+        c.execute("DELETE FROM anexos WHERE estudo_id IN (SELECT value FROM json_each(?))", (lote,))
+        return c.execute("DELETE FROM estudos WHERE id IN (SELECT value FROM json_each(?))", (lote,)).rowcount
+
+    n = _em_lote(ids, excluir)
+    if SHARDS.ativo():
+        SHARDS.esquecer(estudos=ids)
+    return n
+
+def alterar_tags_estudos(ids, adicionar=(), remover=()):
+    """Acrescenta/retira tags (sem diferenciar maiúsculas) e grava só os estudos que mudaram."""
+    novas = {}
+    for t in adicionar:
+        if t.strip():
+            novas.setdefault(t.strip().lower(), t.strip())
+    params = {
+        "adicionar": json.dumps(list(novas.values()), ensure_ascii=False),
+        "remover": json.dumps([t.strip().lower() for t in remover if t.strip()], ensure_ascii=False),
+    }
+
+    def retag(c, lote):
+        c.execute(f"""WITH novas AS (
+                          SELECT e.id, (SELECT group_concat(t, ', ') FROM (
+                              SELECT trim(j.value) AS t FROM {analise.tags_json('e.tags')} j
+                              WHERE trim(j.value) <> '' AND lower(trim(j.value)) NOT IN (SELECT value FROM json_each(:remover))
+                              UNION ALL
+                              SELECT n.value FROM json_each(:adicionar) n
+                              WHERE lower(n.value) NOT IN (SELECT lower(trim(value)) FROM {analise.tags_json('e.tags')})
+                                AND lower(n.value) NOT IN (SELECT value FROM json_each(:remover))
+                          )) AS tags
+                          FROM estudos e WHERE e.id IN (SELECT value FROM json_each(:ids))
+                      )
+                      UPDATE estudos SET tags=novas.tags, updated_at=CURRENT_TIMESTAMP FROM novas
+                      WHERE estudos.id=novas.id AND estudos.tags IS NOT novas.tags""", {**params, "ids": lote})
+        # rowcount não vale para comandos que começam com WITH
+        return c.execute("SELECT changes()").fetchone()[0]
+
+    return _em_lote(ids, retag)
+
+def mover_estudos(ids, cid):
+    """Passa os estudos (com os anexos) para outro cliente; no modo shards, as linhas mudam de arquivo."""
+    ids = [int(i) for i in ids]
+    if not obter_cliente(cid):
+        raise ValueError("Cliente de destino não encontrado.")
+    if not ids:
+        return 0
+    if not SHARDS.ativo():
+        conn = get_conn()
+        n = conn.cursor().execute(
+            """UPDATE estudos SET cliente_id=?, updated_at=CURRENT_TIMESTAMP
+               WHERE id IN (SELECT value FROM json_each(?)) AND cliente_id<>?""",
+            (cid, json.dumps(ids), cid)
+        ).rowcount
+        conn.commit()
+        conn.close()
+        return n
+    conn = conn_cliente(cid)
+    c = conn.cursor()
+    n = 0
+    for origem, lote in SHARDS.agrupar("estudos", ids).items():
+        if origem == cid:
+            continue
+        lote = json.dumps(lote)
+        c.execute("ATTACH DATABASE ? AS origem", (str(SHARDS.caminho(origem)),))
+        # insere no destino antes de excluir na origem; anexos depois dos estudos e antes deles na exclusão,
+        # para os gatilhos de agregados acharem o cliente de cada anexo
+        cols = _colunas_comuns(c, "estudos")
+        valores = ", ".join(
+            {"cliente_id": str(int(cid)), "updated_at": "CURRENT_TIMESTAMP"}.get(col, col) for col in cols.split(", ")
+        )
+        n += c.execute(
+            f"INSERT INTO estudos ({cols}) SELECT {valores} FROM origem.estudos WHERE id IN (SELECT value FROM json_each(?))",
+            (lote,)
+        ).rowcount
+        cols = _colunas_comuns(c, "anexos")
+        c.execute(
+            f"INSERT INTO anexos ({cols}) SELECT {cols} FROM origem.anexos WHERE estudo_id IN (SELECT value FROM json_each(?))",
+            (lote,)
+        )
+        c.execute("DELETE FROM origem.anexos WHERE estudo_id IN (SELECT value FROM json_each(?))", (lote,))
+        c.execute("DELETE FROM origem.estudos WHERE id IN (SELECT value FROM json_each(?))", (lote,))
+        conn.commit()
+        c.execute("DETACH DATABASE origem")
+    conn.close()
+    SHARDS.realocar(ids, cid)
+    return n
+
+# ==================== BACKUP / RESTORE (CORE) ====================
+ANEXO_GRANDE = 64 * 1024  # conteúdo já comprimido abaixo disso segue no bloco de texto em volta
+
+def _ja_comprimido(anexo):
+    """Conteúdo armazenado que o deflate não reduz: comprimido pelo codec ou guardado RAW (o add_anexo
+    já viu que não comprimia); legados em base64, pelo formato do arquivo."""
+    if anexo.get("codec") in (compressao.ZSTD, compressao.ZLIB, compressao.RAW):
+        return True
+    return compressao.ja_comprimido(anexo.get("file_type"), anexo.get("filename"))
+
+@memoria.perfil("core.backup")
+def backup(destino=None, progresso=None, nivel=None, workers=None):
+    """Gera o zip do núcleo linha a linha; `destino` (caminho) evita manter o arquivo em memória.
+
+    O deflate roda em paralelo (`backup_threads`, padrão: núcleos da máquina) com o nível `backup_nivel`.
+    """
+    buf = destino if destino is not None else io.BytesIO()
+    total = sum(stats().values()) or 1
+    feitos = 0
+    nivel = int(obter_config("backup_nivel", 6) if nivel is None else nivel)
+    workers = int(workers or obter_config("backup_threads", 0) or os.cpu_count() or 1)
+    # zip de um membro (backup.json) escrito em fluxo pelo deflate paralelo; abre com o zipfile na restauração
+    with compressao.ZipFluxo(buf, "backup.json", nivel, workers) as out:
+        cab = {"versao": "6.3", "data": datetime.now().isoformat()}
+        out.write(json.dumps(cab, ensure_ascii=False)[:-1].encode())
+        for t in ("clientes", "estudos", "anexos"):
+            out.write(f', "{t}": ['.encode())
+            i = 0
+            # clientes vêm do banco principal; estudos e anexos, de cada shard em sequência
+            for conn in ([get_conn()] if t == "clientes" else map(conn_cliente, fatias_dados())):
+                for r in conn.cursor().execute(f"SELECT * FROM {t}"):
+                    r = dict(r)
+                    if t == "anexos":
+                        r = _anexo_completo(r)  # o backup leva o conteúdo dos anexos frios
+                    if isinstance(r.get("file_data"), bytes):
+                        # anexos comprimidos/binários vão em base64, acompanhados do codec
+                        r["file_data"] = base64.b64encode(r["file_data"]).decode()
+                    out.marcar(t == "anexos" and len(r["file_data"] or "") >= ANEXO_GRANDE and _ja_comprimido(r))
+                    out.write(((", " if i else "") + json.dumps(r, ensure_ascii=False)).encode())
+                    i += 1
+                    feitos += 1
+                    if progresso and feitos % 50 == 0:
+                        progresso(100 * feitos / total, f"{t}: {i}")
+                conn.close()
+            out.marcar(False)
+            out.write(b"]")
+        out.write(b"}")
+    if destino is None:
+        buf.seek(0)
+    return buf
+
+@memoria.perfil("core.restaurar")
+def restaurar(file, progresso=None):
+    try:
+        content = file.read()
+        with zipfile.ZipFile(io.BytesIO(content)) as zf:
+            data = json.loads(zf.read("backup.json"))
+    except zipfile.BadZipFile:
+        data = json.loads(content)
+
+    try:
+        if SHARDS.ativo():
+            _restaurar_shards(data, progresso)
+        else:
+            conn = get_conn()
+            _restaurar_em(conn, data, progresso)
+            conn.close()
+        return True, "Restaurado!"
+    except Exception as e:
+        return False, str(e)
+
+def _restaurar_shards(data, progresso=None):
+    """Restaura num banco único temporário, divide-o em um diretório novo e troca os diretórios no fim."""
+    tmp = DATA_DIR / "restaurar.tmp.db"
+    novo = SHARDS.diretorio.with_name(SHARDS.diretorio.name + ".novo")
+    tmp.unlink(missing_ok=True)
+    shutil.rmtree(novo, ignore_errors=True)
+    conn = _conectar(tmp)
+    criar_esquema(conn)
+    # configurações não fazem parte do backup: seguem as atuais
+    conn.execute("ATTACH DATABASE ? AS atual", (str(SHARDS.catalogo),))
+    conn.execute("INSERT OR REPLACE INTO configuracoes (chave, valor) SELECT chave, valor FROM atual.configuracoes")
+    conn.commit()
+    conn.execute("DETACH DATABASE atual")
+    _restaurar_em(conn, data, progresso and (lambda p, m: progresso(p / 2, m)))
+    conn.close()
+    migrar_para_shards(tmp, novo, progresso and (lambda p, m: progresso(50 + p / 2, m)))
+    try:
+        SHARDS.trocar(novo, drenar=_drenar_shards)
+    finally:
+        _esquemas_prontos.clear()
+        tmp.unlink(missing_ok=True)
+        shutil.rmtree(novo, ignore_errors=True)  # sobra só quando a troca foi cancelada
+
+def _restaurar_em(conn, data, progresso=None):
+    c = conn.cursor()
+
+    # limpa core
+    for t in ["anexos", "estudos", "clientes"]:
+        c.execute(f"DELETE FROM {t}")
+
+    # restaura (tolerante a campos faltantes)
+    cnpjs = set()
+    for cl in data.get("clientes", []):
+        digitos = normalizar_cnpj(cl.get("cnpj"))
+        if digitos in cnpjs:
+            digitos = None
+        cnpjs.add(digitos)
+        c.execute(
+            "INSERT INTO clientes (id, nome, cnpj, observacoes, created_at, cnpj_digitos, nome_busca) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (cl.get("id"), cl.get("nome"), cl.get("cnpj"), cl.get("observacoes"), cl.get("created_at"),
+             digitos, dobrar_acentos(cl.get("nome")))
+        )
+
+    for e in data.get("estudos", []):
+        c.execute(
+            "INSERT INTO estudos (id, cliente_id, titulo, resumo, tags, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (e.get("id"), e.get("cliente_id"), e.get("titulo"), e.get("resumo"), e.get("tags"),
+             e.get("created_at"), e.get("updated_at"))
+        )
+
+    anexos = data.get("anexos", [])
+    for i, a in enumerate(anexos):
+        if progresso and i % 50 == 0:
+            progresso(100 * i / len(anexos), f"anexos: {i}/{len(anexos)}")
+        codec = a.get("codec")
+        dados = a.get("file_data")
+        if codec and codec != compressao.B64:
+            dados = sqlite3.Binary(base64.b64decode(dados))
+        c.execute(
+            "INSERT INTO anexos (id, estudo_id, filename, file_type, file_data, file_size, created_at, codec, sha256) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (a.get("id"), a.get("estudo_id"), a.get("filename"), a.get("file_type"),
+             dados, a.get("file_size"), a.get("created_at"), codec, a.get("sha256"))
+        )
+
+    conn.commit()
+
+def migrar_para_shards(origem, destino_dir, progresso=None):
+    """Divide o banco único `origem` em catálogo + um arquivo por cliente em `destino_dir`.
+
+    Estudos de clientes inexistentes (que já não apareciam nas listagens) ficam de fora.
+    Retorna a quantidade de clientes migrados.
+    """
+    destino = shards.Layout(destino_dir)
+    destino.diretorio.mkdir(parents=True, exist_ok=True)
+    cat = _conectar(destino.catalogo)
+    criar_esquema(cat)
+    destino.init_catalogo(cat)
+    c = cat.cursor()
+    c.execute("ATTACH DATABASE ? AS origem", (str(origem),))
+    cols = _colunas_comuns(c, "clientes")
+    c.execute(f"INSERT INTO clientes ({cols}) SELECT {cols} FROM origem.clientes")
+    c.execute("INSERT OR REPLACE INTO configuracoes (chave, valor) SELECT chave, valor FROM origem.configuracoes")
+    # arquivos novos, logs novos: réplicas recomeçam a partir dos segmentos desta época
+    c.execute("""INSERT INTO configuracoes (chave, valor)
+                 VALUES ('cdc_epoca', COALESCE((SELECT valor FROM origem.configuracoes WHERE chave='cdc_epoca'), 0) + 1)
+                 ON CONFLICT(chave) DO UPDATE SET valor=excluded.valor""")
+    c.execute("""INSERT INTO estudos_idx (id, cliente_id)
+                 SELECT e.id, e.cliente_id FROM origem.estudos e JOIN origem.clientes cl ON cl.id=e.cliente_id""")
+    c.execute("""INSERT INTO anexos_idx (id, cliente_id, estudo_id)
+                 SELECT a.id, e.cliente_id, a.estudo_id FROM origem.anexos a JOIN estudos_idx e ON e.id=a.estudo_id""")
+    # ids apagados no banco antigo não voltam a ser usados
+    for idx, tabela in (("estudos_idx", "estudos"), ("anexos_idx", "anexos")):
+        seq = c.execute("SELECT seq FROM origem.sqlite_sequence WHERE name=?", (tabela,)).fetchone()
+        if seq and not c.execute("UPDATE sqlite_sequence SET seq=MAX(seq, ?) WHERE name=?", (seq[0], idx)).rowcount:
+            c.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (idx, seq[0]))
+    cat.commit()
+    c.execute("DETACH DATABASE origem")
+    cids = [r[0] for r in c.execute("SELECT id FROM clientes")]
+    cat.close()
+
+    contador = count(1)
+
+    def migrar_cliente(cid):
+        conn = _conectar(destino.caminho(cid))
+        criar_esquema(conn)
+        c = conn.cursor()
+        c.execute("ATTACH DATABASE ? AS origem", (str(origem),))
+        for t, filtro in (
+            ("clientes", "id=?"),
+            ("estudos", "cliente_id=?"),
+            ("anexos", "estudo_id IN (SELECT id FROM origem.estudos WHERE cliente_id=?)"),
+        ):
+            cols = _colunas_comuns(c, t)
+            c.execute(f"INSERT INTO {t} ({cols}) SELECT {cols} FROM origem.{t} WHERE {filtro}", (cid,))
+        conn.commit()
+        c.execute("DETACH DATABASE origem")
+        conn.close()
+        n = next(contador)
+        if progresso:
+            progresso(100 * n / len(cids), f"cliente {n}/{len(cids)}")
+
+    shards.em_paralelo(migrar_cliente, cids)
+    return len(cids)
+
+def _colunas_comuns(c, tabela):
+    origem = set(colunas(c, tabela, "origem"))
+    return ", ".join(col for col in colunas(c, tabela) if col in origem)
+
+def fmt_bytes(n):
+    n = float(n or 0)
+    for unidade in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024 or unidade == "GB":
+            return f"{n:.0f} {unidade}" if unidade == "B" else f"{n:.1f} {unidade}"
+        n /= 1024
+
+# ==================== TAREFAS ====================
+def job_backup(job):
+    destino = job.artefato(f"backup_{datetime.now():%Y%m%d_%H%M}.zip")
+    backup(destino, progresso=job.progresso)
+    return destino
+
+def job_restaurar(job, caminho):
+    try:
+        with open(caminho, "rb") as f:
+            ok, msg = restaurar(f, progresso=job.progresso)
+    finally:
+        Path(caminho).unlink(missing_ok=True)
+    if not ok:
+        raise RuntimeError(msg)
+
+def job_upload(job, eid, arquivos):
+    for i, (nome, tipo, dados, tam) in enumerate(arquivos):
+        job.progresso(100 * i / len(arquivos), nome)
+        add_anexo(eid, nome, tipo, dados, tam)
+
+def job_comprimir_anexos(job, lote=20):
+    ids = []
+    for cid in fatias_dados():
+        conn = conn_cliente(cid)
+        ids += [(cid, r[0]) for r in conn.cursor().execute(
+            "SELECT id FROM anexos WHERE codec IS NULL OR codec=?", (compressao.B64,)
+        )]
+        conn.close()
+    antes = depois = 0
+    for i in range(0, len(ids), lote):
+        for cid, grupo in groupby(ids[i:i + lote], key=lambda x: x[0]):
+            conn = conn_cliente(cid)
+            c = conn.cursor()
+            for _, aid in grupo:
+                r = c.execute("SELECT filename, file_type, file_data, codec FROM anexos WHERE id=?", (aid,)).fetchone()
+                if not r:
+                    continue
+                dados = compressao.descomprimir(r["codec"], r["file_data"])
+                codec, payload = compressao.comprimir(dados, r["file_type"], r["filename"])
+                antes += len(r["file_data"])
+                depois += len(payload)
+                c.execute(
+                    "UPDATE anexos SET file_data=?, codec=?, sha256=? WHERE id=?",
+                    (sqlite3.Binary(payload), codec, hashlib.sha256(dados).hexdigest(), aid)
+                )
+            # transações curtas: uploads e edições seguem funcionando durante o lote
+            conn.commit()
+            conn.close()
+        job.progresso(100 * min(i + lote, len(ids)) / len(ids), f"{fmt_bytes(antes - depois)} economizados")
+    job.progresso(100, f"{len(ids)} anexo(s): {fmt_bytes(antes)} → {fmt_bytes(depois)} ({fmt_bytes(antes - depois)} economizados)")
+
+def job_compactar(job):
+    liberados = compactar_banco(progresso=job.progresso)
+    job.progresso(100, f"{fmt_bytes(liberados)} liberados")
+
+def job_verificar_integridade(job):
+    problemas = verificar_integridade(progresso=job.progresso)
+    if problemas:
+        raise RuntimeError("; ".join(f"{nome}: {msg}" for nome, msg in problemas))
+    job.progresso(100, f"{len(arquivos_banco())} arquivo(s) íntegro(s)")
+
+def versao_db():
+    """Muda a cada escrita de conteúdo (ver VERSIONADAS), inclusive de tarefas em segundo plano e de
+    outras sessões; leituras que só registram acesso ou preenchem o hash não invalidam os caches."""
+    if SHARDS.ativo():
+        return SHARDS.versao()
+    conn = get_conn()
+    r = conn.cursor().execute("SELECT instancia, n FROM versao_dados").fetchone()
+    conn.close()
+    return tuple(r)
+
+# ==================== REPLICAÇÃO ====================
+def fontes_replicacao():
+    """(arquivo, tabelas) exportados; no modo shards os clientes saem só do catálogo."""
+    if not SHARDS.ativo():
+        return [(DB_PATH, replicacao.TABELAS)]
+    return [(SHARDS.catalogo, ("clientes",))] + [(p, ("estudos", "anexos")) for p in SHARDS.arquivos()[1:]]
+
+def exportar_alteracoes(destino=None, progresso=None):
+    # réplicas não enxergam FRIO_DIR: anexos frios viajam com o conteúdo
+    return replicacao.exportar(
+        fontes_replicacao(), destino or REPLICACAO_DIR, int(obter_config("cdc_epoca", 0)), progresso,
+        completar=lambda tabela, linha: _anexo_completo(linha) if tabela == "anexos" else linha
+    )
+
+def alteracoes_pendentes():
+    return replicacao.pendentes(fontes_replicacao())
+
+def eh_replica():
+    conn = get_conn()
+    r = conn.cursor().execute("SELECT 1 FROM cdc_meta WHERE chave='replica'").fetchone()
+    conn.close()
+    return bool(r)
+
+def job_exportar_alteracoes(job):
+    criados = exportar_alteracoes(progresso=job.progresso)
+    apagados = replicacao.compactar(REPLICACAO_DIR)
+    job.progresso(100, f"{len(criados)} segmento(s) exportado(s), {apagados} já aplicado(s) apagado(s)")
+
+# ==================== ANÁLISE ====================
+def agregados(meses=12, top=10):
+    """Dados do Dashboard a partir das tabelas de agregados (somadas entre shards)."""
+    hoje = datetime.now()
+    a, m = divmod(hoje.year * 12 + hoje.month - 1 - (meses - 1), 12)
+    desde = f"{a:04d}-{m + 1:02d}"
+
+    def ler(caminho):
+        conn = _conectar(caminho)
+        r = analise.ler(conn, desde)
+        conn.close()
+        return r
+
+    somas = {"estudos_mes": {}, "tags": {}, "anexos_cliente": {}, "anexos_tipo": {}}
+    chaves = {"estudos_mes": ("cliente_id", "mes"), "tags": ("tag",), "anexos_cliente": ("cliente_id",), "anexos_tipo": ("tipo",)}
+    for parte in _por_arquivo(ler):
+        for nome, linhas in parte.items():
+            for linha in linhas:
+                chave = tuple(linha[k] for k in chaves[nome])
+                atual = somas[nome].setdefault(chave, dict.fromkeys(linha, 0) | {k: linha[k] for k in chaves[nome]})
+                for k, v in linha.items():
+                    if k not in chaves[nome]:
+                        atual[k] += v
+
+    ids = {k[0] for k in somas["estudos_mes"]} | {k[0] for k in somas["anexos_cliente"]}
+    conn = get_conn()
+    nomes = {r["id"]: r["nome"] for r in conn.cursor().execute(
+        f"SELECT id, nome FROM clientes WHERE id IN ({','.join('?' * len(ids))})", list(ids)
+    )} if ids else {}
+    conn.close()
+    for nome in ("estudos_mes", "anexos_cliente"):
+        for linha in somas[nome].values():
+            linha["cliente"] = nomes.get(linha["cliente_id"], "(sem cliente)")
+    return {
+        "estudos_mes": sorted(somas["estudos_mes"].values(), key=lambda x: x["mes"]),
+        "tags": heapq.nlargest(top, somas["tags"].values(), key=lambda x: x["estudos"]),
+        "anexos_cliente": sorted(somas["anexos_cliente"].values(), key=lambda x: -x["bytes_armazenados"]),
+        "anexos_tipo": sorted(somas["anexos_tipo"].values(), key=lambda x: -x["bytes_armazenados"]),
+    }
+
+def reconstruir_agregados(progresso=None):
+    """Recalcula os agregados em cada arquivo; retorna quantos buckets divergiam."""
+    def um(caminho):
+        conn = _conectar(caminho)
+        n = analise.reconstruir(conn)
+        conn.commit()
+        conn.close()
+        return n
+
+    return sum(_por_arquivo(um, progresso))
+
+def job_reconstruir_agregados(job):
+    n = reconstruir_agregados(progresso=job.progresso)
+    job.progresso(100, f"{n} bucket(s) corrigido(s)")
+
+# ==================== MANUTENÇÃO ====================
+def _por_arquivo(func, progresso=None):
+    """Roda `func(caminho)` em cada arquivo do banco (shards em paralelo), reportando o avanço."""
+    arquivos = arquivos_banco()
+    contador = count(1)
+
+    def um(caminho):
+        r = func(caminho)
+        n = next(contador)
+        if progresso:
+            progresso(100 * n / len(arquivos), f"{caminho.name} ({n}/{len(arquivos)})")
+        return r
+
+    return shards.em_paralelo(um, arquivos)
+
+def compactar_banco(progresso=None):
+    """VACUUM de cada arquivo; retorna o total de bytes liberados."""
+    if not SHARDS.ativo():
+        return armazenamento.compactar(DB_PATH, progresso=progresso)
+    return sum(_por_arquivo(armazenamento.compactar, progresso))
+
+def verificar_integridade(progresso=None):
+    """Lista de (arquivo, problema) encontrados pelo quick_check; vazia quando tudo está íntegro."""
+    resultados = _por_arquivo(armazenamento.verificar, progresso)
+    problemas = [(p.name, r) for p, r in zip(arquivos_banco(), resultados) if r != "ok"]
+    for nome, n in sorted(_pacotes_referenciados().items()):
+        if not PACOTES.caminho(nome).exists():
+            problemas.append((nome, f"pacote ausente, referenciado por {n} anexo(s)"))
+    return problemas
+
+def relatorio_armazenamento(top=10):
+    """`armazenamento.relatorio` de cada arquivo, somado no modo shards."""
+    def um(caminho):
+        conn = _conectar(caminho)
+        r = armazenamento.relatorio(conn, top)
+        conn.close()
+        return r
+
+    partes = _por_arquivo(um)
+    referenciados = _pacotes_referenciados()
+    frio = {"anexos": sum(referenciados.values()), "pacotes": len(PACOTES.listar()), "bytes_pacotes": PACOTES.bytes_total()}
+    if len(partes) == 1:
+        return {**partes[0], "frio": frio}
+    info = {"page_size": partes[0]["page_size"], "arquivos": len(partes), "frio": frio}
+    for k in ("page_count", "freelist", "bytes_total", "bytes_livres"):
+        info[k] = sum(p[k] for p in partes)
+    info["razao_livre"] = info["bytes_livres"] / info["bytes_total"] if info["bytes_total"] else 0.0
+    modos = {p["auto_vacuum"] for p in partes}
+    info["auto_vacuum"] = modos.pop() if len(modos) == 1 else "misto"
+
+    por_tabela, por_cliente = {}, {}
+    for p in partes:
+        for t in p["por_tabela"]:
+            por_tabela[t["tabela"]] = por_tabela.get(t["tabela"], 0) + t["bytes"]
+        # o cliente aparece no catálogo (zerado) e no próprio shard
+        for cl in p["por_cliente"]:
+            atual = por_cliente.setdefault(cl["id"], {**cl, "estudos": 0, "anexos": 0, "bytes_anexos": 0})
+            for k in ("estudos", "anexos", "bytes_anexos"):
+                atual[k] += cl[k]
+    info["por_tabela"] = sorted(({"tabela": k, "bytes": v} for k, v in por_tabela.items()), key=lambda x: -x["bytes"])
+    info["por_cliente"] = sorted(por_cliente.values(), key=lambda x: -x["bytes_anexos"])
+    info["maiores_anexos"] = heapq.nlargest(
+        top, (a for p in partes for a in p["maiores_anexos"]), key=lambda a: a["bytes_armazenados"] or 0
+    )
+    return info
+
+# ==================== CAMADA FRIA ====================
+_arquivando = threading.Lock()
+LOTE_FRIO = 64 * 1024 * 1024  # conteúdo acumulado em memória antes de cada gravação no pacote
+
+def _pacotes_referenciados():
+    """{pacote: anexos que apontam para ele} somando todos os arquivos do banco."""
+    def um(caminho):
+        conn = _conectar(caminho)
+        r = dict(conn.cursor().execute(
+            "SELECT pacote, COUNT(*) FROM anexos WHERE pacote IS NOT NULL GROUP BY pacote"
+        ).fetchall())
+        conn.close()
+        return r
+
+    total = {}
+    for parte in _por_arquivo(um):
+        for nome, n in parte.items():
+            total[nome] = total.get(nome, 0) + n
+    return total
+
+def arquivar_anexos(idade_dias=None, ocioso_dias=None, progresso=None):
+    """Move para os pacotes o conteúdo dos anexos criados há mais de `idade_dias` e sem leitura há
+    `ocioso_dias` (padrões nas configurações; 0 desliga o critério). Os metadados ficam no banco."""
+    idade = float(obter_config("frio_idade_dias", 90) if idade_dias is None else idade_dias)
+    ocioso = float(obter_config("frio_ocioso_dias", 30) if ocioso_dias is None else ocioso_dias)
+    with _arquivando:
+        alvos = []
+        for cid in fatias_dados():
+            conn = conn_cliente(cid)
+            alvos += [(cid, r[0]) for r in conn.cursor().execute(
+                """SELECT id FROM anexos WHERE pacote IS NULL AND created_at < datetime('now', ?)
+                   AND COALESCE(acessado_em, created_at) < datetime('now', ?) ORDER BY id""",
+                (f"-{idade} days", f"-{ocioso} days")
+            )]
+            conn.close()
+        movidos = volume = 0
+        for cid, grupo in groupby(alvos, key=lambda x: x[0]):
+            conn = conn_cliente(cid)
+            c = conn.cursor()
+            registros, acumulado = [], 0
+
+            def gravar():
+                # o pacote chega ao disco antes de o banco apontar para ele; uma queda no meio
+                # só deixa bytes sem referência no pacote
+                for (aid, codec, sha256, payload), (nome, pos, tam) in zip(registros, PACOTES.gravar(registros)):
+                    c.execute(
+                        """UPDATE anexos SET file_data=X'', codec=?, sha256=COALESCE(sha256, ?),
+                           pacote=?, pacote_pos=?, pacote_tam=? WHERE id=? AND pacote IS NULL""",
+                        (codec, sha256, nome, pos, tam, aid)
+                    )
+                conn.commit()
+                registros.clear()
+
+            for _, aid in grupo:
+                r = c.execute(
+                    "SELECT filename, file_type, file_data, codec, sha256 FROM anexos WHERE id=? AND pacote IS NULL", (aid,)
+                ).fetchone()
+                if not r:
+                    continue
+                codec, payload, sha256 = r["codec"], r["file_data"], r["sha256"]
+                if not codec or codec == compressao.B64:
+                    # legado em base64 vai para o pacote já comprimido
+                    dados = compressao.descomprimir(codec, payload)
+                    codec, payload = compressao.comprimir(dados, r["file_type"], r["filename"])
+                    sha256 = sha256 or hashlib.sha256(dados).hexdigest()
+                payload = bytes(payload)
+                registros.append((aid, codec, sha256, payload))
+                acumulado += len(payload)
+                movidos += 1
+                volume += len(payload)
+                if acumulado >= LOTE_FRIO:
+                    gravar()
+                    acumulado = 0
+                    if progresso:
+                        progresso(100 * movidos / len(alvos), f"{movidos}/{len(alvos)} anexo(s)")
+            if registros:
+                gravar()
+            conn.close()
+            if progresso:
+                progresso(100 * movidos / max(len(alvos), 1), f"{movidos}/{len(alvos)} anexo(s)")
+        liberados = PACOTES.remover_sem_uso(_pacotes_referenciados())
+    return {"anexos": movidos, "bytes": volume, "pacotes_liberados": liberados}
+
+def job_arquivar_anexos(job):
+    r = arquivar_anexos(progresso=job.progresso)
+    job.progresso(100, f"{r['anexos']} anexo(s), {fmt_bytes(r['bytes'])} nos pacotes; "
+                       f"{fmt_bytes(r['pacotes_liberados'])} de pacotes sem uso apagados")
+
+# ==================== DOSSIÊ ====================
+def _dados_dossie(cid):
+    """Cliente, estudos e metadados dos anexos (sem o conteúdo) que entram no dossiê."""
+    cl = obter_cliente(cid)
+    if not cl:
+        raise ValueError("Cliente não encontrado.")
+    conn = conn_cliente(cid)
+    c = conn.cursor()
+    estudos = [dict(r) for r in c.execute(
+        "SELECT id, titulo, resumo, tags, created_at, updated_at FROM estudos WHERE cliente_id=? ORDER BY created_at, id",
+        (cid,)
+    )]
+    anexos = [dict(r) for r in c.execute(
+        """SELECT a.id, a.estudo_id, a.filename, a.file_type, a.file_size, a.sha256, a.created_at
+           FROM anexos a JOIN estudos e ON e.id=a.estudo_id WHERE e.cliente_id=? ORDER BY a.estudo_id, a.id""",
+        (cid,)
+    )]
+    conn.close()
+    return dict(cl), estudos, anexos
+
+def _caminho_dossie(cid, versao):
+    return DOSSIES_DIR / f"dossie_{cid}_{versao}.zip"
+
+def _descartar_dossies(cid, manter=None):
+    for p in DOSSIES_DIR.glob(f"dossie_{cid}_*.zip"):
+        if p != manter:
+            p.unlink(missing_ok=True)
+
+def dossie_em_cache(cid):
+    """Caminho do dossiê já gerado para o estado atual do cliente, ou None."""
+    caminho = _caminho_dossie(cid, dossie.versao(*_dados_dossie(cid)))
+    return caminho if caminho.exists() else None
+
+@memoria.perfil("core.exportar_dossie")
+def exportar_dossie(cid, progresso=None):
+    """Zip do dossiê do cliente; só é gerado de novo quando algo do cliente mudou desde o último."""
+    cl, estudos, anexos = _dados_dossie(cid)
+    caminho = _caminho_dossie(cid, dossie.versao(cl, estudos, anexos))
+    if caminho.exists():
+        return caminho
+    DOSSIES_DIR.mkdir(parents=True, exist_ok=True)
+    # o temporário fica ao lado do destino: o rename é atômico e quem pede junto nunca vê um zip pela metade
+    fd, tmp = tempfile.mkstemp(".tmp", f"dossie_{cid}_", DOSSIES_DIR)
+    try:
+        with os.fdopen(fd, "w+b") as f:
+            dossie.gravar(f, cl, estudos, anexos, lambda aid: iterar_anexo(aid, registrar=False), progresso)
+        os.replace(tmp, caminho)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    _descartar_dossies(cid, manter=caminho)
+    return caminho
+
+def abrir_dossie(cid, gerar=True, progresso=None):
+    """(caminho, arquivo aberto para leitura) do dossiê do estado atual do cliente; sem `gerar`,
+    None quando ele não está em cache.
+
+    O arquivo é aberto na mesma chamada que acha o caminho: uma exportação mais nova do cliente
+    apaga o zip anterior, e quem só guardasse o caminho poderia não achá-lo mais. Se isso acontecer
+    entre achar e abrir, procura de novo (o novo zip ou, com `gerar`, uma nova geração).
+    """
+    for _ in range(3):
+        caminho = exportar_dossie(cid, progresso) if gerar else dossie_em_cache(cid)
+        if caminho is None:
+            return None
+        try:
+            return caminho, open(caminho, "rb")
+        except FileNotFoundError:
+            continue
+    raise FileNotFoundError(f"Dossiê do cliente {cid} foi substituído durante a leitura; tente de novo.")
+
+def job_exportar_dossie(job, cid):
+    caminho = exportar_dossie(cid, progresso=job.progresso)
+    job.progresso(100, f"{fmt_bytes(caminho.stat().st_size)} em {caminho.name}")
@@ -0,0 +1,221 @@
+"""Dossiê do cliente: um zip com os estudos (Markdown e HTML) e todos os anexos.
+
+    python dossie.py <cliente_id> [--saida arquivo.zip]
+
+O zip é escrito direto num arquivo temporário do diretório de dossiês, com os anexos lidos em
+blocos (nenhum fica inteiro em memória), e renomeado ao final. O nome leva a versão do cliente
+(hash dos metadados de cliente, estudos e anexos): enquanto nada mudar, pedir de novo devolve o
+mesmo arquivo sem gerar nada.
+"""
+import argparse
+import hashlib
+import html
+import json
+import re
+import shutil
+import zipfile
+
+import compressao
+
+try:
+    import markdown
+except ImportError:  # sem o pacote, o resumo vai em parágrafos de texto no HTML
+    markdown = None
+
+FORMATO = 1  # mude ao alterar o layout: invalida os dossiês já gerados
+ESTILO = """body{font-family:system-ui,sans-serif;max-width:860px;margin:2rem auto;padding:0 1rem;color:#1e293b}
+h1,h2{color:#0f172a}.meta{color:#64748b}a{color:#2563eb}li{margin:.2rem 0}"""
+
+
+def versao(cliente, estudos, anexos):
+    """Hash do estado do cliente que aparece no dossiê; muda com qualquer edição, inclusão ou exclusão."""
+    estado = [
+        FORMATO,
+        [cliente.get(k) for k in ("id", "nome", "cnpj", "observacoes")],
+        [[e.get(k) for k in ("id", "titulo", "resumo", "tags", "created_at", "updated_at")] for e in estudos],
+        [[a.get(k) for k in ("id", "estudo_id", "filename", "file_size", "sha256")] for a in anexos],
+    ]
+    return hashlib.sha256(json.dumps(estado, default=str).encode()).hexdigest()[:16]
+
+
+def nome_arquivo(texto, padrao="sem-nome", limite=80):
+    """Nome seguro dentro do zip: sem barras, caracteres de controle nem reservados do Windows."""
+    texto = re.sub(r'[\x00-\x1f<>:"/\\|?*]+', "-", texto or "").strip(" .-")
+    return texto[:limite].rstrip(" .-") or padrao
+
+
+def _pasta(est):
+    return f"estudos/{est['id']:06d} - {nome_arquivo(est['titulo'], limite=60)}"
+
+
+def _nomes_anexos(anexos):
+    """Nome de cada anexo na pasta do estudo; repetidos ganham o id na frente."""
+    vistos, nomes = set(), {}
+    for a in anexos:
+        nome = nome_arquivo(a["filename"])
+        if nome.lower() in vistos:
+            nome = f"{a['id']}-{nome}"
+        vistos.add(nome.lower())
+        nomes[a["id"]] = nome
+    return nomes
+
+
+def _data(valor):
+    return str(valor or "")[:16]
+
+
+def _tamanho(n):
+    n = float(n or 0)
+    for unidade in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unidade == "GB":
+            return f"{n:.0f} {unidade}" if unidade == "B" else f"{n:.1f} {unidade}"
+        n /= 1024
+
+
+def _cliente_md(cliente):
+    linhas = [f"# {cliente['nome']}", ""]
+    if cliente.get("cnpj"):
+        linhas.append(f"**CNPJ:** {cliente['cnpj']}  ")
+    if cliente.get("observacoes"):
+        linhas += ["", cliente["observacoes"]]
+    return linhas
+
+
+def indice_md(cliente, estudos, anexos):
+    linhas = _cliente_md(cliente) + ["", f"## Estudos ({len(estudos)})", ""]
+    for est in estudos:
+        n = len(anexos.get(est["id"], []))
+        linhas.append(f"- [{est['titulo']}](<{_pasta(est)}/estudo.md>) — {_data(est['created_at'])}"
+                      + (f" · {n} anexo(s)" if n else ""))
+    return "\n".join(linhas) + "\n"
+
+
+def estudo_md(cliente, est, anexos, nomes):
+    linhas = [f"# {est['titulo']}", "", f"**Cliente:** {cliente['nome']}  "]
+    if est.get("tags"):
+        linhas.append(f"**Tags:** {est['tags']}  ")
+    linhas += [f"**Criado em:** {_data(est['created_at'])} · **Atualizado em:** {_data(est['updated_at'])}",
+               "", est["resumo"] or ""]
+    if anexos:
+        linhas += ["", "## Anexos", ""]
+        linhas += [f"- [{a['filename']}](<anexos/{nomes[a['id']]}>) — {_tamanho(a['file_size'])}" for a in anexos]
+    return "\n".join(linhas) + "\n"
+
+
+def _texto_html(texto):
+    if markdown is not None:
+        # HTML cru do texto vira texto: o dossiê é aberto fora do app
+        return markdown.markdown(html.escape(texto or "", quote=False), extensions=["tables", "sane_lists"])
+    paragrafos = re.split(r"\n\s*\n", (texto or "").strip())
+    return "\n".join(f"<p>{html.escape(p).replace(chr(10), '<br>')}</p>" for p in paragrafos if p)
+
+
+def _pagina(titulo, corpo):
+    return (f'<!DOCTYPE html>\n<html lang="pt-BR"><head><meta charset="utf-8"><title>{html.escape(titulo)}</title>'
+            f"<style>{ESTILO}</style></head><body>\n{corpo}\n</body></html>\n")
+
+
+def _href(caminho):
+    return html.escape(caminho.replace(" ", "%20"))
+
+
+def indice_html(cliente, estudos, anexos):
+    corpo = [f"<h1>{html.escape(cliente['nome'])}</h1>"]
+    if cliente.get("cnpj"):
+        corpo.append(f'<p class="meta">CNPJ: {html.escape(cliente["cnpj"])}</p>')
+    if cliente.get("observacoes"):
+        corpo.append(_texto_html(cliente["observacoes"]))
+    corpo.append(f"<h2>Estudos ({len(estudos)})</h2><ul>")
+    for est in estudos:
+        n = len(anexos.get(est["id"], []))
+        corpo.append(f'<li><a href="{_href(_pasta(est))}/estudo.html">{html.escape(est["titulo"])}</a> '
+                     f'<span class="meta">— {_data(est["created_at"])}{f" · {n} anexo(s)" if n else ""}</span></li>')
+    corpo.append("</ul>")
+    return _pagina(cliente["nome"], "\n".join(corpo))
+
+
+def estudo_html(cliente, est, anexos, nomes):
+    corpo = [
+        '<p><a href="../../index.html">← Índice</a></p>',
+        f"<h1>{html.escape(est['titulo'])}</h1>",
+        f'<p class="meta">{html.escape(cliente["nome"])}'
+        + (f" · Tags: {html.escape(est['tags'])}" if est.get("tags") else "")
+        + f" · Criado em {_data(est['created_at'])} · Atualizado em {_data(est['updated_at'])}</p>",
+        _texto_html(est["resumo"]),
+    ]
+    if anexos:
+        corpo.append("<h2>Anexos</h2><ul>")
+        corpo += [f'<li><a href="anexos/{_href(nomes[a["id"]])}">{html.escape(a["filename"])}</a> '
+                  f'<span class="meta">— {_tamanho(a["file_size"])}</span></li>' for a in anexos]
+        corpo.append("</ul>")
+    return _pagina(est["titulo"], "\n".join(corpo))
+
+
+def _info(nome, quando, comprimir=True):
+    # data de alteração do registro (não a da geração): o mesmo estado rende o mesmo zip
+    data = (tuple(int(p) for p in re.findall(r"\d+", str(quando or ""))[:6]) + (0, 0, 0))[:6]
+    zi = zipfile.ZipInfo(nome, data if data[0] >= 1980 and data[2] else (1980, 1, 1, 0, 0, 0))
+    zi.compress_type = zipfile.ZIP_DEFLATED if comprimir else zipfile.ZIP_STORED
+    return zi
+
+
+def gravar(destino, cliente, estudos, anexos, ler, progresso=None):
+    """Escreve o dossiê em `destino` (caminho ou arquivo binário com seek).
+
+    `anexos` são as linhas de metadados dos anexos do cliente e `ler(id)` devolve o conteúdo original
+    de um anexo em blocos; cada anexo vai para o zip à medida que os blocos chegam.
+    """
+    por_estudo = {}
+    for a in anexos:
+        por_estudo.setdefault(a["estudo_id"], []).append(a)
+    total = sum(a["file_size"] or 0 for a in anexos) + len(estudos) or 1
+    feito = 0
+    raiz = f"dossie - {nome_arquivo(cliente['nome'], limite=60)}"
+    quando = max([e["updated_at"] or e["created_at"] for e in estudos] or [cliente.get("created_at")], key=str)
+    with zipfile.ZipFile(destino, "w", zipfile.ZIP_DEFLATED, compresslevel=6) as zf:
+        zf.writestr(_info(f"{raiz}/README.md", quando), indice_md(cliente, estudos, por_estudo))
+        zf.writestr(_info(f"{raiz}/index.html", quando), indice_html(cliente, estudos, por_estudo))
+        for est in estudos:
+            lista = por_estudo.get(est["id"], [])
+            nomes = _nomes_anexos(lista)
+            pasta = f"{raiz}/{_pasta(est)}"
+            alterado = est["updated_at"] or est["created_at"]
+            zf.writestr(_info(f"{pasta}/estudo.md", alterado), estudo_md(cliente, est, lista, nomes))
+            zf.writestr(_info(f"{pasta}/estudo.html", alterado), estudo_html(cliente, est, lista, nomes))
+            feito += 1
+            for a in lista:
+                # formatos já comprimidos entram sem deflate: só gastaria CPU
+                zi = _info(f"{pasta}/anexos/{nomes[a['id']]}", a["created_at"],
+                           not compressao.ja_comprimido(a["file_type"], a["filename"]))
+                with zf.open(zi, "w", force_zip64=True) as out:
+                    for bloco in ler(a["id"]):
+                        out.write(bloco)
+                        feito += len(bloco)
+                        if progresso:
+                            progresso(100 * feito / total, a["filename"])
+            if progresso:
+                progresso(100 * feito / total, est["titulo"])
+
+
+def main():
+    import core
+
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("cliente_id", type=int)
+    ap.add_argument("--saida", help="copia o dossiê para este caminho (padrão: só informa o arquivo em cache)")
+    args = ap.parse_args()
+
+    core.init_db()
+    if not core.obter_cliente(args.cliente_id):
+        print(f"❌ Cliente {args.cliente_id} não encontrado")
+        return
+    antes = core.dossie_em_cache(args.cliente_id)
+    caminho = antes or core.exportar_dossie(args.cliente_id)
+    if args.saida:
+        shutil.copyfile(caminho, args.saida)
+        caminho = args.saida
+    print(f"✅ Dossiê {'(em cache) ' if antes else ''}em {caminho}")
+
+
+if __name__ == "__main__":
+    main()
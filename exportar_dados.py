@@ -1,9 +1,13 @@
+import base64
 import sqlite3
 import json
 from pathlib import Path
 from datetime import datetime
 
+import pacotes
+
 DB_PATH = Path("data/biblioteca.db")
+FRIO = pacotes.Pacotes("data/frio")
 
 if not DB_PATH.exists():
     print("❌ Banco não encontrado em data/biblioteca.db")
@@ -25,6 +29,13 @@ estudos = [dict(row) for row in c.fetchall()]
 # Exportar anexos
 c.execute("SELECT * FROM anexos")
 anexos = [dict(row) for row in c.fetchall()]
+for a in anexos:
+    # anexos da camada fria têm o conteúdo num pacote, fora do banco
+    if a.get("pacote"):
+        a["file_data"] = FRIO.ler(a["pacote"], a["pacote_pos"], a["pacote_tam"])
+    # anexos comprimidos ficam em BLOB; no JSON vão em base64 junto com o codec
+    if isinstance(a["file_data"], bytes):
+        a["file_data"] = base64.b64encode(a["file_data"]).decode()
 
 conn.close()
 
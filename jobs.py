@@ -0,0 +1,193 @@
+"""Tarefas em segundo plano (backup, restauração, uploads) com progresso persistente."""
+import os
+import sqlite3
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+FILA = "fila"
+EXECUTANDO = "executando"
+CONCLUIDO = "concluido"
+ERRO = "erro"
+INTERROMPIDO = "interrompido"
+
+ATIVOS = (FILA, EXECUTANDO)
+
+
+def _vivo(pid):
+    if pid == os.getpid():
+        return True
+    if os.name == "nt":  # lá os.kill(pid, 0) encerraria o processo: na dúvida, vivo
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Job:
+    """Contexto entregue à função da tarefa para reportar progresso."""
+
+    def __init__(self, runner, job_id):
+        self.runner = runner
+        self.id = job_id
+
+    def progresso(self, pct, mensagem=None):
+        pct = max(0.0, min(100.0, float(pct)))
+        self.runner._atualizar(self.id, progresso=pct, mensagem=mensagem)
+
+    def artefato(self, nome):
+        """Caminho dentro do diretório de artefatos para o arquivo gerado pela tarefa."""
+        return self.runner.artefatos_dir / f"job{self.id}_{nome}"
+
+
+class JobRunner:
+    def __init__(self, db_path, artefatos_dir, max_pesados=2, max_workers=8):
+        self.artefatos_dir = Path(artefatos_dir)
+        self.artefatos_dir.mkdir(parents=True, exist_ok=True)
+        self.db_path = str(db_path)
+        self.max_pesados = max(1, int(max_pesados))
+        self._pesados_ativos = 0
+        # pesadas esperam aqui, fora do pool, até haver vaga: na fila do pool ocupariam threads
+        # que as leves (uploads) precisam
+        self._espera = deque()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.init_db()
+
+    def _conn(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init_db(self):
+        conn = self._conn()
+        c = conn.cursor()
+        c.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo TEXT NOT NULL,
+            descricao TEXT,
+            status TEXT NOT NULL DEFAULT 'fila',
+            progresso REAL NOT NULL DEFAULT 0,
+            mensagem TEXT,
+            erro TEXT,
+            artefato TEXT,
+            pesado INTEGER NOT NULL DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            pid INTEGER
+        )""")
+        if "pid" not in {r[1] for r in c.execute("PRAGMA table_info(jobs)")}:
+            c.execute("ALTER TABLE jobs ADD COLUMN pid INTEGER")
+        # tarefas de um processo que já terminou não têm mais quem as execute; as de outro
+        # processo ainda vivo (outra instância do app) seguem com ele
+        parados = [
+            r["id"] for r in c.execute("SELECT id, pid FROM jobs WHERE status IN (?, ?)", ATIVOS)
+            if r["pid"] is None or not _vivo(r["pid"])
+        ]
+        c.executemany(
+            "UPDATE jobs SET status=?, finished_at=CURRENT_TIMESTAMP WHERE id=?", [(INTERROMPIDO, i) for i in parados]
+        )
+        conn.commit()
+        conn.close()
+
+    def definir_limite(self, n):
+        with self._lock:
+            self.max_pesados = max(1, int(n))
+            self._despachar()
+
+    def _despachar(self):
+        # chamado com o lock: entrega ao pool as pesadas que cabem no limite
+        while self._espera and self._pesados_ativos < self.max_pesados:
+            self._pesados_ativos += 1
+            self._pool.submit(self._executar, *self._espera.popleft())
+
+    def submeter(self, tipo, func, *args, descricao=None, pesado=True, **kwargs):
+        """Enfileira `func(job, *args, **kwargs)`; o retorno (caminho) vira o artefato da tarefa."""
+        conn = self._conn()
+        c = conn.cursor()
+        c.execute(
+            "INSERT INTO jobs (tipo, descricao, status, pesado, pid) VALUES (?, ?, ?, ?, ?)",
+            (tipo, descricao, FILA, int(pesado), os.getpid())
+        )
+        conn.commit()
+        job_id = c.lastrowid
+        conn.close()
+        if pesado:
+            with self._lock:
+                self._espera.append((job_id, func, pesado, args, kwargs))
+                self._despachar()
+        else:
+            self._pool.submit(self._executar, job_id, func, pesado, args, kwargs)
+        return job_id
+
+    def _executar(self, job_id, func, pesado, args, kwargs):
+        try:
+            self._atualizar(job_id, status=EXECUTANDO, started_at=True)
+            artefato = func(Job(self, job_id), *args, **kwargs)
+            self._atualizar(
+                job_id, status=CONCLUIDO, progresso=100.0, finished_at=True,
+                artefato=str(artefato) if artefato else None
+            )
+        except Exception as e:
+            self._atualizar(
+                job_id, status=ERRO, finished_at=True,
+                erro=f"{e}\n\n{traceback.format_exc()}"
+            )
+        finally:
+            if pesado:
+                with self._lock:
+                    self._pesados_ativos -= 1
+                    self._despachar()
+
+    def _atualizar(self, job_id, started_at=False, finished_at=False, **campos):
+        campos = {k: v for k, v in campos.items() if v is not None}
+        sets = [f"{k}=?" for k in campos]
+        if started_at:
+            sets.append("started_at=CURRENT_TIMESTAMP")
+        if finished_at:
+            sets.append("finished_at=CURRENT_TIMESTAMP")
+        if not sets:
+            return
+        conn = self._conn()
+        conn.cursor().execute(f"UPDATE jobs SET {', '.join(sets)} WHERE id=?", (*campos.values(), job_id))
+        conn.commit()
+        conn.close()
+
+    def obter(self, job_id):
+        conn = self._conn()
+        r = conn.cursor().execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+        conn.close()
+        return r
+
+    def listar(self, limite=20):
+        conn = self._conn()
+        r = list(conn.cursor().execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limite,)).fetchall())
+        conn.close()
+        return r
+
+    def em_andamento(self):
+        conn = self._conn()
+        n = conn.cursor().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", ATIVOS
+        ).fetchone()[0]
+        conn.close()
+        return n
+
+    def excluir(self, job_id):
+        job = self.obter(job_id)
+        if not job or job["status"] in ATIVOS:
+            return False
+        if job["artefato"]:
+            Path(job["artefato"]).unlink(missing_ok=True)
+        conn = self._conn()
+        conn.cursor().execute("DELETE FROM jobs WHERE id=?", (job_id,))
+        conn.commit()
+        conn.close()
+        return True
@@ -0,0 +1,189 @@
+"""Perfil de memória opcional (tracemalloc): pico por reexecução, por bloco de página e por função do núcleo.
+
+Desligado, `medir` e `perfil` custam só a verificação de `tracemalloc.is_tracing()`. Ligado
+(BIBLIOTECA_MEMORIA=1 ou pelo painel de Configurações), cada escopo registra o pico de alocação
+acima do que já estava alocado na entrada; quando o pico é o maior já visto no escopo ou passa do
+orçamento, guarda os maiores locais de alocação vivos na saída do escopo (o tracemalloc não tira
+snapshot no instante do pico) e, no segundo caso, emite um aviso no log. Snapshots custam caro com
+muitas alocações rastreadas, por isso picos pequenos só entram nos números.
+
+O tracemalloc mede o processo inteiro: com várias sessões ou tarefas ao mesmo tempo, o pico de um
+escopo inclui o que as outras threads alocaram durante ele. O pico do tracemalloc também é um só
+e cada escopo o zera ao abrir; antes disso, o valor é repassado a todos os escopos abertos, de
+qualquer thread, para que nenhum perca o pico que já tinha.
+"""
+import functools
+import logging
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from itertools import islice
+from pathlib import Path
+
+log = logging.getLogger("biblioteca.memoria")
+
+QUADROS = 1          # só a linha que alocou: tracebacks mais fundos deixam cada alocação e snapshot bem mais caros
+LOCAIS = 10          # maiores locais de alocação guardados por escopo
+NOVO_PICO = 1 << 20  # um novo máximo só ganha snapshot se passar disso e crescer 25% sobre o anterior
+_IGNORAR = {tracemalloc.__file__, "<unknown>"}
+
+_lock = threading.Lock()
+_local = threading.local()
+_abertos = []                    # quadros abertos em todas as threads: recebem o pico antes de cada reset
+_escopos = {}                    # escopo -> agregado das execuções
+_alertas = deque(maxlen=100)     # execuções acima do orçamento, mais recentes no fim
+orcamento = 0                    # bytes; 0 = sem limite
+
+
+def ativo():
+    return tracemalloc.is_tracing()
+
+
+def configurar(ligado, orcamento_mb=0):
+    global orcamento
+    orcamento = max(0, int(float(orcamento_mb or 0) * 1024 * 1024))
+    if ligado and not tracemalloc.is_tracing():
+        tracemalloc.start(QUADROS)
+    elif not ligado and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def limpar():
+    with _lock:
+        _escopos.clear()
+        _alertas.clear()
+
+
+def _descartar(quadros):
+    # por identidade: quadros aninhados abertos sem alocação entre eles são listas iguais
+    fora = {id(q) for q in quadros}
+    _abertos[:] = [q for q in _abertos if id(q) not in fora]
+
+
+def _pilha():
+    if not hasattr(_local, "pilha"):
+        _local.pilha = []
+    return _local.pilha
+
+
+def abrir(raiz=False):
+    """Início de um escopo medido; `raiz` descarta escopos desta thread que não foram fechados
+    (uma reexecução interrompida por st.rerun/st.stop não chega ao `fechar`)."""
+    if not tracemalloc.is_tracing():
+        return None
+    pilha = _pilha()
+    with _lock:
+        if raiz:
+            _descartar(pilha)
+            pilha.clear()
+        # quadros de threads que terminaram sem fechar não recebem mais nada
+        _abertos[:] = [q for q in _abertos if q[2].is_alive()]
+        atual, pico = tracemalloc.get_traced_memory()
+        # o reset abaixo apagaria o pico dos escopos abertos (desta e das outras threads): guarda-o antes
+        for q in _abertos:
+            q[1] = max(q[1], pico)
+        tracemalloc.reset_peak()
+        quadro = [atual, atual, threading.current_thread()]  # [alocado na entrada, maior pico absoluto visto, thread]
+        _abertos.append(quadro)
+    pilha.append(quadro)
+    return quadro
+
+
+def fechar(quadro, escopo):
+    if quadro is None or not tracemalloc.is_tracing():
+        return
+    pilha = _pilha()
+    with _lock:
+        i = next((i for i, q in enumerate(pilha) if q is quadro), None)
+        if i is not None:
+            _descartar(pilha[i:])
+            del pilha[i:]
+        # sem reset aqui: os escopos externos leem o mesmo pico quando fecharem
+        atual, pico = tracemalloc.get_traced_memory()
+        pico = max(quadro[1], pico)
+    _registrar(escopo, pico - quadro[0], atual - quadro[0])
+
+
+@contextmanager
+def medir(escopo):
+    quadro = abrir()
+    try:
+        yield
+    finally:
+        fechar(quadro, escopo)
+
+
+def perfil(escopo):
+    """Decorador: mede cada chamada da função como o escopo `escopo`."""
+    def decorador(func):
+        @functools.wraps(func)
+        def medida(*args, **kwargs):
+            if not tracemalloc.is_tracing():
+                return func(*args, **kwargs)
+            with medir(escopo):
+                return func(*args, **kwargs)
+        return medida
+    return decorador
+
+
+def principais_locais(n=LOCAIS):
+    """Maiores locais (arquivo:linha) da memória alocada agora, sem o próprio tracemalloc."""
+    if not tracemalloc.is_tracing():
+        return []
+    # filtra depois de agrupar por linha: Snapshot.filter_traces testa cada alocação em Python
+    estatisticas = (s for s in tracemalloc.take_snapshot().statistics("lineno") if s.traceback[0].filename not in _IGNORAR)
+    return [
+        {"local": f"{Path(s.traceback[0].filename).name}:{s.traceback[0].lineno}", "bytes": s.size, "blocos": s.count}
+        for s in islice(estatisticas, n)
+    ]
+
+
+def _registrar(escopo, pico, liquido):
+    excedeu = bool(orcamento) and pico > orcamento
+    with _lock:
+        e = _escopos.setdefault(escopo, {"execucoes": 0, "soma": 0, "pico": -1, "ultimo": 0, "acima": 0, "locais": []})
+        novo_maximo = pico > e["pico"]
+        explicar = excedeu or (novo_maximo and pico >= NOVO_PICO and pico > e["pico"] * 1.25)
+        e["execucoes"] += 1
+        e["soma"] += pico
+        e["ultimo"] = pico
+        e["liquido"] = liquido
+        e["acima"] += excedeu
+        if novo_maximo:
+            e["pico"] = pico
+    # o snapshot percorre todas as alocações vivas: só quando há algo novo a explicar
+    locais = principais_locais() if explicar else None
+    with _lock:
+        if explicar and novo_maximo:
+            e["locais"] = locais
+        if excedeu:
+            _alertas.append({"quando": time.time(), "escopo": escopo, "pico": pico, "locais": locais})
+    if excedeu:
+        log.warning(
+            "%s: pico de %.1f MB acima do orçamento de %.1f MB; maiores locais: %s",
+            escopo, pico / 2**20, orcamento / 2**20,
+            ", ".join(f"{l['local']} ({l['bytes'] / 2**20:.1f} MB)" for l in locais[:3]),
+        )
+
+
+def resumo():
+    with _lock:
+        linhas = [
+            {"escopo": k, "execucoes": e["execucoes"], "pico": e["pico"], "medio": e["soma"] / e["execucoes"],
+             "ultimo": e["ultimo"], "liquido": e["liquido"], "acima": e["acima"]}
+            for k, e in _escopos.items()
+        ]
+    return sorted(linhas, key=lambda r: r["pico"], reverse=True)
+
+
+def locais(escopo):
+    """Maiores locais de alocação vivos na saída da maior execução do escopo que ganhou snapshot."""
+    with _lock:
+        return list(_escopos.get(escopo, {}).get("locais") or [])
+
+
+def alertas():
+    with _lock:
+        return list(reversed(_alertas))
@@ -0,0 +1,116 @@
+"""Camada fria dos anexos: pacotes só de acréscimo com o conteúdo de anexos antigos ou ociosos.
+
+Cada registro é um cabeçalho (magia, tamanho do JSON, tamanho do conteúdo), um JSON com id, codec
+e sha256 do anexo e o conteúdo já comprimido. O índice fica no próprio `anexos` (pacote, posição
+do conteúdo e tamanho), então ler um anexo frio é um seek + read no pacote. Nada é reescrito: o
+espaço de anexos promovidos ou excluídos volta quando nenhum registro de um pacote é mais
+referenciado e o arquivo inteiro é apagado.
+"""
+import json
+import os
+import struct
+import threading
+from pathlib import Path
+
+MAGIA = b"BTPK"
+CABECALHO = struct.Struct("<4sIQ")
+LIMITE_PACOTE = 256 * 1024 * 1024
+EXTENSAO = ".pack"
+
+
+class Trecho:
+    """Arquivo aberto restrito ao conteúdo de um registro, com a interface de leitura do blobopen."""
+
+    def __init__(self, caminho, pos, tam):
+        self._f = open(caminho, "rb")
+        self._ini, self._tam, self._pos = pos, tam, 0
+        self._f.seek(pos)
+
+    def seek(self, deslocamento):
+        self._pos = max(0, min(self._tam, deslocamento))
+        self._f.seek(self._ini + self._pos)
+
+    def read(self, n=-1):
+        n = self._tam - self._pos if n < 0 else min(n, self._tam - self._pos)
+        dados = self._f.read(n) if n > 0 else b""
+        self._pos += len(dados)
+        return dados
+
+    def __len__(self):
+        return self._tam
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Pacotes:
+    def __init__(self, diretorio, limite=LIMITE_PACOTE):
+        self.diretorio = Path(diretorio)
+        self.limite = limite
+        self._lock = threading.Lock()
+
+    def caminho(self, nome):
+        return self.diretorio / nome
+
+    def listar(self):
+        return sorted(self.diretorio.glob(f"*{EXTENSAO}"))
+
+    def _atual(self):
+        """Último pacote, ou um novo quando ele já passou do limite."""
+        existentes = self.listar()
+        if existentes and existentes[-1].stat().st_size < self.limite:
+            return existentes[-1]
+        numero = int(existentes[-1].stem) + 1 if existentes else 1
+        return self.diretorio / f"{numero:06d}{EXTENSAO}"
+
+    def gravar(self, registros):
+        """Acrescenta [(id, codec, sha256, conteúdo)] e devolve [(pacote, posição, tamanho)] na mesma ordem.
+
+        Os bytes chegam ao disco (fsync) antes do retorno: só então o banco passa a apontar para eles.
+        """
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        locais = []
+        with self._lock:
+            caminho = self._atual()
+            with open(caminho, "ab") as f:
+                pos = f.tell()
+                for aid, codec, sha256, conteudo in registros:
+                    meta = json.dumps({"id": aid, "codec": codec, "sha256": sha256}).encode()
+                    f.write(CABECALHO.pack(MAGIA, len(meta), len(conteudo)))
+                    f.write(meta)
+                    pos += CABECALHO.size + len(meta)
+                    f.write(conteudo)
+                    locais.append((caminho.name, pos, len(conteudo)))
+                    pos += len(conteudo)
+                f.flush()
+                os.fsync(f.fileno())
+        return locais
+
+    def abrir(self, nome, pos, tam):
+        return Trecho(self.caminho(nome), pos, tam)
+
+    def ler(self, nome, pos, tam):
+        with self.abrir(nome, pos, tam) as t:
+            return t.read()
+
+    def remover_sem_uso(self, referenciados):
+        """Apaga os pacotes que nenhum anexo referencia; retorna os bytes liberados.
+
+        Quem chama garante que não há gravação em curso cujo UPDATE ainda não chegou ao banco.
+        """
+        liberados = 0
+        with self._lock:
+            for caminho in self.listar():
+                if caminho.name not in referenciados:
+                    liberados += caminho.stat().st_size
+                    caminho.unlink()
+        return liberados
+
+    def bytes_total(self):
+        return sum(p.stat().st_size for p in self.listar())
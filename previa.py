@@ -0,0 +1,330 @@
+"""Prévias leves dos anexos: primeiras linhas de planilhas e CSV, início do texto de PDF/DOCX/TXT e
+miniaturas de imagens, geradas na primeira vez e guardadas num cache LRU em disco.
+
+A chave é o sha256 do conteúdo (mais o tipo de prévia), então uma prévia nunca fica velha: anexos
+iguais compartilham a mesma e as de anexos excluídos saem do cache por falta de uso. O LRU usa o
+mtime do arquivo, renovado a cada leitura; passando do limite, os mais antigos são apagados.
+"""
+import base64
+import codecs
+import csv
+import io
+import json
+import os
+import tempfile
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
+from itertools import islice
+from pathlib import Path, PurePath
+
+try:
+    from PIL import Image
+except ImportError:  # sem Pillow, imagens ficam sem miniatura
+    Image = None
+
+try:
+    import pypdf
+except ImportError:  # sem pypdf, PDFs ficam sem prévia
+    pypdf = None
+
+VERSAO = 1                  # mude ao alterar o formato: as prévias antigas deixam de ser usadas
+LINHAS = 20
+COLUNAS = 20
+PLANILHAS = 5
+CARACTERES = 3000
+MINIATURA = (480, 480)
+AMOSTRA_TEXTO = 64 * 1024   # CSV e texto só leem o começo do anexo
+MAX_ORIGINAL = 64 * 1024 * 1024
+LIMITE_CACHE = 64 * 1024 * 1024
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+
+
+def tipo_previa(nome, tipo):
+    ext = PurePath(nome or "").suffix.lower()
+    tipo = (tipo or "").lower()
+    if ext in (".xlsx", ".xlsm") or "spreadsheetml" in tipo:
+        return "xlsx"
+    if ext in (".csv", ".tsv") or tipo in ("text/csv", "text/tab-separated-values"):
+        return "csv"
+    if ext == ".docx" or "wordprocessingml" in tipo:
+        return "docx"
+    if ext == ".pdf" or tipo == "application/pdf":
+        return "pdf"
+    if tipo.startswith("image/") or ext in (".png", ".jpg", ".jpeg", ".gif", ".webp", ".bmp"):
+        return "imagem"
+    if tipo.startswith("text/") or ext in (".txt", ".md", ".json", ".xml", ".log"):
+        return "texto"
+    return None
+
+
+def _nenhuma(motivo, guardar=True):
+    # `guardar=False`: falta uma dependência, a prévia pode existir depois de instalá-la
+    return {"tipo": "nenhuma", "motivo": motivo, "guardar": guardar}
+
+
+def gerar(nome, tipo, blocos, tamanho=None):
+    """Prévia (dict) do anexo cujo conteúdo original chega em `blocos`; lê só o necessário."""
+    genero = tipo_previa(nome, tipo)
+    if genero is None:
+        return _nenhuma("Formato sem prévia.")
+    if genero == "pdf" and pypdf is None:
+        return _nenhuma("Prévia de PDF requer o pacote pypdf.", guardar=False)
+    if genero == "imagem" and Image is None:
+        return _nenhuma("Miniaturas requerem o pacote Pillow.", guardar=False)
+    try:
+        if genero in ("csv", "texto"):
+            amostra, cortado = _inicio(blocos, AMOSTRA_TEXTO)
+            texto = _decodificar(amostra, cortado)
+            return _tabela_csv(texto, cortado) if genero == "csv" else _texto(texto, cortado)
+        if tamanho and tamanho > MAX_ORIGINAL:
+            return _nenhuma("Arquivo grande demais para prévia.")
+        # zip (xlsx/docx), PDF e imagens precisam de acesso aleatório: o conteúdo passa por um spool
+        with tempfile.SpooledTemporaryFile(8 * 1024 * 1024) as f:
+            for b in blocos:
+                f.write(b)
+            f.seek(0)
+            if genero == "xlsx":
+                return {"tipo": "tabela", "planilhas": _planilhas_xlsx(f)}
+            if genero == "docx":
+                return _texto(*_texto_docx(f))
+            if genero == "pdf":
+                paginas = pypdf.PdfReader(f).pages
+                return _texto((paginas[0].extract_text() if len(paginas) else "") or "", len(paginas) > 1)
+            return _miniatura(f)
+    except Exception as e:  # arquivo corrompido ou fora do padrão: fica sem prévia, sem derrubar a página
+        return _nenhuma(f"Não foi possível gerar a prévia ({e.__class__.__name__}).")
+
+
+def _inicio(blocos, n):
+    amostra = bytearray()
+    for b in blocos:
+        amostra += b
+        if len(amostra) > n:
+            return bytes(amostra[:n]), True
+    return bytes(amostra), False
+
+
+def _decodificar(dados, cortado):
+    try:
+        # incremental: um caractere partido no corte da amostra não é erro
+        return codecs.getincrementaldecoder("utf-8-sig")().decode(dados, final=not cortado)
+    except UnicodeDecodeError:
+        return dados.decode("cp1252", errors="replace")
+
+
+def _texto(texto, cortado=False):
+    texto = texto.strip()
+    return {"tipo": "texto", "texto": texto[:CARACTERES], "cortado": cortado or len(texto) > CARACTERES}
+
+
+def _letra(i):
+    letras = ""
+    i += 1
+    while i:
+        i, r = divmod(i - 1, 26)
+        letras = chr(65 + r) + letras
+    return letras
+
+
+def _planilha(nome, linhas, cortada):
+    largura = max((len(l) for l in linhas), default=0)
+    return {
+        "nome": nome,
+        "colunas": [_letra(i) for i in range(largura)],
+        "linhas": [l + [""] * (largura - len(l)) for l in linhas],
+        "cortada": cortada,
+    }
+
+
+def _tabela_csv(texto, cortado):
+    if cortado:
+        texto = texto[:texto.rfind("\n") + 1] or texto  # descarta a última linha, incompleta
+    try:
+        dialeto = csv.Sniffer().sniff(texto[:8192], delimiters=",;\t|")
+    except csv.Error:
+        dialeto = csv.excel
+    linhas = [l[:COLUNAS] for l in islice(csv.reader(io.StringIO(texto), dialeto), LINHAS + 1)]
+    return {"tipo": "tabela", "planilhas": [_planilha("", linhas[:LINHAS], cortado or len(linhas) > LINHAS)]}
+
+
+def _local(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _textos_compartilhados(z):
+    try:
+        f = z.open("xl/sharedStrings.xml")
+    except KeyError:
+        return []
+    textos = []
+    with f:
+        for _, el in ET.iterparse(f):
+            if _local(el.tag) == "si":
+                textos.append("".join(t.text or "" for t in el.iter() if _local(t.tag) == "t"))
+                el.clear()
+    return textos
+
+
+def _coluna(ref):
+    """'BC12' -> 54 (índice a partir de 0)."""
+    n = 0
+    for ch in ref:
+        if not ch.isalpha():
+            break
+        n = n * 26 + ord(ch.upper()) - 64
+    return n - 1
+
+
+def _valor(c, textos):
+    t = c.get("t")
+    v = next((x.text for x in c if _local(x.tag) == "v"), None)
+    if t == "s":
+        return textos[int(v)] if v is not None and int(v) < len(textos) else ""
+    if t == "inlineStr":
+        return "".join(x.text or "" for x in c.iter() if _local(x.tag) == "t")
+    if t == "b":
+        return "VERDADEIRO" if v == "1" else "FALSO"
+    return v or ""  # números e datas como o Excel guarda (datas são números de série)
+
+
+def _linhas_xlsx(f, textos):
+    linhas = []
+    for _, el in ET.iterparse(f):
+        if _local(el.tag) != "row":
+            continue
+        celulas = {}
+        for i, c in enumerate(x for x in el if _local(x.tag) == "c"):
+            col = _coluna(c.get("r")) if c.get("r") else i
+            if col < COLUNAS:
+                celulas[col] = _valor(c, textos)
+        el.clear()
+        if any(celulas.values()):
+            linhas.append([celulas.get(i, "") for i in range(max(celulas) + 1)])
+        if len(linhas) > LINHAS:
+            break  # o resto da planilha nem é lido
+    return linhas
+
+
+def _planilhas_xlsx(f):
+    with zipfile.ZipFile(f) as z:
+        alvos = {r.get("Id"): r.get("Target") for r in ET.fromstring(z.read("xl/_rels/workbook.xml.rels"))}
+        folhas = [(s.get("name"), alvos.get(s.get(f"{REL}id")))
+                  for s in ET.fromstring(z.read("xl/workbook.xml")).iter() if _local(s.tag) == "sheet"]
+        textos = _textos_compartilhados(z)
+        planilhas = []
+        for nome, alvo in folhas[:PLANILHAS]:
+            if not alvo:
+                continue
+            with z.open(alvo.lstrip("/") if alvo.startswith("/") else f"xl/{alvo}") as x:
+                linhas = _linhas_xlsx(x, textos)
+            planilhas.append(_planilha(nome, linhas[:LINHAS], len(linhas) > LINHAS))
+        return planilhas
+
+
+def _texto_docx(f):
+    """Texto até a primeira quebra de página (ou CARACTERES); retorna (texto, cortado)."""
+    partes, tam = [], 0
+    with zipfile.ZipFile(f) as z, z.open("word/document.xml") as x:
+        for evento, el in ET.iterparse(x, events=("start", "end")):
+            nome = _local(el.tag)
+            if evento == "start":
+                pagina = nome == "lastRenderedPageBreak" or (nome == "br" and el.get(f"{W}type") == "page")
+                if pagina and tam:
+                    return "".join(partes), True
+            elif nome == "t":
+                partes.append(el.text or "")
+                tam += len(el.text or "")
+            elif nome == "tab":
+                partes.append("\t")
+            elif nome == "p":
+                partes.append("\n")
+                el.clear()
+            if tam > CARACTERES:
+                return "".join(partes), True
+    return "".join(partes), False
+
+
+def _miniatura(f):
+    with Image.open(f) as im:
+        im.thumbnail(MINIATURA)  # em JPEG decodifica já reduzido (draft)
+        largura, altura = im.size
+        if im.mode in ("RGBA", "LA", "P", "PA"):
+            formato, opcoes = "PNG", {"optimize": True}
+            im = im.convert("RGBA") if im.mode == "PA" else im
+        else:
+            formato, opcoes = "JPEG", {"quality": 80}
+            im = im.convert("RGB") if im.mode != "RGB" else im
+        buf = io.BytesIO()
+        im.save(buf, formato, **opcoes)
+    return {"tipo": "imagem", "formato": formato.lower(), "largura": largura, "altura": altura,
+            "dados": base64.b64encode(buf.getvalue()).decode()}
+
+
+class CachePrevias:
+    """Prévias em JSON, uma por arquivo, com limite de tamanho total e descarte pelo uso mais antigo."""
+
+    def __init__(self, diretorio, limite=LIMITE_CACHE):
+        self.diretorio = Path(diretorio)
+        self.limite = limite
+        self._lock = threading.Lock()
+        self._total = None  # bytes no diretório; medido na primeira gravação do processo
+
+    def _caminho(self, chave):
+        return self.diretorio / f"{chave}-v{VERSAO}.json"
+
+    def obter(self, chave):
+        caminho = self._caminho(chave)
+        try:
+            dados = caminho.read_bytes()
+            os.utime(caminho)  # mtime = último uso, a ordem do LRU
+        except FileNotFoundError:
+            return None
+        return json.loads(dados)
+
+    def guardar(self, chave, previa):
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        dados = json.dumps(previa, ensure_ascii=False).encode()
+        fd, tmp = tempfile.mkstemp(".tmp", "previa_", self.diretorio)
+        with os.fdopen(fd, "wb") as f:
+            f.write(dados)
+        os.replace(tmp, self._caminho(chave))
+        with self._lock:
+            if self._total is None:
+                self._total = self.tamanho()
+            else:
+                self._total += len(dados)
+            if self._total > self.limite:
+                self._total = self._podar()
+
+    def _arquivos(self):
+        """[(mtime, tamanho, caminho)]; outro processo (app e API) pode apagar no meio da listagem."""
+        arquivos = []
+        for p in self.diretorio.glob("*.json"):
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            arquivos.append((st.st_mtime, st.st_size, p))
+        return arquivos
+
+    def _podar(self):
+        """Apaga as prévias usadas há mais tempo até sobrar 90% do limite; retorna o total restante."""
+        arquivos = sorted(self._arquivos())
+        total = sum(a[1] for a in arquivos)
+        for _, tam, p in arquivos:
+            if total <= self.limite * 0.9:
+                break
+            p.unlink(missing_ok=True)
+            total -= tam
+        return total
+
+    def tamanho(self):
+        return sum(a[1] for a in self._arquivos())
+
+    def limpar(self):
+        with self._lock:
+            for p in self.diretorio.glob("*.json"):
+                p.unlink(missing_ok=True)
+            self._total = 0
@@ -0,0 +1,396 @@
+"""Log de alterações (CDC) e réplica somente leitura alimentada por segmentos de log.
+
+Gatilhos em clientes/estudos/anexos anotam (tabela, operação, id) em `cdc_log`. O exportador
+grava os trechos novos do log como segmentos `.cdc.gz` num diretório compartilhado; o aplicador
+reproduz os segmentos num `biblioteca.db` de réplica, guarda a posição por origem e publica
+essa posição em `replicas/<nome>.json`, usada no cálculo de atraso e na limpeza de segmentos.
+
+    python replicacao.py exportar [--destino DIR] [--a-cada 60]
+    python replicacao.py aplicar --replica /srv/replica/biblioteca.db --origem DIR --nome escritorio2 [--a-cada 60]
+    python replicacao.py compactar [--destino DIR]
+    python replicacao.py status [--destino DIR]
+"""
+import argparse
+import base64
+import gzip
+import json
+import os
+import sqlite3
+import time
+import uuid
+from pathlib import Path
+
+import armazenamento
+
+TABELAS = ("clientes", "estudos", "anexos")
+# pai de cada tabela: linhas órfãs não entram na réplica e exclusões descem em cascata
+PAIS = {"estudos": ("clientes", "cliente_id"), "anexos": ("estudos", "estudo_id")}
+EVENTOS_POR_SEGMENTO = 2000
+EXTENSAO = ".cdc.gz"
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS cdc_meta (
+        chave TEXT PRIMARY KEY,
+        valor TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS cdc_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        tabela TEXT NOT NULL,
+        op TEXT NOT NULL,
+        linha_id INTEGER NOT NULL,
+        cliente_id INTEGER
+    )""",
+]
+# cliente dono da linha excluída: mover estudos entre shards exclui num arquivo e insere em outro,
+# e a réplica só aplica a exclusão se a linha ainda for daquele cliente
+DONO = {"estudos": "old.cliente_id", "anexos": "(SELECT cliente_id FROM estudos WHERE id=old.estudo_id)"}
+DONO_NA_REPLICA = {
+    "estudos": "SELECT cliente_id FROM estudos WHERE id=?",
+    "anexos": "SELECT e.cliente_id FROM anexos a JOIN estudos e ON e.id=a.estudo_id WHERE a.id=?",
+}
+# uma réplica não registra as alterações que recebe
+_SO_NO_PRIMARIO = "WHEN NOT EXISTS (SELECT 1 FROM cdc_meta WHERE chave='replica')"
+# em anexos, acessos (acessado_em), a troca de camada (pacote) e o sha256/file_size preenchidos depois
+# em anexos antigos (derivados do conteúdo, que a réplica já tem) não mudam o conteúdo: não viajam
+_ATUALIZACAO = {
+    "anexos": ("UPDATE OF estudo_id, filename, file_type, file_data, codec",
+               " AND new.pacote IS old.pacote"),
+}
+GATILHOS = []
+for _t in TABELAS:
+    _evento_au, _condicao_au = _ATUALIZACAO.get(_t, ("UPDATE", ""))
+    GATILHOS += [
+        f"""CREATE TRIGGER IF NOT EXISTS cdc_{_t}_ai AFTER INSERT ON {_t} {_SO_NO_PRIMARIO} BEGIN
+            INSERT INTO cdc_log (tabela, op, linha_id) VALUES ('{_t}', 'I', new.id);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS cdc_{_t}_au AFTER {_evento_au} ON {_t} {_SO_NO_PRIMARIO}{_condicao_au} BEGIN
+            INSERT INTO cdc_log (tabela, op, linha_id) VALUES ('{_t}', 'U', new.id);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS cdc_{_t}_ad AFTER DELETE ON {_t} {_SO_NO_PRIMARIO} BEGIN
+            INSERT INTO cdc_log (tabela, op, linha_id, cliente_id) VALUES ('{_t}', 'D', old.id, {DONO.get(_t, 'NULL')});
+        END""",
+    ]
+
+
+def init_cdc(conn):
+    """Cria o log e os gatilhos; num banco que já tem dados, o log nasce com um 'I' por linha."""
+    c = conn.cursor()
+    novo = not c.execute("SELECT 1 FROM sqlite_master WHERE name='cdc_log'").fetchone()
+    for sql in SCHEMA:
+        c.execute(sql)
+    if "cliente_id" not in _colunas(c, "cdc_log"):
+        c.execute("ALTER TABLE cdc_log ADD COLUMN cliente_id INTEGER")
+    # gatilhos com definição antiga (de versões anteriores) são trocados
+    for sql in GATILHOS:
+        armazenamento.criar_gatilho(c, sql)
+    c.execute("INSERT OR IGNORE INTO cdc_meta (chave, valor) VALUES ('origem', ?)", (uuid.uuid4().hex,))
+    if novo and not _meta(c, "replica"):
+        for t in TABELAS:
+            c.execute(f"INSERT INTO cdc_log (tabela, op, linha_id) SELECT '{t}', 'I', id FROM {t} ORDER BY id")
+
+
+def _meta(c, chave, padrao=None):
+    r = c.execute("SELECT valor FROM cdc_meta WHERE chave=?", (chave,)).fetchone()
+    return r[0] if r else padrao
+
+
+def _set_meta(c, chave, valor):
+    c.execute(
+        "INSERT INTO cdc_meta (chave, valor) VALUES (?, ?) ON CONFLICT(chave) DO UPDATE SET valor=excluded.valor",
+        (chave, str(valor))
+    )
+
+
+def _conn(caminho):
+    conn = sqlite3.connect(str(caminho), timeout=30, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def pendentes(fontes):
+    """Eventos no log ainda não exportados, somados entre as fontes."""
+    total = 0
+    for caminho, tabelas in fontes:
+        conn = _conn(caminho)
+        total += conn.cursor().execute(
+            f"SELECT COUNT(*) FROM cdc_log WHERE tabela IN ({','.join('?' * len(tabelas))})", tabelas
+        ).fetchone()[0]
+        conn.close()
+    return total
+
+
+# ==================== EXPORTAÇÃO ====================
+def _valor(v):
+    return {"$b64": base64.b64encode(v).decode()} if isinstance(v, bytes) else v
+
+
+def _segmento_nome(rodada, ordem, origem, ini, fim):
+    # a ordem alfabética dos nomes é a ordem de aplicação
+    return f"{rodada:020d}_{ordem:05d}_{origem}_{ini:012d}-{fim:012d}{EXTENSAO}"
+
+
+def _segmento_info(caminho):
+    _, _, origem, faixa = Path(caminho).name[:-len(EXTENSAO)].split("_")
+    ini, fim = faixa.split("-")
+    return origem, int(ini), int(fim)
+
+
+def exportar(fontes, destino, epoca=0, progresso=None, completar=None):
+    """Grava os eventos novos de cada fonte como segmentos em `destino`; retorna os caminhos criados.
+
+    `fontes` é uma lista de (arquivo, tabelas exportadas dele). Vários eventos da mesma linha num
+    segmento viram um só, com o conteúdo atual da linha (ou exclusão, se ela não existe mais).
+    O trecho exportado sai do log na mesma transação que avança a marca 'exportado'.
+    `completar(tabela, linha)` pode trocar o conteúdo da linha antes da gravação (anexos frios).
+    """
+    destino = Path(destino)
+    destino.mkdir(parents=True, exist_ok=True)
+    rodada = time.time_ns()
+    criados = []
+    for ordem, (caminho, tabelas) in enumerate(fontes):
+        conn = _conn(caminho)
+        c = conn.cursor()
+        origem = _meta(c, "origem")
+        while True:
+            eventos = c.execute(
+                f"""SELECT seq, tabela, op, linha_id, cliente_id FROM cdc_log
+                    WHERE seq > ? AND tabela IN ({','.join('?' * len(tabelas))}) ORDER BY seq LIMIT ?""",
+                (int(_meta(c, "exportado", 0)), *tabelas, EVENTOS_POR_SEGMENTO)
+            ).fetchall()
+            if not eventos:
+                break
+            ini, fim = eventos[0]["seq"], eventos[-1]["seq"]
+            ultimo = {}
+            for e in eventos:
+                ultimo[(e["tabela"], e["linha_id"])] = (e["seq"], e["cliente_id"])
+            nome = _segmento_nome(rodada, ordem, origem, ini, fim)
+            tmp = destino / (nome + ".tmp")
+            with gzip.open(tmp, "wt", encoding="utf-8") as f:
+                cab = {"origem": origem, "epoca": epoca, "ini": ini, "fim": fim, "criado_em": time.time()}
+                f.write(json.dumps(cab) + "\n")
+                # a linha sai com o seq do último evento, que pode vir depois do de um filho (estudo
+                # alterado após ganhar um anexo): gravações vão dos pais aos filhos e exclusões, dos
+                # filhos aos pais, senão a réplica descartaria o filho como órfão
+                excluidas = []
+                for (tabela, linha_id), (seq, dono) in sorted(
+                    ultimo.items(), key=lambda x: (TABELAS.index(x[0][0]), x[1][0])
+                ):
+                    linha = c.execute(f"SELECT * FROM {tabela} WHERE id=?", (linha_id,)).fetchone()
+                    if not linha:
+                        excluidas.append({"seq": seq, "tabela": tabela, "id": linha_id, "op": "D",
+                                          **({"cliente_id": dono} if dono is not None else {})})
+                        continue
+                    linha = {k: linha[k] for k in linha.keys()}
+                    if completar:
+                        linha = completar(tabela, linha)
+                    evento = {"seq": seq, "tabela": tabela, "id": linha_id, "op": "U",
+                              "linha": {k: _valor(v) for k, v in linha.items()}}
+                    f.write(json.dumps(evento, ensure_ascii=False) + "\n")
+                for evento in sorted(excluidas, key=lambda e: (-TABELAS.index(e["tabela"]), e["seq"])):
+                    f.write(json.dumps(evento, ensure_ascii=False) + "\n")
+            tmp.rename(destino / nome)
+            criados.append(destino / nome)
+            c.execute("DELETE FROM cdc_log WHERE seq <= ?", (fim,))
+            _set_meta(c, "exportado", fim)
+            conn.commit()
+            if progresso:
+                progresso(100 * (ordem + 1) / len(fontes), f"{len(criados)} segmento(s)")
+        conn.close()
+    return criados
+
+
+def _ler(caminho):
+    with gzip.open(caminho, "rt", encoding="utf-8") as f:
+        cab = json.loads(f.readline())
+        yield cab
+        for linha in f:
+            yield json.loads(linha)
+
+
+def _cabecalho(caminho):
+    with gzip.open(caminho, "rt", encoding="utf-8") as f:
+        return json.loads(f.readline())
+
+
+def segmentos(diretorio):
+    return sorted(Path(diretorio).glob(f"*{EXTENSAO}"))
+
+
+# ==================== RÉPLICA ====================
+def _colunas(c, tabela):
+    return [r[1] for r in c.execute(f"PRAGMA table_info({tabela})")]
+
+
+def _excluir(c, tabela, linha_id, dono=None):
+    if dono is not None and tabela in DONO_NA_REPLICA:
+        atual = c.execute(DONO_NA_REPLICA[tabela], (linha_id,)).fetchone()
+        if atual and atual[0] != dono:
+            return  # a linha já chegou pelo shard do novo cliente
+    if tabela == "clientes":
+        c.execute("DELETE FROM anexos WHERE estudo_id IN (SELECT id FROM estudos WHERE cliente_id=?)", (linha_id,))
+        c.execute("DELETE FROM estudos WHERE cliente_id=?", (linha_id,))
+    elif tabela == "estudos":
+        c.execute("DELETE FROM anexos WHERE estudo_id=?", (linha_id,))
+    c.execute(f"DELETE FROM {tabela} WHERE id=?", (linha_id,))
+
+
+def _gravar(c, tabela, linha, colunas):
+    pai = PAIS.get(tabela)
+    if pai and not c.execute(f"SELECT 1 FROM {pai[0]} WHERE id=?", (linha.get(pai[1]),)).fetchone():
+        return
+    cols = [k for k in colunas if k in linha]
+    valores = [base64.b64decode(v["$b64"]) if isinstance(v, dict) else v for v in (linha[k] for k in cols)]
+    # upsert (e não REPLACE) para que os gatilhos do FTS vejam um UPDATE
+    c.execute(
+        f"""INSERT INTO {tabela} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})
+            ON CONFLICT(id) DO UPDATE SET {', '.join(f'{k}=excluded.{k}' for k in cols if k != 'id')}""",
+        valores
+    )
+
+
+def preparar_replica(conn, criar_esquema):
+    c = conn.cursor()
+    criar_esquema(conn)
+    _set_meta(c, "replica", 1)
+    c.execute("DELETE FROM cdc_log")
+    c.execute("""CREATE TABLE IF NOT EXISTS replica_posicao (
+        origem TEXT PRIMARY KEY,
+        seq INTEGER NOT NULL
+    )""")
+    conn.commit()
+
+
+def aplicar(replica_db, origem_dir, nome, criar_esquema, progresso=None):
+    """Reproduz na réplica os segmentos ainda não aplicados; retorna quantos foram aplicados.
+
+    Cada segmento entra numa transação junto com a nova posição, então reaplicar é inofensivo.
+    Segmentos de uma época anterior são ignorados; uma época nova (restauração ou migração no
+    primário) limpa a réplica, que é remontada pelos segmentos seguintes.
+    """
+    origem_dir = Path(origem_dir)
+    conn = _conn(replica_db)
+    preparar_replica(conn, criar_esquema)
+    c = conn.cursor()
+    colunas = {t: _colunas(c, t) for t in TABELAS}
+    posicoes = {r["origem"]: r["seq"] for r in c.execute("SELECT origem, seq FROM replica_posicao")}
+    epoca = int(_meta(c, "epoca", 0))
+    lista = segmentos(origem_dir)
+    aplicados = 0
+    for i, seg in enumerate(lista):
+        origem, _, fim = _segmento_info(seg)
+        if fim <= posicoes.get(origem, 0):
+            continue
+        eventos = _ler(seg)
+        cab = next(eventos)
+        if cab["epoca"] < epoca:
+            continue
+        if cab["epoca"] > epoca:
+            for t in reversed(TABELAS):
+                c.execute(f"DELETE FROM {t}")
+            c.execute("DELETE FROM replica_posicao")
+            posicoes, epoca = {}, cab["epoca"]
+            _set_meta(c, "epoca", epoca)
+        for e in eventos:
+            if e["seq"] <= posicoes.get(origem, 0):
+                continue
+            if e["op"] == "D":
+                _excluir(c, e["tabela"], e["id"], e.get("cliente_id"))
+            else:
+                _gravar(c, e["tabela"], e["linha"], colunas[e["tabela"]])
+        posicoes[origem] = fim
+        c.execute(
+            "INSERT INTO replica_posicao (origem, seq) VALUES (?, ?) ON CONFLICT(origem) DO UPDATE SET seq=excluded.seq",
+            (origem, fim)
+        )
+        _set_meta(c, "aplicado_em", time.time())
+        conn.commit()
+        aplicados += 1
+        if progresso:
+            progresso(100 * (i + 1) / len(lista), seg.name)
+    conn.close()
+    _publicar(origem_dir, nome, posicoes, epoca)
+    return aplicados
+
+
+def _publicar(origem_dir, nome, posicoes, epoca):
+    pasta = Path(origem_dir) / "replicas"
+    pasta.mkdir(exist_ok=True)
+    tmp = pasta / f"{nome}.json.tmp"
+    tmp.write_text(json.dumps({"nome": nome, "epoca": epoca, "posicoes": posicoes, "aplicado_em": time.time()}))
+    tmp.replace(pasta / f"{nome}.json")
+
+
+def replicas(origem_dir):
+    return [json.loads(p.read_text()) for p in sorted((Path(origem_dir) / "replicas").glob("*.json"))]
+
+
+def _aplicado(replica, cab, origem, fim):
+    if replica["epoca"] != cab["epoca"]:
+        return replica["epoca"] > cab["epoca"]
+    return replica["posicoes"].get(origem, 0) >= fim
+
+
+def situacao(origem_dir):
+    """Por réplica: segmentos pendentes e atraso (idade do segmento pendente mais antigo)."""
+    lista = [(seg, _cabecalho(seg), *_segmento_info(seg)) for seg in segmentos(origem_dir)]
+    agora = time.time()
+    r = []
+    for rep in replicas(origem_dir):
+        faltam = [cab for seg, cab, origem, _, fim in lista if not _aplicado(rep, cab, origem, fim)]
+        r.append({
+            "nome": rep["nome"],
+            "pendentes": len(faltam),
+            "atraso_seg": agora - min(cab["criado_em"] for cab in faltam) if faltam else 0.0,
+            "aplicado_em": rep["aplicado_em"],
+        })
+    return r
+
+
+def compactar(origem_dir):
+    """Apaga os segmentos que todas as réplicas conhecidas já aplicaram; retorna quantos."""
+    reps = replicas(origem_dir)
+    if not reps:
+        return 0
+    apagados = 0
+    for seg in segmentos(origem_dir):
+        origem, _, fim = _segmento_info(seg)
+        cab = _cabecalho(seg)
+        if all(_aplicado(rep, cab, origem, fim) for rep in reps):
+            seg.unlink()
+            apagados += 1
+    return apagados
+
+
+def main():
+    import core
+
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("acao", choices=["exportar", "aplicar", "compactar", "status"])
+    ap.add_argument("--destino", "--origem", dest="dir", default=str(core.REPLICACAO_DIR),
+                    help="diretório dos segmentos (compartilhado com as réplicas)")
+    ap.add_argument("--replica", help="banco da réplica (aplicar)")
+    ap.add_argument("--nome", default=os.uname().nodename, help="nome da réplica (aplicar)")
+    ap.add_argument("--a-cada", type=int, default=0, help="repete a cada N segundos")
+    args = ap.parse_args()
+
+    while True:
+        if args.acao == "exportar":
+            core.init_db()
+            print(f"{len(core.exportar_alteracoes(args.dir))} segmento(s) exportado(s)")
+        elif args.acao == "aplicar":
+            if not args.replica:
+                ap.error("informe --replica")
+            Path(args.replica).parent.mkdir(parents=True, exist_ok=True)
+            print(f"{aplicar(args.replica, args.dir, args.nome, core.criar_esquema)} segmento(s) aplicado(s)")
+        elif args.acao == "compactar":
+            print(f"{compactar(args.dir)} segmento(s) apagado(s)")
+        else:
+            for r in situacao(args.dir):
+                print(f"{r['nome']}: {r['pendentes']} pendente(s), atraso {r['atraso_seg']:.0f}s")
+        if not args.a_cada:
+            break
+        time.sleep(args.a_cada)
+
+
+if __name__ == "__main__":
+    main()
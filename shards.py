@@ -0,0 +1,215 @@
+"""Layout opcional com um arquivo SQLite por cliente (shard) e um catálogo central.
+
+O modo fica ativo quando existe `data/shards/catalogo.db`. O catálogo guarda os clientes,
+as configurações e os mapas id -> cliente de estudos e anexos; esses mapas também geram os
+ids (AUTOINCREMENT), que continuam únicos entre shards.
+
+    python shards.py migrar      # converte data/biblioteca.db (com o app parado)
+"""
+import json
+import shutil
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="shard")
+
+
+class Layout:
+    def __init__(self, diretorio):
+        self.diretorio = Path(diretorio)
+        self.catalogo = self.diretorio / "catalogo.db"
+        # existe enquanto `trocar` troca os diretórios, também para outros processos (API, carga)
+        self.marca_troca = self.diretorio.with_name(self.diretorio.name + ".trocando")
+        self._versoes = {}  # arquivo -> (estado no disco, (instancia, n)) da última leitura
+
+    def aguardar_troca(self, espera=30):
+        """Espera a troca de diretórios terminar; nenhuma conexão nova é aberta enquanto a marca existe."""
+        limite = time.monotonic() + espera
+        while self.marca_troca.exists():
+            if time.monotonic() >= limite:
+                raise RuntimeError("Troca do diretório de shards em andamento; tente novamente")
+            time.sleep(0.02)
+
+    def ativo(self, espera=30):
+        # no meio de uma troca o diretório some por um instante: responder False aqui faria
+        # o chamador cair no banco único e criar um biblioteca.db avulso
+        self.aguardar_troca(espera)
+        return self.catalogo.exists()
+
+    def trocar(self, novo, drenar=None):
+        """Põe o diretório `novo` no lugar do atual (usado ao restaurar um backup).
+
+        `drenar` roda já com a marca criada e antes de renomear: fecha (ou espera fechar) as conexões
+        abertas no diretório atual, que de outro modo continuariam gravando no diretório substituído.
+        """
+        antigo = self.diretorio.with_name(self.diretorio.name + ".antigo")
+        shutil.rmtree(antigo, ignore_errors=True)
+        self.marca_troca.touch()
+        try:
+            if drenar:
+                drenar()
+            self.diretorio.rename(antigo)
+            novo.rename(self.diretorio)
+        finally:
+            self.marca_troca.unlink(missing_ok=True)
+        shutil.rmtree(antigo, ignore_errors=True)
+
+    def caminho(self, cid):
+        return self.diretorio / f"cliente_{int(cid)}.db"
+
+    def _conn(self):
+        self.aguardar_troca()
+        conn = sqlite3.connect(str(self.catalogo), timeout=30, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def init_catalogo(conn):
+        c = conn.cursor()
+        c.execute("""CREATE TABLE IF NOT EXISTS estudos_idx (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cliente_id INTEGER NOT NULL
+        )""")
+        c.execute("""CREATE TABLE IF NOT EXISTS anexos_idx (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cliente_id INTEGER NOT NULL,
+            estudo_id INTEGER NOT NULL
+        )""")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_estudos_idx_cliente ON estudos_idx(cliente_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_anexos_idx_estudo ON anexos_idx(estudo_id)")
+
+    def clientes(self):
+        conn = self._conn()
+        r = [row[0] for row in conn.cursor().execute("SELECT id FROM clientes ORDER BY id")]
+        conn.close()
+        return r
+
+    def arquivos(self):
+        return [self.catalogo] + [self.caminho(cid) for cid in self.clientes() if self.caminho(cid).exists()]
+
+    def versao(self):
+        """Contadores de versao_dados do catálogo e de cada shard.
+
+        Um arquivo só é consultado de novo quando ele ou seu -wal mudou no disco: um acesso registrado
+        muda o arquivo mas não o contador, e o resultado continua o mesmo."""
+        versoes = []
+        for p in sorted(self.diretorio.glob("*.db")):
+            try:
+                disco = tuple((s.st_ino, s.st_mtime_ns, s.st_size)
+                              for s in [p.stat()] + [w.stat() for w in [Path(f"{p}-wal")] if w.exists()])
+                visto = self._versoes.get(p)
+                if not visto or visto[0] != disco:
+                    conn = sqlite3.connect(str(p), timeout=30)
+                    try:
+                        r = conn.execute("SELECT instancia, n FROM versao_dados").fetchone()
+                    finally:
+                        conn.close()
+                    visto = self._versoes[p] = disco, tuple(r)
+            except (FileNotFoundError, sqlite3.OperationalError):
+                # shard trocado no meio da varredura, ou ainda sem o esquema (nada gravado desde então)
+                continue
+            versoes.append(visto[1])
+        return tuple(versoes)
+
+    def cliente_de(self, tabela, item_id):
+        """Cliente dono de um estudo ou anexo (tabela = 'estudos' | 'anexos')."""
+        conn = self._conn()
+        r = conn.cursor().execute(f"SELECT cliente_id FROM {tabela}_idx WHERE id=?", (item_id,)).fetchone()
+        conn.close()
+        return r[0] if r else None
+
+    def agrupar(self, tabela, ids):
+        """{cliente: [ids]} dos estudos/anexos informados, numa consulta só."""
+        conn = self._conn()
+        r = {}
+        for cid, item_id in conn.cursor().execute(
+            f"SELECT cliente_id, id FROM {tabela}_idx WHERE id IN (SELECT value FROM json_each(?)) ORDER BY cliente_id",
+            (json.dumps(list(ids)),)
+        ):
+            r.setdefault(cid, []).append(item_id)
+        conn.close()
+        return r
+
+    def registrar(self, tabela, cid, estudo_id=None):
+        """Reserva um id global para um novo estudo/anexo do cliente."""
+        conn = self._conn()
+        c = conn.cursor()
+        if tabela == "anexos":
+            c.execute("INSERT INTO anexos_idx (cliente_id, estudo_id) VALUES (?, ?)", (cid, estudo_id))
+        else:
+            c.execute("INSERT INTO estudos_idx (cliente_id) VALUES (?)", (cid,))
+        conn.commit()
+        novo = c.lastrowid
+        conn.close()
+        return novo
+
+    def esquecer(self, estudos=(), anexos=()):
+        conn = self._conn()
+        c = conn.cursor()
+        estudos, anexos = json.dumps(list(estudos)), json.dumps(list(anexos))
+        c.execute("DELETE FROM anexos_idx WHERE estudo_id IN (SELECT value FROM json_each(?))", (estudos,))
+        c.execute("DELETE FROM estudos_idx WHERE id IN (SELECT value FROM json_each(?))", (estudos,))
+        c.execute("DELETE FROM anexos_idx WHERE id IN (SELECT value FROM json_each(?))", (anexos,))
+        conn.commit()
+        conn.close()
+
+    def realocar(self, estudos, cid):
+        """Aponta os estudos (e os anexos deles) para o shard de outro cliente."""
+        conn = self._conn()
+        c = conn.cursor()
+        estudos = json.dumps(list(estudos))
+        c.execute("UPDATE estudos_idx SET cliente_id=? WHERE id IN (SELECT value FROM json_each(?))", (cid, estudos))
+        c.execute("UPDATE anexos_idx SET cliente_id=? WHERE estudo_id IN (SELECT value FROM json_each(?))", (cid, estudos))
+        conn.commit()
+        conn.close()
+
+    def remover(self, cid):
+        """Excluir um cliente vira apagar o arquivo dele (e as entradas no catálogo)."""
+        conn = self._conn()
+        c = conn.cursor()
+        c.execute("DELETE FROM anexos_idx WHERE cliente_id=?", (cid,))
+        c.execute("DELETE FROM estudos_idx WHERE cliente_id=?", (cid,))
+        c.execute("DELETE FROM clientes WHERE id=?", (cid,))
+        conn.commit()
+        conn.close()
+        for sufixo in ("", "-wal", "-shm", "-journal"):
+            Path(f"{self.caminho(cid)}{sufixo}").unlink(missing_ok=True)
+
+    def contagens(self):
+        conn = self._conn()
+        c = conn.cursor()
+        r = {
+            "clientes": c.execute("SELECT COUNT(*) FROM clientes").fetchone()[0],
+            "estudos": c.execute("SELECT COUNT(*) FROM estudos_idx").fetchone()[0],
+            "anexos": c.execute("SELECT COUNT(*) FROM anexos_idx").fetchone()[0],
+        }
+        conn.close()
+        return r
+
+
+def em_paralelo(func, itens):
+    """Aplica `func` a cada item no pool de shards, preservando a ordem dos resultados."""
+    return list(_pool.map(func, itens))
+
+
+def main():
+    import core
+
+    if len(sys.argv) < 2 or sys.argv[1] != "migrar":
+        print(__doc__)
+        return
+    if core.SHARDS.ativo():
+        print(f"Já em modo shards ({core.SHARDS.diretorio}).")
+        return
+    core.init_db()
+    n = core.migrar_para_shards(core.DB_PATH, core.SHARDS.diretorio, progresso=lambda p, m: print(f"{p:5.1f}% {m}"))
+    antigo = core.DB_PATH.with_name(core.DB_PATH.name + ".antes-shards")
+    core.DB_PATH.rename(antigo)
+    print(f"✅ {n} cliente(s) migrados para {core.SHARDS.diretorio}; banco antigo mantido em {antigo}")
+
+
+if __name__ == "__main__":
+    main()
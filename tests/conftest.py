@@ -0,0 +1,30 @@
+"""Testes que usam o núcleo rodam num diretório de dados temporário, zerado a cada teste."""
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+DADOS = Path(tempfile.mkdtemp(prefix="biblioteca-testes-"))
+# core lê os caminhos na importação: o ambiente precisa estar pronto antes
+os.environ["BIBLIOTECA_DATA_DIR"] = str(DADOS)
+for _var in ("BIBLIOTECA_REPLICACAO_DIR", "BIBLIOTECA_FRIO_DIR", "BIBLIOTECA_MEMORIA"):
+    os.environ.pop(_var, None)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def core():
+    import core as modulo
+
+    for p in DADOS.iterdir():
+        shutil.rmtree(p) if p.is_dir() else p.unlink()
+    modulo._esquemas_prontos.clear()
+    modulo.init_db()
+    return modulo
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(DADOS, ignore_errors=True)
@@ -0,0 +1,55 @@
+import base64
+import os
+
+import analise
+
+
+def _anexo_legado(core, eid, dados):
+    """Anexo como as versões antigas gravavam: base64 em TEXT, sem codec."""
+    conn = core.conn_estudo(eid)
+    conn.execute("INSERT INTO anexos (estudo_id, filename, file_type, file_data, file_size) VALUES (?, ?, ?, ?, ?)",
+                 (eid, "legado.txt", "text/plain", base64.b64encode(dados).decode(), len(dados)))
+    conn.commit()
+    conn.close()
+
+
+def _deriva(core):
+    conn = core.get_conn()
+    n = analise.reconstruir(conn)
+    conn.rollback()
+    conn.close()
+    return n
+
+
+def test_reconstruir_nao_acha_deriva_depois_de_operacoes_em_lote(core):
+    a, b = core.criar_cliente("Cliente A"), core.criar_cliente("Cliente B")
+    estudos = [core.criar_estudo(a, f"Estudo {i}", "resumo", "icms, pis") for i in range(6)]
+    for i, eid in enumerate(estudos):
+        core.add_anexo(eid, f"a{i}.txt", "text/plain", b"texto repetido " * 500, 7500)
+        core.add_anexo(eid, f"b{i}.jpg", "image/jpeg", os.urandom(3000), 3000)
+    _anexo_legado(core, estudos[0], os.urandom(1000))
+    _anexo_legado(core, estudos[1], os.urandom(1001))
+    assert _deriva(core) == 0
+
+    core.alterar_tags_estudos(estudos[:3], adicionar=["cofins"], remover=["pis"])
+    core.mover_estudos(estudos[:2], b)
+    core.excluir_estudos(estudos[4:])
+    conn = core.get_conn()
+    conn.execute("UPDATE anexos SET created_at=datetime('now', '-1 day')")
+    conn.commit()
+    conn.close()
+    assert core.arquivar_anexos(idade_dias=0, ocioso_dias=0)["anexos"] > 0
+    core.excluir_anexo(core.listar_anexos(estudos[2])[0]["id"])
+    assert _deriva(core) == 0
+
+
+def test_armazenado_de_legado_sem_ler_o_base64(core):
+    cid = core.criar_cliente("Cliente")
+    eid = core.criar_estudo(cid, "Estudo", "resumo")
+    for n in (1000, 1001, 1002):
+        _anexo_legado(core, eid, os.urandom(n))
+    conn = core.get_conn()
+    esperado = conn.execute("SELECT SUM(length(CAST(file_data AS BLOB))) FROM anexos").fetchone()[0]
+    assert conn.execute("SELECT bytes_armazenados FROM agg_anexos_cliente WHERE cliente_id=?",
+                        (cid,)).fetchone()[0] == esperado
+    conn.close()
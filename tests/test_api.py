@@ -0,0 +1,130 @@
+import asyncio
+import base64
+import json
+import os
+
+import pytest
+
+import api
+
+
+def _requisitar(brutas):
+    """Envia cada requisição crua numa conexão nova; devolve [(status, cabecalhos, corpo)]."""
+
+    async def rodar():
+        srv = api.Servidor(2)
+        server = await asyncio.start_server(srv.conexao, "127.0.0.1", 0)
+        porta = server.sockets[0].getsockname()[1]
+        respostas = []
+        try:
+            for bruta in brutas:
+                r, w = await asyncio.open_connection("127.0.0.1", porta)
+                w.write(bruta)
+                await w.drain()
+                dados = await asyncio.wait_for(r.read(), 10)
+                w.close()
+                cabeca, _, corpo = dados.partition(b"\r\n\r\n")
+                linhas = cabeca.decode("latin-1").split("\r\n")
+                cab = {k.lower(): v.strip() for k, _, v in (h.partition(":") for h in linhas[1:])}
+                respostas.append((int(linhas[0].split()[1]), cab, corpo))
+        finally:
+            server.close()
+            srv.pool.shutdown()
+        return respostas
+
+    return asyncio.run(rodar())
+
+
+def _get(caminho, **cabecalhos):
+    linhas = [f"GET {caminho} HTTP/1.1", "Connection: close"]
+    linhas += [f"{k.replace('_', '-')}: {v}" for k, v in cabecalhos.items()]
+    return ("\r\n".join(linhas) + "\r\n\r\n").encode()
+
+
+def _anexo(core, eid, nome, tipo, dados):
+    core.add_anexo(eid, nome, tipo, dados, len(dados))
+    return core.listar_anexos(eid, 1)[0]["id"]
+
+
+@pytest.fixture
+def estudo(core):
+    cid = core.criar_cliente("Cliente API")
+    return core.criar_estudo(cid, "Estudo", "resumo", "icms")
+
+
+def test_range_etag_e_if_range(core, estudo):
+    dados = os.urandom(300_000)
+    aid = _anexo(core, estudo, "dados.bin", "application/octet-stream", dados)
+    etag = f'"{core.hash_anexo(aid)}"'
+    url = f"/anexos/{aid}/conteudo"
+    inteiro, parcial, sufixo, revalidado, outro_etag, fora = _requisitar([
+        _get(url),
+        _get(url, Range="bytes=1000-1999"),
+        _get(url, Range="bytes=-10"),
+        _get(url, If_None_Match=etag),
+        _get(url, Range="bytes=0-9", If_Range='"outro"'),
+        _get(url, Range=f"bytes={len(dados)}-"),
+    ])
+    assert inteiro[0] == 200 and inteiro[1]["etag"] == etag and inteiro[2] == dados
+    assert parcial[0] == 206 and parcial[2] == dados[1000:2000]
+    assert parcial[1]["content-range"] == f"bytes 1000-1999/{len(dados)}"
+    assert sufixo[0] == 206 and sufixo[2] == dados[-10:]
+    assert revalidado[0] == 304 and revalidado[2] == b""
+    assert outro_etag[0] == 200 and outro_etag[2] == dados
+    assert fora[0] == 416 and fora[1]["content-range"] == f"bytes */{len(dados)}"
+
+
+@pytest.mark.parametrize("codec", ["raw", "zstd", "legado"])
+def test_content_length_sai_do_conteudo_e_nao_do_file_size(core, estudo, codec):
+    dados = b"apuracao de icms e pis " * 4000 if codec == "zstd" else os.urandom(10_001)
+    if codec == "legado":
+        conn = core.conn_estudo(estudo)
+        aid = conn.execute("INSERT INTO anexos (estudo_id, filename, file_type, file_data) VALUES (?, ?, ?, ?)",
+                           (estudo, "legado.bin", "application/octet-stream",
+                            base64.b64encode(dados).decode())).lastrowid
+        conn.commit()
+        conn.close()
+    else:
+        aid = _anexo(core, estudo, "dados.txt", "text/plain", dados)
+    conn = core.conn_anexo(aid)
+    assert (conn.execute("SELECT codec FROM anexos WHERE id=?", (aid,)).fetchone()[0] or "legado") == codec
+    # file_size gravado errado (e o sha256 já presente, para não ser recalculado)
+    conn.execute("UPDATE anexos SET file_size=?, sha256='x' WHERE id=?", (len(dados) + 500, aid))
+    conn.commit()
+    conn.close()
+
+    assert core.tamanho_anexo(aid) == len(dados)
+    (status, cab, corpo), (status_fim, cab_fim, corpo_fim) = _requisitar([
+        _get(f"/anexos/{aid}/conteudo"),
+        _get(f"/anexos/{aid}/conteudo", Range="bytes=-3"),
+    ])
+    assert status == 200 and int(cab["content-length"]) == len(dados) and corpo == dados
+    assert status_fim == 206 and corpo_fim == dados[-3:]
+    assert cab_fim["content-range"] == f"bytes {len(dados) - 3}-{len(dados) - 1}/{len(dados)}"
+
+
+def test_conexao_fecha_quando_o_conteudo_encolhe(core, estudo, monkeypatch):
+    aid = _anexo(core, estudo, "dados.bin", "application/octet-stream", os.urandom(5000))
+    # o conteúdo muda entre o cálculo do tamanho e a leitura
+    monkeypatch.setattr(core, "tamanho_anexo", lambda aid: 6000)
+    (status, cab, corpo), = _requisitar([_get(f"/anexos/{aid}/conteudo").replace(b"close", b"keep-alive")])
+    # r.read() só voltou porque o servidor fechou, mesmo com keep-alive
+    assert status == 200 and cab["content-length"] == "6000" and len(corpo) == 5000
+
+
+def test_anexos_do_estudo_paginados(core, estudo):
+    ids = [_anexo(core, estudo, f"a{i}.bin", "application/octet-stream", b"x") for i in range(5)]
+    primeira, segunda, inexistente = _requisitar([
+        _get(f"/estudos/{estudo}/anexos?limite=3"),
+        _get(f"/estudos/{estudo}/anexos?limite=3&offset=3"),
+        _get("/estudos/999/anexos"),
+    ])
+    p1, p2 = json.loads(primeira[2]), json.loads(segunda[2])
+    assert p1["proximo"] == f"/estudos/{estudo}/anexos?limite=3&offset=3" and p2["proximo"] is None
+    assert [a["id"] for a in p1["itens"] + p2["itens"]] == ids[::-1]
+    assert inexistente[0] == 404
+
+
+def test_content_length_invalido(core):
+    (status, cab, _), = _requisitar([b"GET /clientes HTTP/1.1\r\nContent-Length: abc\r\n\r\n"])
+    assert status == 400 and cab["connection"] == "close"
@@ -0,0 +1,74 @@
+import base64
+import os
+import sqlite3
+from collections import namedtuple
+
+import pytest
+
+import armazenamento
+
+
+def _banco_com_paginas_livres(caminho, auto_vacuum="NONE"):
+    conn = sqlite3.connect(caminho)
+    conn.execute(f"PRAGMA auto_vacuum={auto_vacuum}")
+    conn.execute("CREATE TABLE t (dados BLOB)")
+    conn.executemany("INSERT INTO t VALUES (?)", [(os.urandom(8000),) for _ in range(200)])
+    conn.commit()
+    conn.execute("DELETE FROM t WHERE rowid % 2 = 0")
+    conn.commit()
+    conn.close()
+
+
+def test_compactar_migra_para_incremental(tmp_path):
+    db = tmp_path / "antigo.db"
+    _banco_com_paginas_livres(db)
+    conn = armazenamento._conn(db)
+    antes = armazenamento.paginas(conn)
+    conn.close()
+    assert antes["auto_vacuum"] == "NONE" and antes["freelist"] > 0
+
+    assert armazenamento.compactar(db) > 0
+    conn = armazenamento._conn(db)
+    depois = armazenamento.paginas(conn)
+    conn.close()
+    assert depois["auto_vacuum"] == "INCREMENTAL" and depois["freelist"] == 0
+
+
+def test_vacuum_incremental_roda_ate_o_fim(tmp_path):
+    db = tmp_path / "novo.db"
+    _banco_com_paginas_livres(db, "INCREMENTAL")
+    conn = armazenamento._conn(db)
+    livres = armazenamento.paginas(conn)["freelist"]
+    conn.close()
+    assert livres > 10
+    assert armazenamento.vacuum_incremental(db, max_paginas=10) == 10
+    assert armazenamento.vacuum_incremental(db, max_paginas=10_000) == livres - 10
+    assert armazenamento.vacuum_incremental(db) == 0
+
+
+def test_compactar_recusa_sem_espaco_em_disco(tmp_path, monkeypatch):
+    db = tmp_path / "antigo.db"
+    _banco_com_paginas_livres(db)
+    uso = namedtuple("uso", "total used free")
+    monkeypatch.setattr(armazenamento.shutil, "disk_usage", lambda p: uso(0, 0, db.stat().st_size))
+    with pytest.raises(RuntimeError, match="insuficiente"):
+        armazenamento.compactar(db)
+
+
+def test_relatorio_conta_anexos_legados_pelo_base64(core):
+    cid = core.criar_cliente("Cliente")
+    eid = core.criar_estudo(cid, "Estudo", "resumo")
+    core.add_anexo(eid, "foto.jpg", "image/jpeg", os.urandom(5000), 5000)
+    legado = os.urandom(1001)
+    conn = core.conn_estudo(eid)
+    conn.execute("INSERT INTO anexos (estudo_id, filename, file_type, file_data, file_size) VALUES (?, ?, ?, ?, ?)",
+                 (eid, "legado.bin", "application/octet-stream", base64.b64encode(legado).decode(), len(legado)))
+    conn.commit()
+    conn.close()
+
+    rel = core.relatorio_armazenamento()
+    (cliente,) = rel["por_cliente"]
+    assert (cliente["anexos"], cliente["bytes_anexos"]) == (2, 5000 + len(base64.b64encode(legado)))
+    assert [a["bytes_armazenados"] for a in rel["maiores_anexos"]] == [5000, len(base64.b64encode(legado))]
+    assert rel["auto_vacuum"] == "INCREMENTAL"
+    assert "anexos" in {t["tabela"] for t in rel["por_tabela"]}
@@ -0,0 +1,51 @@
+import busca
+
+
+def _titulos(estudos):
+    return {e["titulo"] for e in estudos}
+
+
+def test_prefixo_sem_acentos_em_qualquer_campo(core):
+    cid = core.criar_cliente("Padaria São João")
+    core.criar_estudo(cid, "Crédito presumido de ICMS", "apuração mensal", "icms, crédito")
+    core.criar_estudo(cid, "Exclusão do ISS", "base de cálculo do PIS", "pis")
+
+    assert _titulos(core.buscar_estudos("cred pres")) == {"Crédito presumido de ICMS"}
+    assert _titulos(core.buscar_estudos("CALC")) == {"Exclusão do ISS"}
+    assert _titulos(core.buscar_estudos("joao")) == {"Crédito presumido de ICMS", "Exclusão do ISS"}
+    assert core.buscar_estudos("crédito iss") == []
+    # aspas e operadores do FTS5 no que o usuário digita não quebram a consulta
+    assert busca.consulta_prefixo('icms" OR -pis') == '"icms"* "OR"* "pis"*'
+    assert _titulos(core.buscar_estudos('icms" (')) == {"Crédito presumido de ICMS"}
+
+
+def test_indice_acompanha_alteracoes(core):
+    cid = core.criar_cliente("Comercial Alfa")
+    eid = core.criar_estudo(cid, "Recuperação de PIS", "resumo", "pis")
+    core.atualizar_estudo(eid, "Recuperação de COFINS", "resumo", "cofins")
+    assert core.buscar_estudos("pis") == []
+    assert _titulos(core.buscar_estudos("cofins")) == {"Recuperação de COFINS"}
+
+    conn = core.get_conn()
+    conn.execute("UPDATE clientes SET nome='Comercial Beta' WHERE id=?", (cid,))
+    conn.commit()
+    conn.close()
+    assert core.buscar_estudos("alfa") == []
+    assert _titulos(core.buscar_estudos("beta")) == {"Recuperação de COFINS"}
+
+    core.excluir_estudo(eid)
+    assert core.buscar_estudos("cofins") == []
+
+
+def test_cache_vale_ate_a_versao_mudar(core):
+    cid = core.criar_cliente("Cliente")
+    core.criar_estudo(cid, "Estudo de ICMS", "resumo")
+    busca.cache.limpar()
+    acertos = busca.cache.acertos
+
+    assert len(core.buscar_estudos("icms", core.versao_db())) == 1
+    assert len(core.buscar_estudos("icms", core.versao_db())) == 1
+    assert busca.cache.acertos == acertos + 1
+
+    core.criar_estudo(cid, "Outro de ICMS", "resumo")
+    assert len(core.buscar_estudos("icms", core.versao_db())) == 2
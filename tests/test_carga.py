@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+
+import carga
+
+
+def _args(**kw):
+    padrao = dict(semente=7, clientes=3, estudos=8, anexos=12, tamanho_kb=4, acoes=15, pausa_ms=0, workers=2)
+    return SimpleNamespace(**{**padrao, **kw})
+
+
+def test_percentil():
+    v = list(range(1, 101))
+    assert (carga.percentil(v, 0.5), carga.percentil(v, 0.95), carga.percentil(v, 0.99)) == (51, 96, 100)
+    assert carga.percentil([], 0.95) == 0.0
+
+
+def test_resumir_separa_erros_de_lock():
+    resultados = [
+        {"inicio": 10.0, "fim": 12.0, "medidas": [("busca", 5.0, None), ("busca", 15.0, None),
+                                                   ("upload", 40.0, "OperationalError: database is locked")]},
+        {"inicio": 10.5, "fim": 11.0, "medidas": [("download", 8.0, "HTTP 404: nada")]},
+    ]
+    r = carga.resumir(2, resultados, {"falhas": ["sessão 1: processo morreu"], "rss_pico_kb": 1})
+    assert (r["acoes"], r["duracao_s"], r["vazao_acoes_s"]) == (4, 2.0, 2.0)
+    assert (r["erros"], r["erros_lock"]) == (3, 1)
+    assert r["por_acao"]["busca"] == {"n": 2, "p50": 15.0, "p95": 15.0, "p99": 15.0, "erros": 0}
+    assert r["por_acao"]["upload"]["erros"] == 1
+    assert r["exemplos_erro"][0] == "sessão 1: processo morreu"
+
+
+def test_sessao_segue_depois_de_uma_acao_com_erro():
+    amostra = {"estudos": [(1, 1)], "anexos": [None], "termos": ["icms"]}
+
+    def pagina(acao):
+        if acao == "busca":
+            raise RuntimeError("falhou")
+
+    s = carga.Sessao(0, "api", amostra, 30, 0, semente=3)
+    s._upload = s._criar_estudo = lambda: None
+    s.executar(pagina)
+    assert len(s.medidas) == 30
+    assert {e for a, _, e in s.medidas if a == "busca"} == {"RuntimeError: falhou"}
+    # mesma semente, mesma sequência de ações
+    outra = carga.Sessao(0, "api", amostra, 30, 0, semente=3)
+    outra._upload = outra._criar_estudo = lambda: None
+    outra.executar(lambda acao: None)
+    assert [a for a, _, _ in outra.medidas] == [a for a, _, _ in s.medidas]
+
+
+def test_rodada_api_contra_banco_gerado(core):
+    args = _args()
+    carga.gerar_banco(core, args)
+    amostra = carga.amostras(core, args.semente)
+    assert len(amostra["estudos"]) == args.estudos and len(amostra["anexos"]) == args.anexos
+
+    resultados, extra = carga.rodada_api(args, amostra, 2)
+    r = carga.resumir(2, resultados, extra)
+    assert r["acoes"] == 2 * args.acoes
+    assert r["erros"] == 0, r["exemplos_erro"]
+    assert extra["rss_pico_kb"] > 0
@@ -0,0 +1,39 @@
+import pytest
+
+
+def test_cnpj_unico_pelos_digitos(core):
+    core.criar_cliente("Primeira", "11.222.333/0001-81")
+    with pytest.raises(ValueError, match="Primeira"):
+        core.criar_cliente("Segunda", "11222333000181")
+    # sem CNPJ não há conflito
+    core.criar_cliente("Sem CNPJ A")
+    core.criar_cliente("Sem CNPJ B", "")
+    assert core.stats()["clientes"] == 3
+
+
+def test_cadastros_antigos_repetidos_ficam_sem_indice(core):
+    conn = core.get_conn()
+    conn.execute("DROP INDEX idx_clientes_cnpj")
+    for nome in ("Antigo", "Duplicado"):
+        conn.execute("INSERT INTO clientes (nome, cnpj) VALUES (?, '11.222.333/0001-81')", (nome,))
+    conn.commit()
+    conn.close()
+    core._esquemas_prontos.clear()
+    core.init_db()
+
+    conn = core.get_conn()
+    r = dict(conn.execute("SELECT nome, cnpj_digitos FROM clientes").fetchall())
+    conn.close()
+    assert r == {"Antigo": "11222333000181", "Duplicado": None}
+
+
+def test_autocomplete_por_nome_e_por_cnpj(core):
+    core.criar_cliente("Ótica Central", "11.222.333/0001-81")
+    core.criar_cliente("Oficina do Zé", "44.555.666/0001-99")
+    core.criar_cliente("Padaria", "11.999.000/0001-00")
+
+    assert [c["nome"] for c in core.buscar_clientes("ot")] == ["Ótica Central"]
+    assert [c["nome"] for c in core.buscar_clientes("O")] == ["Oficina do Zé", "Ótica Central"]
+    assert [c["nome"] for c in core.buscar_clientes("11.")] == ["Ótica Central", "Padaria"]
+    assert [c["nome"] for c in core.buscar_clientes("11.9")] == ["Padaria"]
+    assert [c["nome"] for c in core.buscar_clientes("o", limite=1, offset=1)] == ["Ótica Central"]
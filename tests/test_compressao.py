@@ -0,0 +1,180 @@
+import base64
+import hashlib
+import io
+import os
+import random
+import zipfile
+import zlib
+
+import pytest
+
+import compressao
+
+BLOCO = 64 * 1024
+
+
+def _texto(n, semente=1):
+    rnd = random.Random(semente)
+    palavras = "icms pis cofins iss ipi crédito presumido diferimento alíquota base cálculo".split()
+    return " ".join(rnd.choice(palavras) for _ in range(n)).encode()
+
+
+def _deflate(trechos, **kw):
+    """Comprime [(dados, ja_comprimido), ...]; devolve a saída de cada compress() e a do flush."""
+    comp = compressao.DeflateParalelo(bloco=BLOCO, **kw)
+    saidas = []
+    for dados, comprimido in trechos:
+        comp.marcar(comprimido)
+        for i in range(0, len(dados), 10_000):
+            saidas.append(comp.compress(dados[i:i + 10_000]))
+    return saidas, comp.flush()
+
+
+def test_ida_e_volta_com_trechos_huffman():
+    trechos = [(_texto(60_000), False), (os.urandom(300_000), True), (_texto(40_000, 2), False), (b"", True)]
+    saidas, final = _deflate(trechos, workers=4)
+    assert zlib.decompress(b"".join(saidas) + final, -15) == b"".join(d for d, _ in trechos)
+
+
+def test_blocos_usam_o_anterior_como_dicionario():
+    # 16 KB aleatórios repetidos: sem o dicionário, cada bloco de 64 KB recomeçaria do zero
+    trecho = os.urandom(16 * 1024)
+    dados = trecho * 40
+    saidas, final = _deflate([(dados, False)], workers=2)
+    fluxo = b"".join(saidas) + final
+    assert zlib.decompress(fluxo, -15) == dados
+    assert len(fluxo) < 2 * len(trecho)
+
+
+def test_saida_parcial_termina_em_sync_flush():
+    dados = _texto(200_000)
+    saidas, final = _deflate([(dados, False)], workers=1)
+    parcial = b"".join(saidas)
+    assert parcial
+    # cada bloco emitido fecha num Z_SYNC_FLUSH: o que já saiu descomprime sem o resto do fluxo
+    prefixo = zlib.decompressobj(-15).decompress(parcial)
+    assert len(prefixo) >= BLOCO and dados.startswith(prefixo)
+
+
+def test_flush_encerra_o_pool():
+    comp = compressao.DeflateParalelo(workers=2)
+    comp.compress(b"x" * 100)
+    comp.flush()
+    assert comp._pool._shutdown
+
+
+@pytest.mark.parametrize("em_arquivo", [False, True])
+def test_zip_fluxo_abre_no_zipfile(tmp_path, em_arquivo):
+    dados = _texto(50_000) + os.urandom(200_000) + _texto(50_000, 3)
+    destino = tmp_path / "backup.zip" if em_arquivo else io.BytesIO()
+    with compressao.ZipFluxo(destino, "backup.json", nivel=6, workers=3) as out:
+        out.write(dados[:100_000])
+        out.marcar(True)
+        out.write(dados[100_000:300_000])
+        out.marcar(False)
+        out.write(dados[300_000:])
+    fonte = destino if em_arquivo else io.BytesIO(destino.getvalue())
+    with zipfile.ZipFile(fonte) as zf:
+        assert zf.testzip() is None
+        (info,) = zf.infolist()
+        assert (info.filename, info.compress_type, info.file_size) == ("backup.json", zipfile.ZIP_DEFLATED, len(dados))
+        assert zf.read("backup.json") == dados
+
+
+def test_zip_fluxo_encerra_o_pool_quando_falha():
+    destino = io.BytesIO()
+    with pytest.raises(RuntimeError):
+        with compressao.ZipFluxo(destino, "backup.json") as out:
+            out.write(_texto(10_000))
+            raise RuntimeError("falha no meio do backup")
+    assert out.deflate._pool._shutdown
+    with pytest.raises(zipfile.BadZipFile):
+        zipfile.ZipFile(io.BytesIO(destino.getvalue()))
+
+
+# ---------- compressão em repouso ----------
+CODECS_FLUXO = [compressao.RAW, compressao.ZLIB, compressao.B64] + ([compressao.ZSTD] if compressao.zstandard else [])
+
+
+def _armazenar(codec, dados):
+    if codec == compressao.ZLIB:
+        return zlib.compress(dados)
+    if codec == compressao.ZSTD:
+        return compressao.zstandard.ZstdCompressor().compress(dados)
+    if codec == compressao.B64:
+        return base64.b64encode(dados)
+    return dados
+
+
+def test_codec_pelo_tipo_e_pela_amostra():
+    esperado = compressao.ZSTD if compressao.zstandard else compressao.ZLIB
+    assert compressao.comprimir(_texto(20_000), "text/plain", "a.txt")[0] == esperado
+    assert compressao.comprimir(_texto(20_000), "image/jpeg", "a.jpg")[0] == compressao.RAW
+    assert compressao.comprimir(_texto(20_000), None, "planilha.XLSX")[0] == compressao.RAW
+    assert compressao.comprimir(os.urandom(20_000), None, "a.bin")[0] == compressao.RAW
+    assert compressao.comprimir(b"a" * 100, "text/plain")[0] == compressao.RAW  # pequeno demais
+
+
+@pytest.mark.parametrize("codec", CODECS_FLUXO)
+@pytest.mark.parametrize("tamanho", [0, 1, 2, 3, 100_001])
+def test_ida_e_volta_por_codec(codec, tamanho):
+    dados = _texto(tamanho)[:tamanho]
+    payload = _armazenar(codec, dados)
+    assert compressao.descomprimir(codec, payload) == dados
+    blocos = (payload[i:i + 1000] for i in range(0, len(payload), 1000))
+    assert b"".join(compressao.iterar(codec, blocos)) == dados
+    assert compressao.tamanho_original(codec, io.BytesIO(payload), len(payload)) == len(dados)
+
+
+@pytest.mark.skipif(compressao.zstandard is None, reason="zstandard não instalado")
+def test_tamanho_de_zstd_sem_tamanho_no_cabecalho():
+    dados = _texto(30_000)
+    payload = compressao.zstandard.ZstdCompressor(write_content_size=False).compress(dados)
+    assert compressao.tamanho_original(compressao.ZSTD, io.BytesIO(payload), len(payload)) == len(dados)
+
+
+def test_anexos_em_cada_codec_leem_por_intervalo(core):
+    cid = core.criar_cliente("Cliente")
+    eid = core.criar_estudo(cid, "Estudo", "resumo")
+    texto, binario = _texto(50_000), os.urandom(50_000)
+    core.add_anexo(eid, "texto.txt", "text/plain", texto, len(texto))
+    core.add_anexo(eid, "foto.jpg", "image/jpeg", binario, len(binario))
+    conn = core.conn_estudo(eid)
+    conn.execute("INSERT INTO anexos (estudo_id, filename, file_type, file_data, file_size) VALUES (?, ?, ?, ?, ?)",
+                 (eid, "legado.txt", "text/plain", base64.b64encode(texto).decode(), len(texto)))
+    conn.commit()
+    codecs = dict(conn.execute("SELECT filename, codec FROM anexos").fetchall())
+    ids = dict(conn.execute("SELECT filename, id FROM anexos").fetchall())
+    conn.close()
+    assert codecs["foto.jpg"] == compressao.RAW and codecs["texto.txt"] != compressao.RAW and codecs["legado.txt"] is None
+
+    for nome, dados in (("texto.txt", texto), ("foto.jpg", binario), ("legado.txt", texto)):
+        aid = ids[nome]
+        assert core.ler_anexo(aid) == dados
+        for inicio, fim in ((0, 1), (1, 4), (12_345, 40_000), (49_999, 50_000)):
+            assert b"".join(core.iterar_anexo(aid, 4096, inicio, fim)) == dados[inicio:fim]
+
+
+def test_job_comprime_os_legados_sem_mudar_o_conteudo(core):
+    class Tarefa:
+        def progresso(self, pct, msg):
+            self.ultimo = (pct, msg)
+
+    cid = core.criar_cliente("Cliente")
+    eid = core.criar_estudo(cid, "Estudo", "resumo")
+    texto = _texto(30_000)
+    conn = core.conn_estudo(eid)
+    aid = conn.execute("INSERT INTO anexos (estudo_id, filename, file_type, file_data, file_size) VALUES (?, ?, ?, ?, ?)",
+                       (eid, "legado.txt", "text/plain", base64.b64encode(texto).decode(), len(texto))).lastrowid
+    conn.commit()
+    conn.close()
+
+    tarefa = Tarefa()
+    core.job_comprimir_anexos(tarefa)
+    assert tarefa.ultimo[0] == 100
+    conn = core.conn_anexo(aid)
+    r = conn.execute("SELECT codec, typeof(file_data), length(file_data), sha256 FROM anexos WHERE id=?", (aid,)).fetchone()
+    conn.close()
+    assert r[0] not in (None, compressao.B64, compressao.RAW) and r[1] == "blob" and r[2] < len(texto) / 2
+    assert core.ler_anexo(aid) == texto
+    assert r[3] == hashlib.sha256(texto).hexdigest()
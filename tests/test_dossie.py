@@ -0,0 +1,57 @@
+import os
+import zipfile
+
+import dossie
+
+
+def _cliente(core):
+    cid = core.criar_cliente("Cliente: A/B", "11.222.333/0001-81")
+    eid = core.criar_estudo(cid, "Estudo <1>", "**resumo**", "icms")
+    binario = os.urandom(300_000)
+    core.add_anexo(eid, "a.txt", "text/plain", b"texto " * 1000, 6000)
+    core.add_anexo(eid, "A.txt", "text/plain", b"outro", 5)
+    core.add_anexo(eid, "foto.jpg", "image/jpeg", binario, len(binario))
+    return cid, eid, binario
+
+
+def test_nomes_seguros_no_zip():
+    assert dossie.nome_arquivo('con:tra/to*.pdf') == "con-tra-to-.pdf"
+    assert dossie.nome_arquivo(" ..\x00.. ") == "sem-nome"
+    nomes = dossie._nomes_anexos([{"id": 1, "filename": "a.txt"}, {"id": 2, "filename": "A.TXT"}])
+    assert nomes == {1: "a.txt", 2: "2-A.TXT"}
+
+
+def test_dossie_traz_estudos_e_anexos(core):
+    cid, eid, binario = _cliente(core)
+    with zipfile.ZipFile(core.exportar_dossie(cid)) as zf:
+        assert zf.testzip() is None
+        pasta = f"dossie - Cliente- A-B/estudos/{eid:06d} - Estudo -1"
+        assert zf.read(f"{pasta}/anexos/a.txt") == b"texto " * 1000
+        assert zf.read(f"{pasta}/anexos/2-A.txt") == b"outro"
+        assert zf.read(f"{pasta}/anexos/foto.jpg") == binario
+        assert "icms" in zf.read(f"{pasta}/estudo.md").decode()
+        assert {"dossie - Cliente- A-B/README.md", "dossie - Cliente- A-B/index.html"} <= set(zf.namelist())
+    # exportar não conta como leitura dos anexos
+    conn = core.conn_cliente(cid)
+    assert conn.execute("SELECT COUNT(*) FROM anexos WHERE acessado_em IS NOT NULL").fetchone()[0] == 0
+    conn.close()
+
+
+def test_cache_reaproveita_ate_o_cliente_mudar(core):
+    cid, eid, _ = _cliente(core)
+    assert core.abrir_dossie(cid, gerar=False) is None
+    primeiro = core.exportar_dossie(cid)
+    mtime = primeiro.stat().st_mtime_ns
+    assert core.exportar_dossie(cid) == primeiro and primeiro.stat().st_mtime_ns == mtime
+    caminho, f = core.abrir_dossie(cid, gerar=False)
+    f.close()
+    assert caminho == primeiro
+
+    core.atualizar_estudo(eid, "Estudo revisto", "resumo", "icms")
+    assert core.dossie_em_cache(cid) is None
+    segundo = core.exportar_dossie(cid)
+    assert segundo != primeiro and not primeiro.exists()
+    assert list(core.DOSSIES_DIR.glob("*.tmp")) == []
+
+    core.excluir_cliente(cid)
+    assert not segundo.exists()
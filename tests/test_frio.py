@@ -0,0 +1,71 @@
+import base64
+import hashlib
+import os
+
+
+def _envelhecer(core, eid, dias=10):
+    conn = core.conn_estudo(eid)
+    conn.execute("UPDATE anexos SET created_at=datetime('now', ?)", (f"-{dias} days",))
+    conn.commit()
+    conn.close()
+
+
+def _local(core, aid):
+    conn = core.conn_anexo(aid)
+    r = conn.execute("SELECT pacote, length(file_data) AS tam, sha256 FROM anexos WHERE id=?", (aid,)).fetchone()
+    conn.close()
+    return r
+
+
+def _biblioteca(core):
+    cid = core.criar_cliente("Cliente")
+    eid = core.criar_estudo(cid, "Estudo", "resumo")
+    binario, texto = os.urandom(20_000), b"parecer sobre icms " * 2000
+    core.add_anexo(eid, "foto.jpg", "image/jpeg", binario, len(binario))
+    conn = core.conn_estudo(eid)
+    conn.execute("INSERT INTO anexos (estudo_id, filename, file_type, file_data, file_size) VALUES (?, ?, ?, ?, ?)",
+                 (eid, "legado.txt", "text/plain", base64.b64encode(texto).decode(), len(texto)))
+    conn.commit()
+    conn.close()
+    ids = {a["filename"]: a["id"] for a in core.listar_anexos(eid)}
+    return eid, {ids["foto.jpg"]: binario, ids["legado.txt"]: texto}
+
+
+def test_arquiva_e_le_do_pacote(core):
+    eid, conteudos = _biblioteca(core)
+    assert core.arquivar_anexos(5, 0)["anexos"] == 0  # ainda novos
+    _envelhecer(core, eid)
+    r = core.arquivar_anexos(5, 0)
+    assert r["anexos"] == 2 and core.PACOTES.listar()
+
+    for aid, dados in conteudos.items():
+        local = _local(core, aid)
+        assert local["pacote"] and local["tam"] == 0
+        assert local["sha256"] == hashlib.sha256(dados).hexdigest()
+        assert core.ler_anexo(aid, registrar=False) == dados
+        assert b"".join(core.iterar_anexo(aid, 1000, 5000, 15_000, registrar=False)) == dados[5000:15_000]
+    # o legado vai comprimido para o pacote
+    legado = max(conteudos, key=lambda aid: len(conteudos[aid]))
+    assert core.relatorio_armazenamento()["frio"]["bytes_pacotes"] < len(conteudos[legado])
+
+
+def test_leitura_repetida_promove_e_pacote_sem_uso_some(core):
+    eid, conteudos = _biblioteca(core)
+    _envelhecer(core, eid)
+    core.arquivar_anexos(5, 0)
+    aid, outro = list(conteudos)
+
+    for _ in range(3):
+        core.ler_anexo(aid, registrar=False)  # leituras em massa não contam
+    assert _local(core, aid)["pacote"]
+    core.ler_anexo(aid)
+    assert _local(core, aid)["pacote"]  # a primeira leitura só anota o acesso
+    assert core.ler_anexo(aid) == conteudos[aid]
+    assert not _local(core, aid)["pacote"] and _local(core, aid)["tam"] > 0
+    assert core.ler_anexo(aid) == conteudos[aid]
+
+    # lido agora: não esfria de novo enquanto estiver em uso
+    assert core.arquivar_anexos(5, 1)["anexos"] == 0
+    core.excluir_anexo(outro)
+    assert core.arquivar_anexos(5, 1)["pacotes_liberados"] > 0
+    assert core.PACOTES.listar() == []
@@ -0,0 +1,75 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import jobs
+
+
+def _esperar(runner, job_id, status=(jobs.CONCLUIDO, jobs.ERRO), limite=10):
+    fim = time.monotonic() + limite
+    while time.monotonic() < fim:
+        job = runner.obter(job_id)
+        if job["status"] in status:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"tarefa {job_id} ficou em {runner.obter(job_id)['status']}")
+
+
+def test_ciclo_de_vida(tmp_path):
+    runner = jobs.JobRunner(tmp_path / "jobs.db", tmp_path / "artefatos")
+
+    def gerar(job, texto):
+        job.progresso(50, "metade")
+        destino = job.artefato("saida.txt")
+        destino.write_text(texto)
+        return destino
+
+    def falhar(job):
+        raise RuntimeError("quebrou")
+
+    ok = _esperar(runner, runner.submeter("gerar", gerar, "olá"))
+    assert ok["status"] == jobs.CONCLUIDO and ok["progresso"] == 100
+    assert open(ok["artefato"], encoding="utf-8").read() == "olá"
+    erro = _esperar(runner, runner.submeter("falhar", falhar))
+    assert erro["status"] == jobs.ERRO and erro["erro"].startswith("quebrou")
+    assert runner.excluir(ok["id"]) and not os.path.exists(ok["artefato"])
+
+
+def test_pesadas_na_espera_nao_ocupam_threads_das_leves(tmp_path):
+    runner = jobs.JobRunner(tmp_path / "jobs.db", tmp_path / "artefatos", max_pesados=1, max_workers=2)
+    liberar = threading.Event()
+    pesadas = [runner.submeter("backup", lambda job: liberar.wait(10)) for _ in range(4)]
+    leve = runner.submeter("upload", lambda job: None, pesado=False)
+    try:
+        assert _esperar(runner, leve, limite=5)["status"] == jobs.CONCLUIDO
+        assert [runner.obter(i)["status"] for i in pesadas].count(jobs.EXECUTANDO) == 1
+    finally:
+        liberar.set()
+    for i in pesadas:
+        assert _esperar(runner, i)["status"] == jobs.CONCLUIDO
+
+
+def test_so_interrompe_tarefas_de_processos_encerrados(tmp_path):
+    banco = tmp_path / "jobs.db"
+    runner = jobs.JobRunner(banco, tmp_path / "artefatos")
+    morto = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"],
+                           capture_output=True, text=True).stdout.strip()
+    vivo = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    try:
+        conn = runner._conn()
+        conn.executemany("INSERT INTO jobs (tipo, status, pid) VALUES (?, ?, ?)", [
+            ("outro_processo", jobs.EXECUTANDO, vivo.pid),
+            ("processo_encerrado", jobs.EXECUTANDO, int(morto)),
+            ("sem_dono", jobs.FILA, None),
+        ])
+        conn.commit()
+        conn.close()
+        jobs.JobRunner(banco, tmp_path / "artefatos")  # segundo processo (ou reinício) abrindo o mesmo banco
+        status = {j["tipo"]: j["status"] for j in runner.listar()}
+    finally:
+        vivo.kill()
+        vivo.wait()
+    assert status == {"outro_processo": jobs.EXECUTANDO, "processo_encerrado": jobs.INTERROMPIDO,
+                      "sem_dono": jobs.INTERROMPIDO}
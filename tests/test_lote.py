@@ -0,0 +1,53 @@
+import pytest
+
+
+@pytest.fixture(params=["unico", "shards"])
+def biblioteca(core, request):
+    a, b = core.criar_cliente("Cliente A"), core.criar_cliente("Cliente B")
+    estudos = [core.criar_estudo(a, f"Estudo {i}", "resumo", "ICMS, pis") for i in range(4)]
+    for eid in estudos:
+        core.add_anexo(eid, f"{eid}.txt", "text/plain", f"conteúdo {eid} ".encode() * 100, 1200)
+    if request.param == "shards":
+        core.migrar_para_shards(core.DB_PATH, core.SHARDS.diretorio)
+        core.DB_PATH.unlink()
+    return core, a, b, estudos
+
+
+def _tags(core, eid):
+    return core.obter_estudo(eid)["tags"]
+
+
+def test_tags_sem_diferenciar_maiusculas(biblioteca):
+    core, _, _, estudos = biblioteca
+    core.atualizar_estudo(estudos[0], "Estudo 0", "resumo", "icms, Cofins")
+    n = core.alterar_tags_estudos(estudos[:3], adicionar=["cofins", " IPI ", ""], remover=["PIS"])
+    assert n == 3
+    assert _tags(core, estudos[0]) == "icms, Cofins, IPI"
+    assert _tags(core, estudos[1]) == "ICMS, cofins, IPI"
+    assert _tags(core, estudos[3]) == "ICMS, pis"
+    # nada muda: nenhuma linha é regravada
+    assert core.alterar_tags_estudos(estudos[:3], adicionar=["ipi"]) == 0
+
+
+def test_mover_leva_os_anexos(biblioteca):
+    core, a, b, estudos = biblioteca
+    assert core.mover_estudos(estudos[:2] + [999], b) == 2
+    assert core.mover_estudos(estudos[:1], b) == 0
+    assert {e["id"] for e in core.listar_estudos(b)} == set(estudos[:2])
+    assert {e["id"] for e in core.listar_estudos(a)} == set(estudos[2:])
+    for eid in estudos[:2]:
+        (anexo,) = core.listar_anexos(eid)
+        assert core.ler_anexo(anexo["id"]) == f"conteúdo {eid} ".encode() * 100
+        assert core.obter_estudo(eid)["cliente_id"] == b
+    assert [e["titulo"] for e in core.buscar_estudos("estudo 0")] == ["Estudo 0"]
+    with pytest.raises(ValueError):
+        core.mover_estudos(estudos, 999)
+
+
+def test_excluir_em_lote(biblioteca):
+    core, a, _, estudos = biblioteca
+    assert core.excluir_estudos([]) == 0
+    assert core.excluir_estudos(estudos[1:3] + [999]) == 2
+    assert {e["id"] for e in core.listar_estudos(a)} == {estudos[0], estudos[3]}
+    assert core.listar_anexos(estudos[1]) == []
+    assert core.stats() == {"clientes": 2, "estudos": 2, "anexos": 2}
@@ -0,0 +1,69 @@
+import threading
+
+import pytest
+
+import memoria
+
+MB = 1 << 20
+
+
+@pytest.fixture
+def perfil():
+    memoria.configurar(True)
+    memoria.limpar()
+    yield
+    memoria.configurar(False)
+    memoria.limpar()
+
+
+def _pico(escopo):
+    return next(r["pico"] for r in memoria.resumo() if r["escopo"] == escopo)
+
+
+def test_pico_sobrevive_a_reset_de_outra_thread(perfil):
+    alocou, mediu = threading.Event(), threading.Event()
+
+    def longa():
+        with memoria.medir("teste:longa"):
+            dados = bytearray(8 * MB)
+            del dados
+            alocou.set()
+            # outra thread abre (e zera o pico do tracemalloc) antes deste escopo fechar
+            mediu.wait(10)
+
+    def curta():
+        alocou.wait(10)
+        with memoria.medir("teste:curta"):
+            pass
+        mediu.set()
+
+    threads = [threading.Thread(target=longa), threading.Thread(target=curta)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert _pico("teste:longa") >= 8 * MB
+    assert _pico("teste:curta") < MB
+
+
+def test_escopo_externo_guarda_pico_do_interno(perfil):
+    with memoria.medir("teste:externo"):
+        with memoria.medir("teste:interno"):
+            dados = bytearray(4 * MB)
+            del dados
+        with memoria.medir("teste:vazio"):
+            pass
+
+    assert _pico("teste:interno") >= 4 * MB
+    assert _pico("teste:externo") >= 4 * MB
+    assert _pico("teste:vazio") < MB
+
+
+def test_raiz_descarta_escopos_nao_fechados(perfil):
+    memoria.abrir()
+    memoria.abrir()
+    quadro = memoria.abrir(raiz=True)
+    assert memoria._abertos == [quadro]
+    memoria.fechar(quadro, "teste:raiz")
+    assert memoria._abertos == []
@@ -0,0 +1,109 @@
+import io
+import os
+import zipfile
+
+import pytest
+
+import previa
+
+NS = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+NS_R = 'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"'
+
+
+def _blocos(dados, bloco=64 * 1024, lidos=None):
+    for i in range(0, len(dados), bloco):
+        if lidos is not None:
+            lidos.append(i)
+        yield dados[i:i + bloco]
+
+
+def _xlsx(linhas):
+    celulas = "".join(
+        f'<row r="{i + 1}"><c r="A{i + 1}" t="s"><v>0</v></c><c r="C{i + 1}"><v>{i}</v></c></row>'
+        for i in range(linhas)
+    )
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as z:
+        z.writestr("xl/workbook.xml", f'<workbook {NS} {NS_R}><sheets><sheet name="Apuração" r:id="rId1"/></sheets></workbook>')
+        z.writestr("xl/_rels/workbook.xml.rels",
+                   '<Relationships><Relationship Id="rId1" Target="worksheets/sheet1.xml"/></Relationships>')
+        z.writestr("xl/sharedStrings.xml", f"<sst {NS}><si><t>crédito</t></si></sst>")
+        z.writestr("xl/worksheets/sheet1.xml", f"<worksheet {NS}><sheetData>{celulas}</sheetData></worksheet>")
+    return buf.getvalue()
+
+
+def test_csv_le_so_o_comeco():
+    dados = "".join(f"{i};ICMS;{i * 10}\n" for i in range(500_000)).encode()
+    lidos = []
+    p = previa.gerar("apuracao.csv", "text/csv", _blocos(dados, lidos=lidos))
+    assert len(lidos) <= 2
+    (planilha,) = p["planilhas"]
+    assert planilha["cortada"] and len(planilha["linhas"]) == previa.LINHAS
+    assert planilha["linhas"][3] == ["3", "ICMS", "30"] and planilha["colunas"] == ["A", "B", "C"]
+
+
+def test_texto_cortado_no_meio_de_um_caractere():
+    dados = ("ação " * 30_000).encode()
+    p = previa.gerar("nota.txt", "text/plain", _blocos(dados, bloco=previa.AMOSTRA_TEXTO + 1))
+    assert p["tipo"] == "texto" and p["cortado"] and p["texto"].startswith("ação ação")
+    assert len(p["texto"]) == previa.CARACTERES
+
+
+def test_planilha_e_documento():
+    p = previa.gerar("apuracao.xlsx", None, _blocos(_xlsx(30)))
+    (planilha,) = p["planilhas"]
+    assert planilha["nome"] == "Apuração" and planilha["cortada"]
+    assert planilha["linhas"][2] == ["crédito", "", "2"]
+
+    buf = io.BytesIO()
+    w = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+    with zipfile.ZipFile(buf, "w") as z:
+        z.writestr("word/document.xml",
+                   f'<w:document {w}><w:body><w:p><w:r><w:t>Parecer</w:t></w:r></w:p>'
+                   '<w:p><w:r><w:br w:type="page"/><w:t>segunda página</w:t></w:r></w:p></w:body></w:document>')
+    p = previa.gerar("parecer.docx", None, _blocos(buf.getvalue()))
+    assert p == {"tipo": "texto", "texto": "Parecer", "cortado": True}
+
+
+def test_sem_previa():
+    assert previa.gerar("dados.bin", "application/octet-stream", iter(()))["tipo"] == "nenhuma"
+    assert previa.gerar("quebrado.xlsx", None, _blocos(b"nao e zip"))["tipo"] == "nenhuma"
+
+
+@pytest.mark.skipif(previa.Image is None, reason="Pillow não instalado")
+def test_miniatura():
+    buf = io.BytesIO()
+    previa.Image.new("RGB", (2000, 1000), "navy").save(buf, "JPEG")
+    p = previa.gerar("foto.jpg", "image/jpeg", _blocos(buf.getvalue()))
+    assert (p["tipo"], p["formato"], p["largura"], p["altura"]) == ("imagem", "jpeg", 480, 240)
+
+
+def test_cache_descarta_o_usado_ha_mais_tempo(tmp_path):
+    cache = previa.CachePrevias(tmp_path, limite=3500)  # cabem 3; passando, poda até 90%
+    for i, chave in enumerate("abc"):
+        cache.guardar(chave, {"texto": "x" * 900})
+        os.utime(cache._caminho(chave), (1000 + i, 1000 + i))
+    assert cache.obter("a") is not None  # renova o uso de "a"
+    cache.guardar("d", {"texto": "x" * 900})
+    assert [cache.obter(c) is not None for c in "abcd"] == [True, False, True, True]
+    assert cache.tamanho() <= 3500 * 0.9
+
+
+def test_previa_do_anexo_vem_do_cache(core, monkeypatch):
+    cid = core.criar_cliente("Cliente")
+    eid = core.criar_estudo(cid, "Estudo", "resumo")
+    conn = core.conn_estudo(eid)
+    # anexo legado: sem sha256, que sai da mesma leitura da prévia
+    aid = conn.execute("INSERT INTO anexos (estudo_id, filename, file_type, file_data) VALUES (?, ?, ?, ?)",
+                       (eid, "nota.txt", "text/plain", "b2zDoSwgbXVuZG8=")).lastrowid
+    conn.commit()
+    conn.close()
+
+    assert core.previa_anexo(aid)["texto"] == "olá, mundo"
+    info = core.obter_anexo_info(aid)
+    assert info["sha256"] and info["file_size"] == len("olá, mundo".encode())
+    monkeypatch.setattr(core, "iterar_anexo", lambda *a, **kw: pytest.fail("prévia deveria vir do cache"))
+    assert core.previa_anexo(aid)["texto"] == "olá, mundo"
+    conn = core.conn_anexo(aid)
+    assert conn.execute("SELECT acessado_em FROM anexos WHERE id=?", (aid,)).fetchone()[0] is None
+    conn.close()
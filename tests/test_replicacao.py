@@ -0,0 +1,49 @@
+import replicacao
+
+
+def _aplicar(core, tmp_path):
+    replica = tmp_path / "replica.db"
+    core.exportar_alteracoes(tmp_path / "segmentos")
+    replicacao.aplicar(replica, tmp_path / "segmentos", "teste", core.criar_esquema)
+    return core._conectar(replica)
+
+
+def _contagens(conn):
+    return {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in replicacao.TABELAS}
+
+
+def test_estudo_alterado_depois_do_anexo_nao_perde_o_anexo(core, tmp_path):
+    cid = core.criar_cliente("Cliente A")
+    eid = core.criar_estudo(cid, "Estudo", "resumo", "icms")
+    core.add_anexo(eid, "a.txt", "text/plain", b"conteudo", 8)
+    core.atualizar_estudo(eid, "Estudo revisto", "resumo", "icms")
+
+    replica = _aplicar(core, tmp_path)
+    assert _contagens(replica) == {"clientes": 1, "estudos": 1, "anexos": 1}
+    assert replica.execute("SELECT titulo FROM estudos").fetchone()[0] == "Estudo revisto"
+    replica.close()
+
+
+def test_ida_e_volta_com_exclusoes(core, tmp_path):
+    cid = core.criar_cliente("Cliente A")
+    outro = core.criar_cliente("Cliente B")
+    manter = core.criar_estudo(cid, "Fica", "r")
+    sair = core.criar_estudo(outro, "Sai", "r")
+    core.add_anexo(manter, "a.bin", "application/octet-stream", bytes(range(256)) * 40, 10240)
+    core.add_anexo(sair, "b.txt", "text/plain", b"x", 1)
+    replica = _aplicar(core, tmp_path)
+    assert _contagens(replica) == {"clientes": 2, "estudos": 2, "anexos": 2}
+    replica.close()
+
+    # a segunda rodada traz alteração no pai e exclusão do filho e do pai no mesmo segmento
+    core.add_anexo(manter, "c.txt", "text/plain", b"novo", 4)
+    core.atualizar_estudo(manter, "Fica (v2)", "r", None)
+    core.excluir_estudo(sair)
+    core.excluir_cliente(outro)
+    replica = _aplicar(core, tmp_path)
+    assert _contagens(replica) == {"clientes": 1, "estudos": 1, "anexos": 2}
+    primario = core.get_conn()
+    assert (sorted(tuple(r) for r in replica.execute("SELECT id, filename, file_data FROM anexos"))
+            == sorted(tuple(r) for r in primario.execute("SELECT id, filename, file_data FROM anexos")))
+    primario.close()
+    replica.close()
@@ -0,0 +1,80 @@
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def em_shards(core):
+    a, b = core.criar_cliente("Cliente A", "11.222.333/0001-81"), core.criar_cliente("Cliente B")
+    estudos = [core.criar_estudo(cid, f"Estudo {cid}", "resumo", "icms") for cid in (a, b, b)]
+    core.add_anexo(estudos[0], "a.txt", "text/plain", b"conteudo de a", 13)
+    assert core.migrar_para_shards(core.DB_PATH, core.SHARDS.diretorio) == 2
+    core.DB_PATH.unlink()
+    assert core.SHARDS.ativo()
+    return core, a, b, estudos
+
+
+def test_migracao_mantem_dados_e_ids(em_shards):
+    core, a, b, estudos = em_shards
+    assert core.SHARDS.caminho(a).exists() and core.SHARDS.caminho(b).exists()
+    assert {e["id"] for e in core.listar_estudos(b)} == set(estudos[1:])
+    (anexo,) = core.listar_anexos(estudos[0])
+    assert core.ler_anexo(anexo["id"]) == b"conteudo de a"
+    # ids novos continuam globais, depois dos que já existiam
+    assert core.criar_estudo(a, "Novo", "resumo") > max(estudos)
+    assert core.stats() == {"clientes": 2, "estudos": 4, "anexos": 1}
+
+
+def test_espera_a_troca_sem_segurar_o_lock(em_shards):
+    core = em_shards[0]
+    core.SHARDS.marca_troca.touch()
+    abertas = []
+    t = threading.Thread(target=lambda: abertas.append(core.get_conn()))
+    t.start()
+    try:
+        time.sleep(0.1)
+        assert not abertas
+        # quem espera a marca sumir não bloqueia o lock usado pela própria troca
+        assert core._troca_shards.acquire(timeout=1)
+        core._troca_shards.release()
+        with pytest.raises(RuntimeError):
+            core.SHARDS.ativo(espera=0.05)
+    finally:
+        core.SHARDS.marca_troca.unlink()
+    t.join(5)
+    abertas[0].close()
+    assert not core.DB_PATH.exists()
+
+
+def test_troca_espera_as_conexoes_abertas(em_shards):
+    core, a, _, _ = em_shards
+    conn = core.conn_cliente(a)
+    fechou = []
+
+    def fechar():
+        time.sleep(0.2)
+        fechou.append(time.monotonic())
+        conn.close()
+
+    threading.Thread(target=fechar).start()
+    core._drenar_shards(espera=5)
+    assert fechou and not [c for c in core._abertas if c.caminho.parent == core.SHARDS.diretorio]
+
+
+def test_restaurar_cancela_a_troca_com_conexao_presa(em_shards, monkeypatch):
+    core, a, b, _ = em_shards
+    backup = core.backup()
+    core.criar_estudo(b, "Depois do backup", "resumo")
+    presa = core.conn_cliente(a)
+    drenar = core._drenar_shards
+    monkeypatch.setattr(core, "_drenar_shards", lambda: drenar(espera=0.1))
+    ok, msg = core.restaurar(backup)
+    assert not ok and "em uso" in msg
+    assert not core.SHARDS.marca_troca.exists()
+    assert "Depois do backup" in {e["titulo"] for e in core.listar_estudos(b)}
+
+    presa.close()
+    backup.seek(0)
+    assert core.restaurar(backup) == (True, "Restaurado!")
+    assert "Depois do backup" not in {e["titulo"] for e in core.listar_estudos(b)}
@@ -0,0 +1,45 @@
+import os
+
+
+def _anexo(core, eid, dados):
+    core.add_anexo(eid, "dados.bin", "application/octet-stream", dados, len(dados))
+    return core.listar_anexos(eid, 1)[0]["id"]
+
+
+def test_versao_so_muda_com_escrita_de_conteudo(core):
+    cid = core.criar_cliente("Cliente")
+    eid = core.criar_estudo(cid, "Estudo", "resumo", "icms")
+    aid = _anexo(core, eid, os.urandom(1000))
+    antes = core.versao_db()
+
+    # leitura (registra acesso), hash preenchido depois e manutenção
+    core.ler_anexo(aid)
+    conn = core.conn_anexo(aid)
+    conn.execute("UPDATE anexos SET sha256=NULL, file_size=NULL WHERE id=?", (aid,))
+    conn.commit()
+    conn.close()
+    core.hash_anexo(aid)
+    core.compactar_banco()
+    assert core.versao_db() == antes
+
+    core.atualizar_estudo(eid, "Estudo revisto", "resumo", "icms")
+    depois = core.versao_db()
+    assert depois != antes
+    core.excluir_anexo(aid)
+    assert core.versao_db() != depois
+
+
+def test_versao_no_modo_shards(core):
+    cid = core.criar_cliente("Cliente")
+    eid = core.criar_estudo(cid, "Estudo", "resumo", "icms")
+    core.migrar_para_shards(core.DB_PATH, core.SHARDS.diretorio)
+    assert core.SHARDS.ativo()
+    aid = _anexo(core, eid, os.urandom(1000))
+    antes = core.versao_db()
+
+    # o acesso grava no shard (muda o arquivo no disco), mas não o conteúdo
+    core.ler_anexo(aid)
+    assert core.versao_db() == antes
+
+    core.atualizar_estudo(eid, "Estudo revisto", "resumo", "icms")
+    assert core.versao_db() != antes